@@ -5,12 +5,17 @@ Created on Fri Jan 22 15:57:01 2021
 @author: Dillo
 """
 
-import os
 import json
-import pickle
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
-import praw
+
+from payload import load_payload, delete_payload
+from post_record import records_from_columns
+from reddit_session import get_session_if_cold
+from staging_files import write_staging_file, record_manifest_entry
 
 
 def fetch_gilds(event, context):
@@ -22,7 +27,11 @@ def fetch_gilds(event, context):
     #working_directory = inputs_dict['working_directory']
     auth_filename = inputs_dict['auth_filename']
     staging_directory = inputs_dict['staging_directory']
-    all_features = inputs_dict['all_features']
+    features_payload = inputs_dict['all_features']
+    all_features = records_from_columns(load_payload(features_payload))
+    max_workers = inputs_dict.get('max_workers', 4)
+    staging_format = inputs_dict.get('staging_format', 'pickle')
+    manifest_directory = inputs_dict.get('manifest_directory')
     
     """ 
     Set up call to AWS S3 bucket that contains the file for Reddit API 
@@ -55,32 +64,40 @@ def fetch_gilds(event, context):
     # Pull Reddit API keys from file
     auth = get_auth(auth_file)
     
-    # Instantiate a Reddit API call header
-    reddit = praw.Reddit(client_id = auth.client_id,
-                         client_secret = auth.client_secret,
-                         user_agent = auth.user_agent,
-                         )    
+    # Re-use the API session (connections and OAuth token) if Lambda is warm
+    session = get_session_if_cold(auth, pool_size = max_workers)
     
     # Get IDs of all Reddit posts
     IDs = list(all_features.keys())
     
-    # Build list of fullnames and get data for all - will automatically call
-    #   Reddit API in batches to optimize speed.
-    fullname_list = ['t3_' + ID for ID in IDs]
-    posts = reddit.info(fullname_list) 
-
-    # Iterate over Reddit posts and extract Gilds data    
-    new_data = get_gilds_and_upvotes(posts)
+    # Get data for all posts, calling the Reddit API concurrently in batches of
+    #   100 and extracting gilds data from each batch as it arrives.
+    new_data = fetch_all_gilds_and_upvotes(session, IDs, max_workers)
  
     # Add gilding data to submissions data
-    data_with_gilds = all_features.copy()
-    for ID in data_with_gilds:
-        data_with_gilds[ID].update(new_data[ID])
+    data_with_gilds = add_gilds(all_features, new_data)
+    print('Gilding data for {} of {} posts, {} missing from the API skipped'
+          .format(len(data_with_gilds),
+                  len(all_features),
+                  len(all_features) - len(data_with_gilds),
+                 )
+         )
     
-    # Save all features to s3 bucket.
-    gilded_data_fpath = os.path.join(staging_directory, 'gilded_data_' + fname)
-    gilded_data_obj = pickle.dumps(data_with_gilds)
-    s3.Object(bucket_name, gilded_data_fpath).put(Body = gilded_data_obj)     
+    if len(data_with_gilds) > 0:
+        # Save all features to s3 bucket, as a compressed columnar file
+        staging_key = write_staging_file(data_with_gilds,
+                                         bucket_name,
+                                         staging_directory,
+                                         fname,
+                                         staging_format,
+                                         )
+        
+        # Let the database loader know there is a new file to load
+        if manifest_directory is not None:
+            record_manifest_entry(bucket_name, manifest_directory, staging_key)
+    
+    # The features payload has been used, and the staged file is saved
+    delete_payload(features_payload)
     
     return {
             'statusCode': 200,
@@ -89,10 +106,161 @@ def fetch_gilds(event, context):
 
 
 
+def fetch_all_gilds_and_upvotes(session, IDs, max_workers = 4, 
+                                batch_size = 100,
+                                base_url = 'https://oauth.reddit.com/',
+                                ):
+    """
+    Retrieve the current state of many posts. The IDs are split in to batches
+    of 100 (the most the API accepts per call), the batches are requested
+    concurrently while sharing the session's rate limit, and the results of
+    each batch are processed as soon as it arrives.
+
+    Parameters
+    ----------
+    session : RedditSession
+        Authenticated session for making calls to the Reddit API.
+    IDs : list
+        List of strings, the IDs of the posts to be retrieved.
+    max_workers : int, optional
+        The maximum number of batches requested at once. The default is 4.
+    batch_size : int, optional
+        The number of posts requested per call, at most 100. The default is
+        100.
+    base_url : str, optional
+        The root url of the API. The default is 'https://oauth.reddit.com/'.
+
+    Returns
+    -------
+    new_data : dict
+        Keys are post ID, values are dictionaries of gilding data (see 
+        get_gilds_and_upvotes).
+
+    """
+    
+    batches = [IDs[k:k + batch_size] for k in range(0, len(IDs), batch_size)]
+    
+    new_data = {}
+    latencies = []
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = [executor.submit(get_posts_info, session, batch, base_url)
+                   for batch in batches
+                  ]
+        for future in as_completed(futures):
+            posts, latency = future.result()
+            new_data.update(get_gilds_and_upvotes(posts))
+            latencies.append(latency)
+    
+    print(latency_summary(latencies))
+    
+    return new_data
+
+
+
+
+def latency_summary(latencies):
+    """
+    Summarise the time taken by each api/info call, one line for all batches.
+
+    Parameters
+    ----------
+    latencies : list
+        List of floats, the time taken for each call in seconds.
+
+    Returns
+    -------
+    str
+        The number of calls and their minimum, median and maximum latency.
+
+    """
+    
+    if len(latencies) == 0:
+        return 'api/info: no batches requested'
+    
+    return ('api/info: {} batches, latency min {:.2f}s, median {:.2f}s, '
+            'max {:.2f}s'.format(len(latencies),
+                                 min(latencies),
+                                 statistics.median(latencies),
+                                 max(latencies),
+                                ))
+
+
+
+
+def add_gilds(all_features, new_data):
+    """
+    Add the final gilding data to the features of each post. Posts which have
+    since been deleted or removed may be missing from the API's response,
+    these have no final gilding data and are left out.
+
+    Parameters
+    ----------
+    all_features : dict
+        Keys are post ID, values are PostRecords.
+    new_data : dict
+        Keys are post ID, values are dictionaries of gilding data, see
+        fetch_all_gilds_and_upvotes.
+
+    Returns
+    -------
+    data_with_gilds : dict
+        Keys are post ID, values are the updated PostRecords.
+
+    """
+    
+    data_with_gilds = {}
+    for ID, record in all_features.items():
+        if ID in new_data:
+            record.update(new_data[ID])
+            data_with_gilds[ID] = record
+    
+    return data_with_gilds
+
+
+
+
+def get_posts_info(session, IDs, base_url = 'https://oauth.reddit.com/'):
+    """
+    Retrieve the data of up to 100 posts in a single API call.
+
+    Parameters
+    ----------
+    session : RedditSession
+        Authenticated session for making calls to the Reddit API.
+    IDs : list
+        List of strings, the IDs of the posts to be retrieved.
+    base_url : str, optional
+        The root url of the API. The default is 'https://oauth.reddit.com/'.
+
+    Returns
+    -------
+    posts : list
+        List of dictionaries, the data of each post returned by the API.
+        Posts which have been deleted or removed may be missing.
+    latency : float
+        The time taken for the call, in seconds.
+
+    """
+    
+    start = time.monotonic()
+    
+    fullnames = ['t3_' + ID for ID in IDs]
+    listing = session.get(base_url + 'api/info.json',
+                          params = {'id': ','.join(fullnames),
+                                    'limit': len(fullnames),
+                                   },
+                         )
+    posts = [post['data'] for post in listing['data']['children']]
+    
+    return posts, time.monotonic() - start
+
+
+
+
 def get_gilds_and_upvotes(posts):
     new_data = {}
     for post in posts:      
-        post_gilds = post.gildings      
+        post_gilds = post['gildings']
         try:
             silvers = post_gilds['gid_1']
         except KeyError:
@@ -106,13 +274,13 @@ def get_gilds_and_upvotes(posts):
         except KeyError:
             platinums = 0
         
-        new_data[post.id] = {}
-        new_data[post.id]['Silver awarded'] = silvers
-        new_data[post.id]['Gold awarded'] = golds
-        new_data[post.id]['Platinum awarded'] = platinums
+        new_data[post['id']] = {}
+        new_data[post['id']]['Silver awarded'] = silvers
+        new_data[post['id']]['Gold awarded'] = golds
+        new_data[post['id']]['Platinum awarded'] = platinums
         
-        new_data[post.id]['Final upvotes'] = post.ups
-        new_data[post.id]['Final num comments'] = post.num_comments
+        new_data[post['id']]['Final upvotes'] = post['ups']
+        new_data[post['id']]['Final num comments'] = post['num_comments']
     
     return new_data
 
@@ -136,7 +304,7 @@ class get_auth:
     """
 
     def __init__(self, reddit_auth_file):
-        lines = reddit_auth_file['Body'].read().decode('utf-8').split('\r')
+        lines = reddit_auth_file['Body'].read().decode('utf-8').splitlines()
         #lines = open(reddit_auth_file, "r") # When passing a filepath
         for line in lines:
             if len(line.split('=')) < 2:
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import os
+
+import boto3
+
+
+
+
+def dump_payload(columns, bucket_name, working_directory, fname,
+                 max_inline_bytes = 200*1024
+                 ):
+    """
+    Prepare a set of feature columns (see records_to_columns) to be passed to
+    the next stage of the step function. Small payloads are passed inline, in
+    the body of the response. AWS limits the data passed between states to
+    256 KB, so larger payloads are compressed and saved to the s3 bucket and
+    only a reference to the saved file is passed on. Saved payloads should be
+    removed with delete_payload once the next stage has used them.
+    
+    The response body is itself a JSON string, so an inline payload is
+    encoded twice and every quote in it is escaped; the size checked is that
+    of the twice-encoded payload.
+
+    Parameters
+    ----------
+    columns : dict
+        The feature columns to be passed on.
+    bucket_name : str
+        The name of the AWS s3 bucket where large payloads are saved.
+    working_directory : str
+        The directory within the bucket where large payloads are saved.
+    fname : str
+        Unique string used to build filename.
+    max_inline_bytes : int, default=200*1024
+        The size of the largest payload to be passed inline (once encoded in
+        the response body), leaving some space for the rest of the response.
+
+    Returns
+    -------
+    payload : dict
+        Either the columns themselves or a dictionary with the keys
+        's3_bucket' and 's3_key' locating the saved columns.
+
+    """
+
+    columns_json = json.dumps(columns)
+    # json.dumps escapes any non-ASCII character, so length is size in bytes
+    if len(json.dumps(columns_json)) <= max_inline_bytes:
+        return columns
+
+    payload_key = os.path.join(working_directory, fname + '.json.gz')
+    (boto3.resource('s3')
+          .Object(bucket_name, payload_key)
+          .put(Body = gzip.compress(columns_json.encode('utf-8')))
+          )
+    print('Payload of {} bytes saved to {}'.format(len(columns_json),
+                                                    payload_key
+                                                   ))
+
+    return {'s3_bucket': bucket_name, 's3_key': payload_key}
+
+
+
+
+def load_payload(payload):
+    """
+    Inverse of dump_payload, retrieve the feature columns whether they were
+    passed inline or by reference.
+
+    Parameters
+    ----------
+    payload : dict
+        As returned by dump_payload.
+
+    Returns
+    -------
+    columns : dict
+        The feature columns.
+
+    """
+
+    if 's3_key' not in payload:
+        return payload
+
+    payload_obj = (boto3.resource('s3')
+                        .Object(payload['s3_bucket'], payload['s3_key'])
+                        .get()
+                  )
+    columns_json = gzip.decompress(payload_obj['Body'].read())
+
+    return json.loads(columns_json)
+
+
+
+
+def delete_payload(payload):
+    """
+    Remove a payload saved to the s3 bucket by dump_payload, once it is no
+    longer needed. Payloads passed inline are left alone.
+
+    Parameters
+    ----------
+    payload : dict
+        As returned by dump_payload.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    if 's3_key' not in payload:
+        return None
+
+    (boto3.resource('s3')
+          .Object(payload['s3_bucket'], payload['s3_key'])
+          .delete()
+          )
+
+    return None
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+"""
+All features collected for a Reddit post, in the order they are added by the
+stages of the Get Data step function: post features (pull_posts), comment
+features (retrieve_comments), then gilding features (fetch_gilds).
+"""
+feature_names = ['Title', 'Author', 'ID', 'Gilded', 'Gildings', 'Upvotes',
+                 'Upvote ratio', 'Post time', 'Views', 'Discussion type',
+                 'Distinguished', 'Contest mode', 'Content categories',
+                 'Edited', 'Hidden', 'Crosspostable', 'Crossposts', 'Meta',
+                 'OC', 'Reddit media', 'Robot indexable', 'Selfpost', 'Video',
+                 'Likes', 'Comments', 'Adult content', 'Subreddit',
+                 'Created utc', 'Post age', 'Upvote rate', 'Comment rate',
+                 'avg_up_rate', 'std_up_rate', 'gild_rate',
+                 'distinguished_rate', 'op_comment_rate', 'premium_auth_rate',
+                 'Silver awarded', 'Gold awarded', 'Platinum awarded',
+                 'Final upvotes', 'Final num comments',
+                ]
+
+
+
+
+def attribute_name(feature_name):
+    """
+    Convert a feature name to the name of the PostRecord attribute holding it,
+    multi-word names are joined with underscores (as in the SQL table).
+
+    Parameters
+    ----------
+    feature_name : str
+        The human-readable feature name, e.g. 'Upvote ratio'.
+
+    Returns
+    -------
+    str
+        The attribute name, e.g. 'Upvote_ratio'.
+
+    """
+
+    return '_'.join(feature_name.split())
+
+
+
+
+attribute_names = {feature_name: attribute_name(feature_name)
+                   for feature_name in feature_names
+                  }
+
+
+
+
+class PostRecord:
+    """
+    The features of a single Reddit post. Features are stored in slots rather
+    than a per-post dictionary, but may still be read and written using their
+    human-readable names, e.g. record['Upvote ratio']. Features which have not
+    yet been collected are simply unset.
+    """
+
+    __slots__ = tuple(attribute_names.values())
+
+
+
+
+    @classmethod
+    def from_dict(cls, features):
+        """
+        Build a record from a dictionary of features.
+
+        Parameters
+        ----------
+        features : dict
+            Keys are feature names (see feature_names), values are the
+            feature values.
+
+        Returns
+        -------
+        record : PostRecord
+            The record holding these features.
+
+        """
+
+        record = cls()
+        record.update(features)
+
+        return record
+
+
+
+
+    def __getitem__(self, feature_name):
+        try:
+            return getattr(self, attribute_names[feature_name])
+        except AttributeError:
+            raise KeyError(feature_name)
+
+
+
+
+    def __setitem__(self, feature_name, value):
+        setattr(self, attribute_names[feature_name], value)
+
+
+
+
+    def update(self, features):
+        """
+        Set many features at once, in the same manner as dict.update.
+
+        Parameters
+        ----------
+        features : dict
+            Keys are feature names, values are the feature values.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for feature_name, value in features.items():
+            setattr(self, attribute_names[feature_name], value)
+
+
+
+
+    def to_dict(self):
+        """
+        Convert the record back to a dictionary, containing only those features
+        which have been set.
+
+        Returns
+        -------
+        features : dict
+            Keys are feature names, values are the feature values.
+
+        """
+
+        features = {}
+        for feature_name, attr in attribute_names.items():
+            try:
+                features[feature_name] = getattr(self, attr)
+            except AttributeError:
+                pass
+
+        return features
+
+
+
+
+def records_to_columns(records):
+    """
+    Serialize a set of records column-by-column: each feature name appears
+    once, followed by the values of that feature for every post. Used as the
+    JSON payload passed between stages of the step function.
+
+    Parameters
+    ----------
+    records : dict
+        Keys are post ID, values are PostRecords. Every record is expected to
+        hold the same set of features.
+
+    Returns
+    -------
+    columns : dict
+        'features' is the list of feature names, 'values' is a list holding
+        one list of values per feature (in the same order).
+
+    """
+
+    if len(records) == 0:
+        return {'features': [], 'values': []}
+
+    # The features present are those set on the first record
+    first_record = next(iter(records.values()))
+    names = [feature_name for feature_name in feature_names
+             if hasattr(first_record, attribute_names[feature_name])
+            ]
+
+    values = []
+    for feature_name in names:
+        attr = attribute_names[feature_name]
+        values.append([getattr(record, attr, None)
+                       for record in records.values()
+                      ])
+
+    return {'features': names, 'values': values}
+
+
+
+
+def features_to_columns(posts):
+    """
+    Build the same columns as records_to_columns directly from a stream of
+    posts, appending each post's features to the columns as it arrives so
+    that no per-post dictionary or record is kept.
+
+    Parameters
+    ----------
+    posts : iterable
+        Pairs of post ID and a dictionary of that post's features, e.g. as
+        yielded by submission_features. Every post is expected to hold the
+        same set of features, repeated IDs are skipped.
+
+    Returns
+    -------
+    columns : dict
+        'features' is the list of feature names, 'values' is a list holding
+        one list of values per feature (in the same order).
+
+    """
+
+    names = []
+    values = []
+    seen_IDs = set()
+    for ID, features in posts:
+        if ID in seen_IDs:
+            continue
+        if not seen_IDs:
+            # The features present are those of the first post
+            names = [feature_name for feature_name in feature_names
+                     if feature_name in features
+                    ]
+            values = [[] for _ in names]
+        seen_IDs.add(ID)
+
+        for feature_name, column in zip(names, values):
+            column.append(features.get(feature_name))
+
+    return {'features': names, 'values': values}
+
+
+
+
+def records_from_columns(columns):
+    """
+    Inverse of records_to_columns.
+
+    Parameters
+    ----------
+    columns : dict
+        'features' is the list of feature names, 'values' is a list holding
+        one list of values per feature.
+
+    Returns
+    -------
+    records : dict
+        Keys are post ID, values are PostRecords.
+
+    """
+
+    attrs = [attribute_names[feature_name]
+             for feature_name in columns['features']
+            ]
+
+    records = {}
+    for post_values in zip(*columns['values']):
+        record = PostRecord()
+        for attr, value in zip(attrs, post_values):
+            setattr(record, attr, value)
+        records[record.ID] = record
+
+    return records
@@ -13,6 +13,9 @@ import json
 import praw
 import boto3
 
+from payload import dump_payload
+from post_record import features_to_columns
+
 
 def pull_posts(event, context):
     
@@ -64,19 +67,24 @@ def pull_posts(event, context):
     subreddits_filename : str
         The filename (including extension) where the list of subreddits to be
         included is stored. See subreddits.txt
-    working_directory : str 
+    working_directory : str, optional
         The name of the directory within the AWS s3 bucket where intermediate
-        data will be stored for processing.
+        data will be stored for processing. If not set then 'working' is used.
     staging_directory: str
         The name of the directory within the AWS s3 bucket where data will be
         stored after gilds have been fetched, before appending in batches to 
         the database.
+    manifest_directory: str, optional
+        The name of the directory within the AWS s3 bucket where each staged
+        file is recorded for the database loader. If not set then no manifest
+        is kept, and the loader lists the staging directory instead.
     """
     bucket_name = os.environ['bucket_name']
     auth_filename = os.environ['auth_filename']
     subreddits_filename = os.environ['subreddits_filename']
-    #working_directory = os.environ['working_directory']
+    working_directory = os.environ.get('working_directory', 'working')
     staging_directory = os.environ['staging_directory']
+    manifest_directory = os.environ.get('manifest_directory')
     
     
     
@@ -114,13 +122,6 @@ def pull_posts(event, context):
     subreddit_instance = getattr(reddit.subreddit(reddit_subs_to_pull),
                                  how
                                 )(limit = num_posts)
-        
-    # Put all submissions in to a list, this forces the API call    
-    submissions = []
-    submissions_IDs = []
-    for subm in subreddit_instance:
-        submissions.append(subm)
-        submissions_IDs.append([subm.id, str(subm.subreddit)])
     
     # Save list of Reddit submissions to disc
     fname = build_working_filename(how)
@@ -130,18 +131,30 @@ def pull_posts(event, context):
     
     
     
-    posts_features = submission_features(submissions)
+    # Iterating over the listing calls the API lazily, 100 posts at a time.
+    #   Each submission is reduced to its features, which are appended
+    #   straight on to the columns, so only the columns grow with the number
+    #   of posts - neither the PRAW objects nor per-post records are kept.
+    posts_columns = features_to_columns(submission_features(subreddit_instance))
     
     
+    # Large payloads are passed on via s3 rather than in the response body
+    posts_payload = dump_payload(posts_columns,
+                                 bucket_name,
+                                 working_directory,
+                                 'posts_features_' + os.path.splitext(fname)[0],
+                                )
+    
     return_dict = {'fname': fname,
-                   #'working_directory': working_directory,
+                   'working_directory': working_directory,
                    #'IDs': submissions_IDs,
                    'num_top_comments': num_top_comments,
                    'auth_filename': auth_filename,
                    'bucket_name': bucket_name,
                    'staging_directory': staging_directory,
+                   'manifest_directory': manifest_directory,
                    #'submissions': submissions#_pickle,
-                   'posts_features': posts_features
+                   'posts_features': posts_payload,
                    }
     return {
             'statusCode': 200,
@@ -168,7 +181,7 @@ class get_auth:
     """
 
     def __init__(self, reddit_auth_file):
-        lines = reddit_auth_file['Body'].read().decode('utf-8').split('\r')
+        lines = reddit_auth_file['Body'].read().decode('utf-8').splitlines()
         #lines = open(reddit_auth_file, "r") # When passing a filepath
         for line in lines:
             if len(line.split('=')) < 2:
@@ -253,8 +266,9 @@ def get_subreddit_list(subreddits_file):
 
     Parameters
     ----------
-    subreddits_filepath : str
-        Filepath of txt file containing list of subreddits, delimited by ',/n'.
+    subreddits_file : dict
+        The s3 object (as from Object.get) of the txt file containing the list
+        of subreddits, one per line and optionally followed by a comma.
 
     Returns
     -------
@@ -262,7 +276,9 @@ def get_subreddit_list(subreddits_file):
         List of all subreddits.
     """
     
-    return subreddits_file['Body'].read().decode('utf-8').split('\r')
+    lines = subreddits_file['Body'].read().decode('utf-8').splitlines()
+    
+    return [line.strip().rstrip(',') for line in lines if line.strip()]
 
 
 
@@ -277,27 +293,23 @@ def submission_features(submissions):
     #submissions = inputs_dict['submissions']
                     
     """
-    Retrieve relevent feature data from a batch of Reddit posts. The API has
-    already been called for the post, so further API calls will only be invoked
-    when retrieving additional data about the posts' comments.
+    Retrieve relevent feature data from a stream of Reddit posts. Posts are
+    consumed lazily, one at a time, and the features of each are yielded as
+    soon as it arrives - when passed a PRAW listing the API is only called as
+    more posts are needed. Further API calls will only be invoked when 
+    retrieving additional data about the posts' comments.
 
     Parameters
     ----------
+    submissions : iterable
+        Reddit submissions, e.g. a PRAW listing generator.
 
-    working_directory: str
-        String naming the directory within the AWS s3 bucket where data is 
-        stored.
-    fname: str
-        Unique string used to build filename.
-    bucket_name : str
-        The name of the AWS s3 bucket containing data.
-
-    Returns
-    -------
-    batch_features : dict
-        Dictionary with keys given by individual Reddit posts submitted, the
-        corresponding values are dictionaries containing the features extracted
-        from that post.
+    Yields
+    ------
+    ID : str
+        The ID of the Reddit post.
+    features : dict
+        Dictionary containing the features extracted from that post.
 
     """
     
@@ -324,54 +336,39 @@ def submission_features(submissions):
     # Dictionary containing names for API featues.
     api_feat = api_feature_names()
     
-    # Initialize dictionary to hold features for Reddit posts
-    features = {}
-    # Iterate over each submission. They have all been pulled from the API,
-    #   they will now just be processed.
+    # Iterate over each submission, pulling more from the API only as needed.
     for subm in submissions:
         
-        features[subm.id] = {}
-            
-        for feat_name in api_feat:
-            features[subm.id][feat_name] = subm.__dict__[api_feat[feat_name]]
+        subm_data = subm.__dict__
+        features = {feat_name: subm_data[api_feat[feat_name]]
+                    for feat_name in api_feat
+                   }
     
         # Extract author and subreddit names as strings
         try:
-            features[subm.id]['Author'] = features[subm.id]['Author'].name
+            features['Author'] = features['Author'].name
         except AttributeError:
-            features[subm.id]['Author'] = None
+            features['Author'] = None
         try:
-            features[subm.id]['Subreddit'] = (features[subm.id]['Subreddit']
-                                              ).display_name
+            features['Subreddit'] = features['Subreddit'].display_name
         except AttributeError:
-            features[subm.id]['Subreddit'] = None
+            features['Subreddit'] = None
         
-        features[subm.id]['Created utc'] = subm.created_utc
+        features['Created utc'] = subm.created_utc
         # Convert UTC timestamp to time of day (in minutes since beginning of 
         #   UTC day)
-        dtime_posted = dt.utcfromtimestamp(features[subm.id]['Post time'])
-        features[subm.id]['Post time'] = (dtime_posted.hour*60 
-                                          + dtime_posted.minute
-                                         )
+        dtime_posted = dt.utcfromtimestamp(features['Post time'])
+        features['Post time'] = dtime_posted.hour*60 + dtime_posted.minute
         
         # Calculate age of the post (in minutes)
-        features[subm.id]['Post age'] = (dt.utcnow() 
-                                         - dtime_posted).total_seconds()/60
+        features['Post age'] = (dt.utcnow() 
+                                - dtime_posted).total_seconds()/60
         
         # Calculate upvotes per minute of age and comments per minute of age
-        features[subm.id]['Upvote rate'] = (features[subm.id]['Upvotes']
-                                            /features[subm.id]['Post age']
-                                           )
-        features[subm.id]['Comment rate'] = (features[subm.id]['Comments']
-                                             /features[subm.id]['Post age']
-                                            )
+        features['Upvote rate'] = features['Upvotes']/features['Post age']
+        features['Comment rate'] = features['Comments']/features['Post age']
       
-    # Save all post features to s3 bucket.
-    #features_fpath = os.path.join(working_directory, 'posts_data_' + fname)
-    #posts_features_pickle = pickle.dumps(features)
-    #s3.Object(bucket_name, features_fpath).put(Body = features_data_obj) 
-    
-    return features
+        yield subm.id, features
     
 # =============================================================================
 #     return_dict = {'posts_features': features}
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Thread-safe bookkeeping of the Reddit API rate limit. Reddit reports the
+    state of the limit in the headers of every response:
+        X-Ratelimit-Remaining - requests left in the current window
+        X-Ratelimit-Reset     - seconds until the window resets
+    Every worker calls wait() before making a request and update() with the
+    response headers afterwards. When the remaining budget drops below
+    min_remaining all workers pause until the window resets.
+
+    Parameters
+    ----------
+    min_remaining : int, default=10
+        The number of requests to hold in reserve. Should be at least the
+        number of concurrent workers, since that many requests may already be
+        in flight when the budget is checked.
+    """
+
+    def __init__(self, min_remaining = 10):
+
+        self.min_remaining = min_remaining
+        self.remaining = None
+        self.reset_at = None
+        self.lock = threading.Lock()
+
+
+
+
+    def wait(self):
+        """
+        Block until it is safe to make another request, then reserve one
+        request from the remaining budget.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        while True:
+            with self.lock:
+                # Nothing known about the limit until the first response
+                if self.remaining is None:
+                    return None
+
+                if self.remaining >= self.min_remaining:
+                    self.remaining -= 1
+                    return None
+
+                sleep_for = self.reset_at - time.monotonic()
+                if sleep_for <= 0:
+                    # The window has reset, the budget is unknown until the
+                    #   next response arrives
+                    self.remaining = None
+                    self.reset_at = None
+                    return None
+
+            # Sleep without holding the lock, every worker pauses until the
+            #   reset on its own rather than queueing behind one sleeper
+            print('Rate limit reached, pausing {:.1f}s'.format(sleep_for))
+            time.sleep(sleep_for)
+
+
+
+
+    def update(self, headers):
+        """
+        Record the rate limit state reported in a response's headers.
+
+        Parameters
+        ----------
+        headers : dict
+            Headers of the response from the Reddit API.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        try:
+            remaining = float(headers['X-Ratelimit-Remaining'])
+            reset_in = float(headers['X-Ratelimit-Reset'])
+        except (KeyError, TypeError, ValueError):
+            # Not every endpoint reports the limit, leave state unchanged
+            return None
+
+        with self.lock:
+            self.remaining = remaining
+            self.reset_at = time.monotonic() + reset_in
+
+        return None
+
+
+
+
+    def backoff(self, headers, default_wait = 10):
+        """
+        Record that the API has refused a request (HTTP 429), so that every
+        worker pauses at its next wait() until the window resets.
+
+        Parameters
+        ----------
+        headers : dict
+            Headers of the refused response.
+        default_wait : float, default=10
+            Seconds to pause if the response does not say when the window
+            resets.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        try:
+            reset_in = float(headers['X-Ratelimit-Reset'])
+        except (KeyError, TypeError, ValueError):
+            reset_in = default_wait
+
+        with self.lock:
+            self.remaining = 0
+            self.reset_at = time.monotonic() + reset_in
+
+        return None
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from exceptions import ApiRetryAttemptsExceeded
+from rate_limiter import RateLimiter
+
+
+
+
+"""
+Module-level session, kept alive between warm invocations of a Lambda function
+in the same way as the database connection in make_connection_if_cold.
+"""
+session = None
+
+
+
+
+def get_session_if_cold(auth, pool_size = 10):
+    """
+    Return the existing Reddit API session if there is one for these API keys,
+    otherwise build a new one. Re-using the session means re-using its open
+    connections and its OAuth token, so a warm Lambda invocation skips both the
+    TCP/TLS handshake and the token request.
+
+    Parameters
+    ----------
+    auth : auth_object
+        Authorization object with properites needed to access the Reddit API.
+    pool_size : int, default=10
+        The maximum number of connections kept open to each host, should be at
+        least the number of threads sharing the session.
+
+    Returns
+    -------
+    session : RedditSession
+        Session for making authenticated calls to the Reddit API.
+
+    """
+
+    global session
+
+    if ((session is None)
+        or (session.client_id != auth.client_id)
+        or (session.pool_size < pool_size)
+       ):
+        print('No Reddit API session, now establishing')
+        session = RedditSession(auth, pool_size)
+
+    return session
+
+
+
+
+class RedditSession:
+    """
+    Keep-alive connection pool to the Reddit API, authenticated with an
+    application-only OAuth bearer token which is refreshed shortly before it
+    expires. Safe to share between threads.
+
+    Parameters
+    ----------
+    auth : auth_object
+        Authorization object with properites needed to access the Reddit API.
+    pool_size : int, default=10
+        The maximum number of connections kept open to each host.
+    token_url : str, optional
+        Where to request OAuth tokens from.
+    """
+
+    def __init__(self, auth, pool_size = 10,
+                 token_url = 'https://www.reddit.com/api/v1/access_token'
+                 ):
+
+        self.client_id = auth.client_id
+        self.client_secret = auth.client_secret
+        self.pool_size = pool_size
+        self.token_url = token_url
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 2, pool_maxsize = pool_size)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        self.http.headers['user-agent'] = auth.user_agent
+
+        self.rate_limiter = RateLimiter(min_remaining = pool_size + 2)
+
+        self.token = None
+        self.token_expires_at = 0
+        self.token_lock = threading.Lock()
+
+
+
+
+    def get_token(self, expiry_margin = 60):
+        """
+        Return the current OAuth token, requesting a new one if there is none
+        or if it is about to expire.
+
+        Parameters
+        ----------
+        expiry_margin : float, default=60
+            Refresh the token when it has fewer than this many seconds left.
+
+        Returns
+        -------
+        token : str
+            The OAuth bearer token.
+
+        """
+
+        with self.token_lock:
+            if ((self.token is None)
+                or (time.monotonic() > self.token_expires_at - expiry_margin)
+               ):
+                r = self.http.post(self.token_url,
+                                   data = {'grant_type': 'client_credentials'},
+                                   auth = (self.client_id, self.client_secret),
+                                   )
+                r.raise_for_status()
+                token_data = r.json()
+                self.token = token_data['access_token']
+                self.token_expires_at = (time.monotonic()
+                                         + float(token_data['expires_in'])
+                                        )
+            token = self.token
+
+        return token
+
+
+
+
+    def get(self, url, params = None, max_attempts = 3):
+        """
+        Make an authenticated GET request, respecting the rate limit shared by
+        all threads using this session.
+
+        Parameters
+        ----------
+        url : str
+            The url to be requested.
+        params : dict, optional
+            Query parameters of the request. The default is None.
+        max_attempts : int, optional
+            How many times to make the request if the API refuses it due to
+            rate limiting or an expired token. The default is 3.
+
+        Raises
+        ------
+        ApiRetryAttemptsExceeded
+            The API refused every attempt.
+
+        Returns
+        -------
+        response : dict or list
+            The json body of the response.
+
+        """
+
+        for attempt in range(max_attempts):
+            headers = {'Authorization': 'bearer ' + self.get_token()}
+            # Pauses here after a refusal, so the last one raises at once
+            self.rate_limiter.wait()
+            r = self.http.get(url,
+                              params = params,
+                              headers = headers,
+                              )
+            if r.status_code == 401:
+                # Token revoked or expired early, force a refresh
+                with self.token_lock:
+                    self.token = None
+            elif r.status_code == 429:
+                self.rate_limiter.backoff(r.headers)
+            else:
+                break
+        else:
+            raise ApiRetryAttemptsExceeded('No response from ' + url)
+
+        self.rate_limiter.update(r.headers)
+        r.raise_for_status()
+
+        return r.json()
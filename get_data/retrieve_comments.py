@@ -6,13 +6,19 @@ Created on Fri Jan 15 17:13:31 2021
 """
 
 
-from datetime import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import json
+import os
+import time
 #import pickle
 #import os
 
 import boto3
-import requests
+import numpy as np
+
+from payload import dump_payload, load_payload, delete_payload
+from post_record import records_from_columns, records_to_columns
+from reddit_session import get_session_if_cold
 
 
 def  process_all_posts_comments(event, context):
@@ -21,12 +27,16 @@ def  process_all_posts_comments(event, context):
 
     fname = inputs_dict['fname']
     #subm_IDs =  inputs_dict['IDs']
-    #working_directory = inputs_dict['working_directory']
+    working_directory = inputs_dict['working_directory']
     num_top_comments = inputs_dict['num_top_comments']
     bucket_name = inputs_dict['bucket_name']
     auth_filename = inputs_dict['auth_filename']
     staging_directory = inputs_dict['staging_directory']
-    posts_features = inputs_dict['posts_features']
+    manifest_directory = inputs_dict.get('manifest_directory')
+    posts_payload = inputs_dict['posts_features']
+    posts_features = records_from_columns(load_payload(posts_payload))
+    max_workers = inputs_dict.get('max_workers', 8)
+    comments_mode = inputs_dict.get('comments_mode', 'per_post')
     
     """
     Wrapper for get_toplevel_comment_info, iterates through submission ID's
@@ -51,6 +61,14 @@ def  process_all_posts_comments(event, context):
     auth_filename : str
         The name of the txt file containing Reddit API keys, stored within the 
         root of the bucket named above. 
+    max_workers : int, optional
+        The number of posts whose comments are requested from the API at the
+        same time. The default is 8.
+    comments_mode : str, optional
+        Either 'per_post', one API call for each post, or 'bulk', which reads
+        the subreddits' shared comment stream and only calls the API for
+        individual posts that the stream does not cover. The default is 
+        'per_post'.
 
     Returns
     -------
@@ -90,15 +108,31 @@ def  process_all_posts_comments(event, context):
     # Pull Reddit API keys from file
     auth = get_auth(auth_file)
     
+    # Re-use the API session (connections and OAuth token) if Lambda is warm
+    session = get_session_if_cold(auth, pool_size = max_workers)
+    
+    # Request the comments of many posts at once, staying within rate limit
+    if comments_mode == 'bulk':
+        posts_created = {post_id: posts_features[post_id]['Created utc']
+                         for post_id in posts_features
+                        }
+        all_comment_data = fetch_all_toplevel_comment_info_bulk(session,
+                                                                subm_IDs,
+                                                                posts_created,
+                                                                num_top_comments,
+                                                                max_workers,
+                                                               )
+    else:
+        all_comment_data = fetch_all_toplevel_comment_info(session,
+                                                           subm_IDs,
+                                                           num_top_comments,
+                                                           max_workers,
+                                                          )
+    
     comments_dict = {}
     for subm in subm_IDs:
         submission_id = subm[0]
-        subm_subreddit = subm[1] 
-        comment_data = get_toplevel_comment_info(auth,
-                                                 submission_id,
-                                                 subm_subreddit,
-                                                 num_top_comments
-                                                )
+        comment_data = all_comment_data[submission_id]
         
         # Store post data to a dictionary
         comments_dict[submission_id] = {}
@@ -127,13 +161,24 @@ def  process_all_posts_comments(event, context):
         
 
     
+    # Large payloads are passed on via s3 rather than in the response body
+    features_payload = dump_payload(records_to_columns(combined),
+                                    bucket_name,
+                                    working_directory,
+                                    'all_features_' + os.path.splitext(fname)[0],
+                                   )
+    
+    # The posts payload has been used, and this stage's output is saved
+    delete_payload(posts_payload)
+    
     return_dict = {'fname': fname,
-                   #'working_directory': working_directory,
+                   'working_directory': working_directory,
                    'bucket_name': bucket_name,
                    'staging_directory': staging_directory,
+                   'manifest_directory': manifest_directory,
                    'auth_filename': auth_filename,
                    #'comments_features': comments_dict
-                   'all_features':combined,
+                   'all_features': features_payload,
                   }
     
     return {
@@ -165,10 +210,356 @@ def count_gildings(gild_dict):
 
 
 
-def get_toplevel_comment_info(auth,
+def fetch_all_toplevel_comment_info(session,
+                                    subm_IDs,
+                                    num_top_comments = 15,
+                                    max_workers = 8,
+                                    base_url = 'https://oauth.reddit.com/r/',
+                                    ):
+    """
+    Retrieve the top comments of many posts concurrently, then process all of
+    them at once with toplevel_comment_features. The calls are spread over a
+    pool of max_workers threads which share the session's connections and 
+    rate limit, so the pool as a whole respects the rate limit reported by the
+    Reddit API.
+
+    Parameters
+    ----------
+    session : RedditSession
+        Authenticated session for making calls to the Reddit API.
+    subm_IDs : list
+        List of pairs, first entry is the ID of post, second entry is the 
+        subreddit its from.
+    num_top_comments : int, optional
+        How many comments, sorted by upvotes descending, will be used to
+        perform the analysis. The default is 15.
+    max_workers : int, optional
+        The maximum number of requests in flight at once. The default is 8.
+    base_url : str, optional
+        The root url of the API, may be pointed at a local server for testing.
+        The default is 'https://oauth.reddit.com/r/'.
+
+    Returns
+    -------
+    all_comment_data : dict
+        Keys are post ID, values are the tuples returned by 
+        get_toplevel_comment_info.
+
+    """
+    
+    all_comments = get_all_toplevel_comments(session,
+                                             subm_IDs,
+                                             num_top_comments,
+                                             max_workers,
+                                             base_url,
+                                            )
+    
+    # All posts share a single 'now' when computing comment ages
+    features = toplevel_comment_features(all_comments)
+    
+    all_comment_data = {subm[0]: tuple(features[k].tolist())
+                        for k, subm in enumerate(subm_IDs)
+                       }
+        
+    return all_comment_data
+
+
+
+
+def fetch_all_toplevel_comment_info_bulk(session,
+                                         subm_IDs,
+                                         posts_created,
+                                         num_top_comments = 15,
+                                         max_workers = 8,
+                                         base_url = 'https://oauth.reddit.com/',
+                                         max_pages = 10,
+                                         ):
+    """
+    Alternative to fetch_all_toplevel_comment_info which can need fewer API 
+    calls. A post's comment tree can only be requested one post at a time,
+    so instead read the newest comments across all of the subreddits at once
+    (100 per call) and keep the top-level comments belonging to our posts.
+    
+    The stream is read backwards in time until it reaches the oldest post, or
+    until max_pages have been read. Any post created after the oldest comment
+    read has had every one of its comments seen. For the remaining (older)
+    posts, current comment counts are looked up 100 posts at a time and only
+    those which have comments are requested individually.
+    
+    Reddit lists only the newest ~1000 comments of the stream, shared between
+    all of the subreddits, so on busy subreddits it may reach back just a few
+    minutes and most posts then fall back to individual requests. How many
+    calls are saved therefore depends on the subreddits' comment volume; the
+    breakdown of calls made is printed on every run. The /api/morechildren
+    endpoint is not used: it expands comment IDs which are only known once a
+    post's comment tree has been fetched, so it cannot replace that request.
+    
+    Comments from the stream are ranked by score, the order used by Reddit's
+    'top' comment sort, before the top num_top_comments are kept.
+
+    Parameters
+    ----------
+    session : RedditSession
+        Authenticated session for making calls to the Reddit API.
+    subm_IDs : list
+        List of pairs, first entry is the ID of post, second entry is the 
+        subreddit its from.
+    posts_created : dict
+        Keys are post ID, values are the UTC epoch when the post was created.
+    num_top_comments : int, optional
+        How many comments, sorted by upvotes descending, will be used to
+        perform the analysis. The default is 15.
+    max_workers : int, optional
+        The maximum number of requests in flight at once when falling back to
+        individual posts. The default is 8.
+    base_url : str, optional
+        The root url of the API. The default is 'https://oauth.reddit.com/'.
+    max_pages : int, optional
+        The maximum number of pages of the comment stream to read. Reddit
+        stops listing after roughly 1000 items. The default is 10.
+
+    Returns
+    -------
+    all_comment_data : dict
+        Keys are post ID, values are the tuples returned by 
+        get_toplevel_comment_info.
+
+    """
+    
+    subreddits = sorted(set([subm[1] for subm in subm_IDs]))
+    oldest_post = min(posts_created.values())
+    
+    stream_comments, window_start, num_stream_calls = \
+        get_recent_toplevel_comments(session,
+                                     subreddits,
+                                     [subm[0] for subm in subm_IDs],
+                                     oldest_post,
+                                     base_url,
+                                     max_pages,
+                                    )
+    
+    # Posts older than the stream window may be missing some comments
+    uncovered = [subm for subm in subm_IDs 
+                 if posts_created[subm[0]] < window_start
+                ]
+    num_comments = get_num_comments(session,
+                                    [subm[0] for subm in uncovered],
+                                    base_url,
+                                   )
+    to_fetch = [subm for subm in uncovered if num_comments.get(subm[0], 1) > 0]
+    
+    fetched_comments = get_all_toplevel_comments(session,
+                                                 to_fetch,
+                                                 num_top_comments,
+                                                 max_workers,
+                                                 base_url + 'r/',
+                                                )
+    fetched_comments = {subm[0]: comments 
+                        for subm, comments in zip(to_fetch, fetched_comments)
+                       }
+    
+    # Assemble comments in original order, top comments sorted by upvotes
+    all_comments = []
+    for submission_id, _ in subm_IDs:
+        if submission_id in fetched_comments:
+            all_comments.append(fetched_comments[submission_id])
+        elif posts_created[submission_id] >= window_start:
+            comments = sorted(stream_comments[submission_id],
+                              key = lambda comment: comment_value(comment['data'],
+                                                                  'score'
+                                                                  ),
+                              reverse = True,
+                             )
+            all_comments.append(comments[:num_top_comments])
+        else:
+            # No comments on the post
+            all_comments.append([])
+    
+    print('Comment data for {} posts from {} API calls: {} stream pages, '
+          '{} count lookups, {} individual posts'
+          .format(len(subm_IDs),
+                  num_stream_calls + (len(uncovered) + 99)//100 + len(to_fetch),
+                  num_stream_calls,
+                  (len(uncovered) + 99)//100,
+                  len(to_fetch),
+                 )
+         )
+    
+    # All posts share a single 'now' when computing comment ages
+    features = toplevel_comment_features(all_comments)
+    
+    all_comment_data = {subm[0]: tuple(features[k].tolist())
+                        for k, subm in enumerate(subm_IDs)
+                       }
+        
+    return all_comment_data
+
+
+
+
+def get_all_toplevel_comments(session,
+                              subm_IDs,
+                              num_top_comments = 15,
+                              max_workers = 8,
+                              base_url = 'https://oauth.reddit.com/r/',
+                              ):
+    """
+    Run get_toplevel_comments for many posts over a pool of threads.
+
+    Parameters
+    ----------
+    session : RedditSession
+        Authenticated session for making calls to the Reddit API.
+    subm_IDs : list
+        List of pairs, first entry is the ID of post, second entry is the 
+        subreddit its from.
+    num_top_comments : int, optional
+        How many comments, sorted by upvotes descending, to retrieve per post.
+        The default is 15.
+    max_workers : int, optional
+        The maximum number of requests in flight at once. The default is 8.
+    base_url : str, optional
+        The root url of the API. The default is 'https://oauth.reddit.com/r/'.
+
+    Returns
+    -------
+    all_comments : list
+        List of lists of comment dictionaries, in the same order as subm_IDs.
+
+    """
+    
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = [executor.submit(get_toplevel_comments,
+                                   session,
+                                   submission_id,
+                                   subm_subreddit,
+                                   num_top_comments,
+                                   base_url,
+                                   )
+                   for submission_id, subm_subreddit in subm_IDs
+                  ]
+        
+        # Any exception raised within a worker is re-raised here
+        all_comments = [future.result() for future in futures]
+    
+    return all_comments
+
+
+
+
+def get_recent_toplevel_comments(session,
+                                 subreddits,
+                                 submission_ids,
+                                 oldest_needed,
+                                 base_url = 'https://oauth.reddit.com/',
+                                 max_pages = 10,
+                                 ):
+    """
+    Page backwards through the newest comments made across a set of
+    subreddits, keeping the top-level comments made on the given posts.
+
+    Parameters
+    ----------
+    session : RedditSession
+        Authenticated session for making calls to the Reddit API.
+    subreddits : list
+        List of strings, the subreddits to read comments from.
+    submission_ids : list
+        List of strings, the IDs of the posts whose comments are wanted.
+    oldest_needed : float
+        Stop paging once comments older than this UTC epoch are reached.
+    base_url : str, optional
+        The root url of the API. The default is 'https://oauth.reddit.com/'.
+    max_pages : int, optional
+        The maximum number of pages (of 100 comments) to read. The default is
+        10.
+
+    Returns
+    -------
+    comments : dict
+        Keys are post ID, values are lists of top-level comment dictionaries.
+    window_start : float
+        UTC epoch of the oldest comment read, every comment made since then
+        on these subreddits has been seen.
+    num_calls : int
+        The number of API calls made.
+
+    """
+    
+    url = base_url + 'r/' + '+'.join(subreddits) + '/comments.json'
+    
+    comments = {submission_id: [] for submission_id in submission_ids}
+    window_start = float('inf')
+    after = None
+    num_calls = 0
+    while num_calls < max_pages:
+        params = {'limit': 100}
+        if after is not None:
+            params['after'] = after
+        listing = session.get(url, params = params)['data']
+        num_calls += 1
+        
+        for comment in listing['children']:
+            data = comment['data']
+            window_start = min(window_start, data['created_utc'])
+            
+            # Top-level comments are those replying directly to the post
+            link_id = data['link_id']
+            submission_id = link_id[3:]
+            if (data['parent_id'] == link_id) & (submission_id in comments):
+                comments[submission_id].append(comment)
+        
+        after = listing['after']
+        if (after is None) or (window_start < oldest_needed):
+            break
+    
+    return comments, window_start, num_calls
+
+
+
+
+def get_num_comments(session, submission_ids, 
+                     base_url = 'https://oauth.reddit.com/'
+                     ):
+    """
+    Look up the current number of comments on many posts, using the info
+    endpoint which accepts up to 100 fullnames per call.
+
+    Parameters
+    ----------
+    session : RedditSession
+        Authenticated session for making calls to the Reddit API.
+    submission_ids : list
+        List of strings, the IDs of the posts to be looked up.
+    base_url : str, optional
+        The root url of the API. The default is 'https://oauth.reddit.com/'.
+
+    Returns
+    -------
+    num_comments : dict
+        Keys are post ID, values are the number of comments on the post.
+
+    """
+    
+    num_comments = {}
+    for k in range(0, len(submission_ids), 100):
+        fullnames = ['t3_' + ID for ID in submission_ids[k:k + 100]]
+        listing = session.get(base_url + 'api/info.json',
+                              params = {'id': ','.join(fullnames)},
+                             )['data']
+        for post in listing['children']:
+            num_comments[post['data']['id']] = post['data']['num_comments']
+    
+    return num_comments
+
+
+
+
+def get_toplevel_comment_info(session,
                               submission_id,
                               subm_subreddit,
-                              num_top_comments = 15
+                              num_top_comments = 15,
+                              base_url = 'https://oauth.reddit.com/r/',
                               ):
     """
     Given a single submission, process its top comments to build relevant
@@ -176,13 +567,17 @@ def get_toplevel_comment_info(auth,
 
     Parameters
     ----------
-    auth_dict : dict
-        Dictionary which contains authorization info for accesing Reddit API.
-    submission : [reddit submission]
-        The Reddit post for which comment info is to be extracted.
+    session : RedditSession
+        Authenticated session for making calls to the Reddit API.
+    submission_id : str
+        The ID of the Reddit post for which comment info is to be extracted.
+    subm_subreddit : str
+        The subreddit the post was made in.
     num_top_comments : int, optional
         How many comments, sorted by upvotes descending, will be used to
         perform the analysis. The default is 15.
+    base_url : str, optional
+        The root url of the API. The default is 'https://oauth.reddit.com/r/'.
 
     Returns
     -------
@@ -202,14 +597,53 @@ def get_toplevel_comment_info(auth,
 
     """
 
+    comments = get_toplevel_comments(session,
+                                     submission_id,
+                                     subm_subreddit,
+                                     num_top_comments,
+                                     base_url,
+                                     )
     
-    # Set up authentication for Reddit API
-    #   Due to some rate-limiting, cannot practically use PRAW for comments
-    base_url = str('https://www.reddit.com/r/')
-    authorization = requests.auth.HTTPBasicAuth(auth.client_id,
-                                                auth.client_secret,
-                                                )
-    headers = {'user-agent': auth.user_agent}
+    features = toplevel_comment_features([comments])
+    
+    return tuple(features[0].tolist())
+
+
+
+
+def get_toplevel_comments(session,
+                          submission_id,
+                          subm_subreddit,
+                          num_top_comments = 15,
+                          base_url = 'https://oauth.reddit.com/r/',
+                          ):
+    """
+    Call the Reddit API to retrieve the top-level comments of a single
+    submission.
+
+    Parameters
+    ----------
+    session : RedditSession
+        Authenticated session for making calls to the Reddit API.
+    submission_id : str
+        The ID of the Reddit post for which comments are to be retrieved.
+    subm_subreddit : str
+        The subreddit the post was made in.
+    num_top_comments : int, optional
+        How many comments, sorted by upvotes descending, to retrieve. The
+        default is 15.
+    base_url : str, optional
+        The root url of the API. The default is 'https://oauth.reddit.com/r/'.
+
+    Returns
+    -------
+    comments : list
+        List of dictionaries, one per comment, as returned by the API.
+
+    """
+
+    # Due to some rate-limiting, cannot practically use PRAW for comments.
+    #   The session holds the OAuth token and open connections to the API.
     
     #Call the API with these params
     params = {'context': 1,
@@ -221,63 +655,96 @@ def get_toplevel_comment_info(auth,
               'threaded': 0,
               'truncate': 50,
               }
-    #submission_id = str(submission.id)
-    #submission_sub = str(submission.subreddit)
     url = base_url + subm_subreddit + '/comments/' + submission_id + '.json'
 
-    # Call API
-    r = requests.get(url,
-                     params = params,
-                     auth = authorization,
-                     headers = headers,
-                     )
+    # Call API, pausing and retrying if the rate limit has been exceeded
+    response = session.get(url, params = params)
     
-    # Convert json response to dictionary
-    comments_dict = json.loads(r.text)[1]['data']['children']
-    num_comments = len(comments_dict)
+    return response[1]['data']['children']
 
 
-    created =   [comment_value(comment['data'], 'created_utc')
-                 for comment in comments_dict
-                ]
-    upvotes =   [comment_value(comment['data'], 'ups')
-                 for comment in comments_dict
-                ]
-    gilded  =   [comment_value(comment['data'], 'gilded')
-                 for comment in comments_dict
-                ]
-    disting =   [comment_value(comment['data'], 'distinguished')
-                 for comment in comments_dict
-                ]
-    op_comm =   [comment_value(comment['data'], 'is_submitter')
-                 for comment in comments_dict
-                ]
-    auth_prem = [comment_value(comment['data'], 'author_premium')
-                 for comment in comments_dict
-                ] 
-    
-    # Use the above to calculate summary info about comment section for submission
-    current_dtime = dt.utcnow()
-    age = [(current_dtime - dt.utcfromtimestamp(time)).total_seconds() 
-           for time in created
-          ]
-    
-    up_rate = [ups/time for ups,time in zip(upvotes, age)]
-    if num_comments == 0:
-        Avg_up_rate = 0
-        Std_up_rate = 0
-        gild_rate = 0
-        distinguished_rate = 0
-        op_comment_rate = 0
-        premium_auth_rate = 0
-    else:
-        Avg_up_rate = sum(up_rate)/num_comments
-        Std_up_rate = sum([(up - Avg_up_rate)**2 for up in up_rate])/num_comments        
-        gild_rate          = sum(gilded)/num_comments
-        distinguished_rate = sum(disting)/num_comments
-        op_comment_rate    = sum(op_comm)/num_comments
-        premium_auth_rate  = sum(auth_prem)/num_comments
-        
+
+
+"""
+Fields unpacked from each comment, in the order they are stored in the
+structured array built by toplevel_comment_features.
+"""
+comment_dtype = np.dtype([('created_utc', 'f8'),
+                          ('ups', 'f8'),
+                          ('gilded', 'f8'),
+                          ('distinguished', 'f8'),
+                          ('is_submitter', 'f8'),
+                          ('author_premium', 'f8'),
+                         ])
+
+
+
+
+def toplevel_comment_features(all_comments, now = None):
+    """
+    Summarize the top comments of a batch of posts. All comments from all
+    posts are unpacked in a single pass in to one structured array, after 
+    which every feature is computed for every post at once.
+
+    Parameters
+    ----------
+    all_comments : list
+        List of lists, one per post. Each inner list holds the comment
+        dictionaries returned by get_toplevel_comments.
+    now : float, optional
+        The UTC epoch against which comment ages are measured, shared by all
+        posts in the batch. The default is None, meaning the current time.
+
+    Returns
+    -------
+    features : np.array
+        Array of floats, one row per post. The columns are, in order:
+        Avg_up_rate, Std_up_rate, gild_rate, distinguished_rate, 
+        op_comment_rate, premium_auth_rate (see get_toplevel_comment_info).
+        Posts with no comments have all features equal to zero.
+
+    """
+    
+    if now is None:
+        now = time.time()
+    
+    num_posts = len(all_comments)
+    num_comments = np.fromiter((len(comments) for comments in all_comments),
+                               dtype = np.int64,
+                               count = num_posts,
+                              )
+    
+    # Unpack every comment from every post in one pass
+    fields = comment_dtype.names
+    data = np.array([tuple([comment_value(comment['data'], field)
+                            for field in fields
+                           ])
+                     for comments in all_comments
+                     for comment in comments
+                    ],
+                    dtype = comment_dtype,
+                   )
+    
+    # Row number of the post that each comment belongs to
+    post_idx = np.repeat(np.arange(num_posts), num_comments)
+    
+    # Avoid dividing by zero for posts with no comments, their sums are zero
+    denominator = np.maximum(num_comments, 1)
+    def per_post_mean(values):
+        return (np.bincount(post_idx, weights = values, minlength = num_posts)
+                /denominator
+               )
+    
+    # Use the above to calculate summary info about comment section for posts
+    age = now - data['created_utc']
+    up_rate = data['ups']/age
+    
+    Avg_up_rate = per_post_mean(up_rate)
+    Std_up_rate = per_post_mean((up_rate - Avg_up_rate[post_idx])**2)
+    gild_rate          = per_post_mean(data['gilded'])
+    distinguished_rate = per_post_mean(data['distinguished'])
+    op_comment_rate    = per_post_mean(data['is_submitter'])
+    premium_auth_rate  = per_post_mean(data['author_premium'])
     
     # There is an opportunity to create more features out of the comments. These could include:
     #    explore the success of comments/replies made by the submitter of the original post
@@ -285,9 +752,10 @@ def get_toplevel_comment_info(auth,
     #    look at the average controversiality among comments or replies to comments
     #    calculate the rate of gildings among comments and/or comment replies
     
-    return (Avg_up_rate, Std_up_rate, gild_rate, distinguished_rate,
-            op_comment_rate, premium_auth_rate,
-           )
+    return np.column_stack([Avg_up_rate, Std_up_rate, gild_rate, 
+                            distinguished_rate, op_comment_rate,
+                            premium_auth_rate,
+                           ])
 
 
 
@@ -321,6 +789,9 @@ def comment_value(data, feature):
             value = 1
         elif (feature == 'distinguished') & (value == 'admin'):
             value = 1            
+        elif feature == 'distinguished':
+            # Any other kind of distinguished user, e.g. 'special'
+            value = 1
     except KeyError:
         value = 0   
     return value
@@ -345,7 +816,7 @@ class get_auth:
     """
 
     def __init__(self, reddit_auth_file):
-        lines = reddit_auth_file['Body'].read().decode('utf-8').split('\r')
+        lines = reddit_auth_file['Body'].read().decode('utf-8').splitlines()
         #lines = open(reddit_auth_file, "r") # When passing a filepath
         for line in lines:
             if len(line.split('=')) < 2:
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import io
+import json
+import os
+import pickle
+
+import boto3
+
+from post_record import records_to_columns
+
+
+
+
+def write_staging_file(records, bucket_name, staging_directory, fname,
+                       staging_format = 'pickle'
+                       ):
+    """
+    Save the final features of all posts to the s3 staging directory, where
+    they wait to be loaded in to the database.
+
+    Parameters
+    ----------
+    records : dict
+        Keys are post ID, values are PostRecords.
+    bucket_name : str
+        The name of the AWS s3 bucket containing data.
+    staging_directory : str
+        The directory within the bucket where staged files are saved.
+    fname : str
+        Unique string used to build filename, see build_working_filename.
+    staging_format : str, default='pickle'
+        Either 'pickle', a pickled dictionary of dictionaries (the original
+        format), or 'parquet', a compressed columnar file. Parquet requires
+        pyarrow to be packaged with the Lambda function.
+
+    Returns
+    -------
+    staging_key : str
+        The s3 key of the saved file.
+
+    """
+
+    base_fname = 'gilded_data_' + os.path.splitext(fname)[0]
+
+    if staging_format == 'parquet':
+        staging_key = os.path.join(staging_directory, base_fname + '.parquet')
+        body = records_to_parquet(records)
+    elif staging_format == 'pickle':
+        staging_key = os.path.join(staging_directory, base_fname + '.pkl')
+        body = pickle.dumps({ID: record.to_dict()
+                             for ID, record in records.items()
+                            })
+    else:
+        raise ValueError('Unknown staging format: ' + staging_format)
+
+    boto3.resource('s3').Object(bucket_name, staging_key).put(Body = body)
+
+    return staging_key
+
+
+
+
+def record_manifest_entry(bucket_name, manifest_directory, staging_key):
+    """
+    Record a newly staged file in the manifest, so that the database loader can
+    find new files without listing the whole staging directory. Each entry is
+    a small object whose key starts with the (UTC) time it was written, so
+    entries sort in the order files were staged; its body is the staging key.
+
+    Parameters
+    ----------
+    bucket_name : str
+        The name of the AWS s3 bucket containing data.
+    manifest_directory : str
+        The directory within the bucket holding the manifest, entries are saved
+        in its 'entries' subdirectory.
+    staging_key : str
+        The s3 key of the staged file, see write_staging_file.
+
+    Returns
+    -------
+    entry_key : str
+        The s3 key of the manifest entry.
+
+    """
+
+    timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    entry_key = os.path.join(manifest_directory,
+                             'entries',
+                             timestamp + '_' + os.path.basename(staging_key)
+                             )
+
+    (boto3.resource('s3')
+          .Object(bucket_name, entry_key)
+          .put(Body = staging_key.encode('utf-8'))
+          )
+
+    return entry_key
+
+
+
+
+def records_to_parquet(records, compression = 'zstd'):
+    """
+    Convert records to the bytes of a parquet file, one column per feature.
+
+    Columns holding nested values (such as the 'Gildings' dictionary) or a mix
+    of types (such as 'Edited', either False or a UTC epoch) cannot be stored
+    as a parquet column directly; these are stored as JSON strings and listed
+    in the file metadata under b'json_columns' so that they can be decoded
+    when read.
+
+    Parameters
+    ----------
+    records : dict
+        Keys are post ID, values are PostRecords.
+    compression : str, default='zstd'
+        The compression codec used within the parquet file.
+
+    Returns
+    -------
+    bytes
+        The parquet file.
+
+    """
+
+    # Not available to every Lambda function, only import when needed
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = records_to_columns(records)
+
+    arrays = []
+    json_columns = []
+    for feature_name, values in zip(columns['features'], columns['values']):
+        try:
+            if not is_plain_column(values):
+                raise TypeError
+            arrays.append(pa.array(values))
+        except (TypeError, pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(pa.array([json.dumps(value) for value in values]))
+            json_columns.append(feature_name)
+
+    table = pa.Table.from_arrays(arrays, names = columns['features'])
+    table = table.replace_schema_metadata({b'json_columns':
+                                           json.dumps(json_columns)
+                                          })
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression = compression)
+
+    return buffer.getvalue()
+
+
+
+
+def is_plain_column(values):
+    """
+    Check whether a column can be stored as a parquet column without changing
+    any of its values: every value (other than None) must be a scalar of the
+    same type, though ints and floats may be mixed. Bools are kept apart from
+    ints, otherwise pyarrow would store False as 0.0 in a column of floats.
+
+    Parameters
+    ----------
+    values : list
+        The values of a single feature.
+
+    Returns
+    -------
+    bool
+        True if the column can be stored directly, False if it must be
+        stored as JSON strings.
+
+    """
+
+    value_types = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, (dict, list)):
+            return False
+        if isinstance(value, bool):
+            value_types.add(bool)
+        elif isinstance(value, (int, float)):
+            value_types.add(float)
+        else:
+            value_types.add(type(value))
+
+    return len(value_types) <= 1
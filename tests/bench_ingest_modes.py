@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Time the two ingest modes of the database loader (see write_rows in
+add_top_file_to_dbase): a multi-row INSERT built by execute_values, and COPY
+in to a temporary table. Not collected by pytest, run by hand against a local
+PostgreSQL server:
+
+    python tests/bench_ingest_modes.py "host=localhost dbname=bench"
+    python tests/bench_ingest_modes.py "<dsn>" --sizes 10000 100000
+
+Each run writes to a fresh table in the public schema, which is dropped after.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'to_database'))
+
+import argparse
+import time
+
+import psycopg2
+
+import ensure_table
+import make_connection
+import schema
+
+
+def connect(dsn):
+    """
+    The loader's connection, re-made if the server dropped it. The loader
+    opens its connection when imported, so it is handed this one as if the
+    Lambda function were warm.
+    """
+
+    if make_connection.conn is None or make_connection.conn.closed:
+        # A server which crashed takes a few seconds to recover
+        for attempt in range(60):
+            try:
+                make_connection.conn = psycopg2.connect(dsn)
+                break
+            except psycopg2.OperationalError:
+                if attempt == 59:
+                    raise
+                time.sleep(1)
+
+    return make_connection.conn
+
+
+def make_rows(num_rows):
+    """
+    Rows for every column of the schema, a value of the column's type in each.
+    """
+
+    sample_values = {'varchar': 'a, "b"\nc',
+                     'integer': 42,
+                     'real': 0.5,
+                     'double': 1616426570.25,
+                     'boolean': True,
+                    }
+    columns = []
+    row_template = []
+    for name, definition in schema.column_definitions():
+        columns.append(name)
+        row_template.append(sample_values[definition.split()[1].split('(')[0]])
+
+    id_index = columns.index('ID')
+    values = []
+    for k in range(num_rows):
+        row = list(row_template)
+        row[id_index] = 'p{}_new03221643'.format(k)
+        values.append(row)
+
+    return columns, values
+
+
+def time_write(dsn, ingest_mode, columns, values):
+    """
+    Seconds taken to write the rows to a new table, None if the database
+    failed to take them (the connection is then dropped).
+    """
+
+    conn = connect(dsn)
+    table_name = 'bench_' + ingest_mode
+    cur = conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS public.{}'.format(table_name))
+    ensure_table.forget_table('public', table_name)
+    ensure_table.ensure_table(cur, 'public', table_name)
+    conn.commit()
+
+    start = time.perf_counter()
+    try:
+        atf.write_rows(cur, 'public', table_name, columns, values, ingest_mode)
+        conn.commit()
+    except psycopg2.Error as e:
+        print('{} of {} rows failed: {}'.format(ingest_mode, len(values),
+                                                str(e).strip()))
+        make_connection.close_quietly(conn)
+        make_connection.conn = None
+        return None
+    elapsed = time.perf_counter() - start
+
+    cur.execute('SELECT COUNT(*) FROM public.{}'.format(table_name))
+    assert cur.fetchone()[0] == len(values)
+    cur.execute('DROP TABLE public.{}'.format(table_name))
+    conn.commit()
+    cur.close()
+
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0])
+    parser.add_argument('dsn', help = 'libpq connection string')
+    parser.add_argument('--sizes', type = int, nargs = '+',
+                        default = [10000, 100000, 1000000],
+                        help = 'numbers of rows to write')
+    args = parser.parse_args()
+
+    connect(args.dsn)
+    os.environ.setdefault('bucket_name', '')
+    os.environ.setdefault('db_auth_fname', '')
+    import add_top_file_to_dbase as atf
+
+    print('{:>9} {:>10} {:>10} {:>8}'.format('rows', 'insert (s)', 'copy (s)',
+                                             'speedup'))
+    for num_rows in args.sizes:
+        columns, values = make_rows(num_rows)
+        insert_time = time_write(args.dsn, 'insert', columns, values)
+        copy_time = time_write(args.dsn, 'copy', columns, values)
+        print('{:>9} {:>10} {:>10} {:>8}'.format(
+                num_rows,
+                'failed' if insert_time is None else '{:.2f}'.format(insert_time),
+                'failed' if copy_time is None else '{:.2f}'.format(copy_time),
+                '' if None in (insert_time, copy_time)
+                   else '{:.1f}x'.format(insert_time / copy_time),
+                ))
+
+    make_connection.close_quietly(make_connection.conn)
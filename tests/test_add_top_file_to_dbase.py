@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'to_database'))
+
+import json
+import unittest
+from unittest import mock
+
+import psycopg2.errors
+
+import ensure_table
+import make_connection
+
+# The module connects to the database when imported. Its sibling modules are
+#   dropped from sys.modules afterwards, as get_data has its own staging_files
+with mock.patch.object(make_connection, 'make_connection_if_cold'), \
+     mock.patch.dict(sys.modules):
+    import add_top_file_to_dbase as atf
+
+
+class TestInsertTransformedFiles(unittest.TestCase):
+    
+    def setUp(self):
+        ensure_table.ensured_tables.clear()
+        ensure_table.ensured_tables.add(('schema', 'table'))
+        self.files = {'a.pkl': (('ID',), [('a',)]),
+                      'b.pkl': (('ID',), [('b',)]),
+                      'c.pkl': (('ID',), []),
+                     }
+
+    def insert(self, error):
+        def write_rows(cur, schema_name, table_name, columns, values,
+                       ingest_mode):
+            if ('b',) in values:
+                raise error
+        
+        with mock.patch.object(atf, 'write_rows', side_effect = write_rows):
+            return atf.insert_transformed_files(None, 'schema', 'table',
+                                                self.files,
+                                                )
+
+    def test_bad_file_reported(self):
+        completed, failed = self.insert(ValueError('bad row'))
+        
+        self.assertEqual(sorted(completed), ['a.pkl', 'c.pkl'])
+        self.assertEqual(failed, ['b.pkl'])
+        # Not a problem with the table, it needn't be checked again
+        self.assertIn(('schema', 'table'), ensure_table.ensured_tables)
+
+    def test_table_changed(self):
+        self.insert(psycopg2.errors.UndefinedColumn('no such column'))
+        
+        self.assertNotIn(('schema', 'table'), ensure_table.ensured_tables)
+
+
+
+class TestAddTopFile(unittest.TestCase):
+    
+    def add_top_file(self, fnames_list):
+        inputs_dict = {'bucket_name': 'bucket',
+                       'staging_dir': 'staging',
+                       'completed_dir': 'completed',
+                       'error_dir': 'error',
+                       'schema_name': 'schema',
+                       'table_name': 'table',
+                       'fnames_list': fnames_list,
+                      }
+        event = {'body': json.dumps(inputs_dict)}
+        
+        with mock.patch.object(atf.boto3, 'resource',
+                               side_effect = OSError('no access'),
+                               ):
+            return atf.add_top_file_to_dbase(event, None)
+
+    def test_failed_file_moved_on(self):
+        response = self.add_top_file(['a.pkl', 'b.pkl'])
+        body = json.loads(response['body'])
+        
+        self.assertTrue(response['error'])
+        self.assertEqual(response['num_names_left'], 1)
+        self.assertEqual(body['fname_processed'], 'a.pkl')
+        self.assertEqual(body['fnames_list'], ['b.pkl'])
+
+    def test_empty_list(self):
+        # Nothing to move to the error folder, the run should fail
+        with self.assertRaises(IndexError):
+            self.add_top_file([])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'to_database'))
+
+import csv
+import unittest
+
+import copy_rows
+
+
+class TestCsvField(unittest.TestCase):
+    
+    def test_none_is_null(self):
+        self.assertEqual(copy_rows.csv_field(None), '')
+
+    def test_strings_always_quoted(self):
+        self.assertEqual(copy_rows.csv_field(''), '""')
+        self.assertEqual(copy_rows.csv_field('a "b", c'), '"a ""b"", c"')
+        self.assertEqual(copy_rows.csv_field('line\nbreak'), '"line\nbreak"')
+
+    def test_bools(self):
+        self.assertEqual(copy_rows.csv_field(True), 'True')
+        self.assertEqual(copy_rows.csv_field(False), 'False')
+
+    def test_numbers(self):
+        self.assertEqual(copy_rows.csv_field(7.0), '7')
+        self.assertEqual(copy_rows.csv_field(-3), '-3')
+        self.assertEqual(copy_rows.csv_field(0.25), '0.25')
+        self.assertEqual(copy_rows.csv_field(1616426570.0), '1616426570')
+
+
+class TestRowsToCsv(unittest.TestCase):
+    
+    def test_round_trip(self):
+        rows = [['a1', 'He said "hi", then\nleft', 2.0, True, None],
+                ['a2', '', 0.5, False, 'back\\slash\r\nline'],
+               ]
+        
+        text = copy_rows.rows_to_csv(rows).read()
+        
+        self.assertEqual(text.splitlines()[0], '"a1","He said ""hi"", then')
+        # Parsed back, quoting keeps the empty string apart from NULL
+        parsed = list(csv.reader(text.splitlines(keepends = True)))
+        self.assertEqual(parsed,
+                         [['a1', 'He said "hi", then\nleft', '2', 'True', ''],
+                          ['a2', '', '0.5', 'False', 'back\\slash\r\nline'],
+                         ])
+        self.assertTrue(text.endswith(',"back\\slash\r\nline"\n'))
+        self.assertIn('"a2","",0.5,False,', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
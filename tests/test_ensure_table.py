@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'to_database'))
+
+import unittest
+
+import ensure_table
+import schema
+
+
+class FakeCursor:
+    """
+    Records the statements executed, answering the catalog queries from the
+    columns and indexes of one table (none, if it doesn't exist yet).
+    """
+
+    def __init__(self, columns = (), indexes = ()):
+        self.columns = {column.lower() for column in columns}
+        self.indexes = set(indexes)
+        self.statements = []
+        self.rows = []
+
+    def execute(self, sql, params = None):
+        sql = ' '.join(sql.split())
+        self.statements.append(sql)
+        if 'pg_attribute' in sql:
+            self.rows = [(column,) for column in self.columns]
+        elif 'pg_indexes' in sql:
+            self.rows = [(index,) for index in self.indexes]
+        elif sql.startswith('CREATE TABLE'):
+            self.columns = {name.lower()
+                            for name, _ in schema.column_definitions()}
+        elif sql.startswith('ALTER TABLE'):
+            self.columns.add(sql.split('ADD COLUMN IF NOT EXISTS ')[1]
+                                .split()[0].lower())
+        elif sql.startswith('CREATE INDEX'):
+            self.indexes.add(sql.split()[5])
+
+    def fetchall(self):
+        return self.rows
+
+    def count(self, prefix):
+        return len([sql for sql in self.statements if sql.startswith(prefix)])
+
+
+class TestEnsureTable(unittest.TestCase):
+
+    def setUp(self):
+        ensure_table.ensured_tables.clear()
+        self.addCleanup(ensure_table.ensured_tables.clear)
+        # A table built before the scrape metadata columns were added
+        self.old_columns = [name for name, _ in schema.column_definitions()
+                            if name not in ('Scrape_tag', 'Scrape_time')]
+
+    def test_new_table(self):
+        cur = FakeCursor()
+
+        self.assertTrue(ensure_table.ensure_table(cur, 'schema', 'table'))
+
+        self.assertEqual(cur.count('CREATE TABLE IF NOT EXISTS schema.table'),
+                         1)
+        self.assertEqual(cur.count('ALTER TABLE'), 0)
+        self.assertEqual(cur.count('UPDATE'), 0)
+        self.assertEqual(cur.count('CREATE INDEX'),
+                         len(schema.indexed_columns))
+
+    def test_migration_runs_once_per_process(self):
+        cur = FakeCursor(self.old_columns)
+
+        self.assertTrue(ensure_table.ensure_table(cur, 'schema', 'table'))
+        self.assertFalse(ensure_table.ensure_table(cur, 'schema', 'table'))
+
+        self.assertEqual(cur.count('ALTER TABLE schema.table ADD COLUMN IF '
+                                   'NOT EXISTS Scrape_tag'), 1)
+        self.assertEqual(cur.count('ALTER TABLE schema.table ADD COLUMN IF '
+                                   'NOT EXISTS Scrape_time'), 1)
+        self.assertEqual(cur.count('ALTER TABLE'), 2)
+        self.assertEqual(cur.count('UPDATE schema.table SET Scrape_tag = '
+                                   "SPLIT_PART(ID, '_', 2) WHERE Scrape_tag "
+                                   'IS NULL'), 1)
+        self.assertEqual(cur.count('UPDATE schema.table SET Scrape_time'), 1)
+        self.assertEqual(cur.count('CREATE INDEX'),
+                         len(schema.indexed_columns))
+
+        # Checked again once forgotten, but there is nothing left to do
+        num_statements = len(cur.statements)
+        ensure_table.forget_table('schema', 'table')
+        self.assertTrue(ensure_table.ensure_table(cur, 'schema', 'table'))
+        self.assertEqual(len(cur.statements), num_statements + 2)
+
+    def test_existing_indexes_kept(self):
+        cur = FakeCursor(self.old_columns + ['Scrape_tag', 'Scrape_time'],
+                         ['table_how_sorted_idx'])
+
+        ensure_table.ensure_table(cur, 'schema', 'table')
+
+        self.assertEqual(cur.count('ALTER TABLE'), 0)
+        self.assertEqual(cur.count('CREATE INDEX IF NOT EXISTS '
+                                   'table_how_sorted_idx'), 0)
+        self.assertEqual(cur.count('CREATE INDEX'),
+                         len(schema.indexed_columns) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'train_model'))
+
+from datetime import datetime as dt
+import unittest
+
+import pandas as pd
+
+from feature_derivation import derive_features
+
+
+class TestDeriveFeatures(unittest.TestCase):
+    
+    def setUp(self):
+        self.df = pd.DataFrame({'gold_awarded': [0, 1, 0, 2],
+                                'platinum_awarded': [0, 0, 1, 1],
+                                'created_utc': [1615975000.0,
+                                                1616025599.0,
+                                                1609459200.0,
+                                                1616500000.5,
+                                               ],
+                                'id': ['aaaaaa_rising03171105',
+                                       'bbbbbb_new03180001',
+                                       'cccccc_rising01012359',
+                                       'dddddd_new03231200',
+                                      ],
+                               },
+                               index = [10, 3, 7, 8],
+                              )
+
+    def test_matches_row_by_row(self):
+        gilded, weekday, hour, scrape_time = derive_features(self.df)
+        
+        # The per-row code which derive_features replaced
+        num_gilds = self.df['gold_awarded'] + self.df['platinum_awarded']
+        self.assertEqual(gilded.tolist(),
+                         num_gilds.apply(lambda x: 1 if x > 0 else 0).tolist()
+                         )
+        self.assertEqual(weekday.tolist(),
+                         [dt.utcfromtimestamp(x).weekday()
+                          for x in self.df['created_utc']
+                         ])
+        self.assertEqual(hour.tolist(),
+                         [dt.utcfromtimestamp(x).hour
+                          for x in self.df['created_utc']
+                         ])
+        self.assertEqual(scrape_time.tolist(),
+                         [ID[-4:] for ID in self.df['id']]
+                         )
+
+    def test_values(self):
+        gilded, weekday, hour, scrape_time = derive_features(self.df)
+        
+        self.assertEqual(gilded.tolist(), [0, 1, 1, 1])
+        # 2021-01-01 00:00 UTC was a Friday
+        self.assertEqual((weekday[7], hour[7]), (4, 0))
+        self.assertEqual(scrape_time.tolist(),
+                         ['1105', '0001', '2359', '1200']
+                         )
+        for feature in [gilded, weekday, hour, scrape_time]:
+            self.assertEqual(feature.index.tolist(), [10, 3, 7, 8])
+        self.assertEqual(gilded.dtype, 'int64')
+        self.assertEqual(weekday.dtype, 'int64')
+        self.assertEqual(hour.dtype, 'int64')
+
+
+if __name__ == '__main__':
+    unittest.main()
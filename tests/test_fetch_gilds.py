@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'get_data'))
+
+import unittest
+
+import fetch_gilds as fg
+from post_record import PostRecord
+
+
+class FakeSession:
+    """
+    Stands in for RedditSession, answering api/info requests for every ID
+    except those which have been deleted.
+    """
+    
+    def __init__(self, deleted = ()):
+        self.deleted = set(deleted)
+        self.num_calls = 0
+    
+    def get(self, url, params = None):
+        self.num_calls += 1
+        IDs = [fullname[3:] for fullname in params['id'].split(',')]
+        return {'data': {'children': [{'data': {'id': ID,
+                                                'gildings': {'gid_2': 1},
+                                                'ups': 7,
+                                                'num_comments': 3,
+                                               }}
+                                      for ID in IDs
+                                      if ID not in self.deleted
+                                     ]}}
+
+
+class TestFetchGilds(unittest.TestCase):
+    
+    def test_batches(self):
+        IDs = ['id{}'.format(k) for k in range(250)]
+        session = FakeSession()
+        
+        new_data = fg.fetch_all_gilds_and_upvotes(session, IDs)
+        
+        self.assertEqual(session.num_calls, 3)
+        self.assertEqual(set(new_data), set(IDs))
+        self.assertEqual(new_data['id7'], {'Silver awarded': 0,
+                                           'Gold awarded': 1,
+                                           'Platinum awarded': 0,
+                                           'Final upvotes': 7,
+                                           'Final num comments': 3,
+                                          })
+
+    def test_deleted_posts_skipped(self):
+        all_features = {ID: PostRecord.from_dict({'ID': ID})
+                        for ID in ['a', 'b', 'c']
+                       }
+        new_data = fg.fetch_all_gilds_and_upvotes(FakeSession(deleted = ['b']),
+                                                  list(all_features)
+                                                  )
+        
+        data_with_gilds = fg.add_gilds(all_features, new_data)
+        
+        self.assertEqual(list(data_with_gilds), ['a', 'c'])
+        self.assertEqual(data_with_gilds['c']['Final upvotes'], 7)
+
+
+    def test_latency_summary(self):
+        self.assertEqual(fg.latency_summary([0.5, 0.25, 2.0]),
+                         'api/info: 3 batches, latency min 0.25s, '
+                         'median 0.50s, max 2.00s'
+                         )
+        self.assertEqual(fg.latency_summary([]),
+                         'api/info: no batches requested'
+                         )
+
+
+if __name__ == '__main__':
+    unittest.main()
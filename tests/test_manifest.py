@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'to_database'))
+
+import io
+import unittest
+from unittest import mock
+
+import manifest
+
+
+class FakeS3Client:
+    """
+    In-memory stand in for boto3.client('s3'), only the calls used by the
+    manifest functions.
+    """
+    
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+    
+    def __init__(self):
+        self.objects = {}
+    
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+    
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'Body': io.BytesIO(self.objects[Key])}
+    
+    def get_paginator(self, name):
+        return self
+    
+    def paginate(self, Bucket, Prefix, StartAfter = ''):
+        keys = sorted(key for key in self.objects
+                      if key.startswith(Prefix) and key > StartAfter
+                     )
+        yield {'Contents': [{'Key': key} for key in keys]}
+
+
+class TestManifest(unittest.TestCase):
+    
+    def setUp(self):
+        manifest.batch_manifests.clear()
+        self.s3 = FakeS3Client()
+        patcher = mock.patch.object(manifest.boto3, 'client',
+                                    return_value = self.s3,
+                                    )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_entry(self, timestamp, staging_key):
+        self.s3.put_object('bucket',
+                           'manifest/entries/{}_{}'.format(timestamp,
+                                                           staging_key,
+                                                           ),
+                           staging_key.encode('utf-8'),
+                           )
+
+    def run_loader(self, finish = True):
+        fnames_list, cursor = manifest.new_manifest_entries('bucket',
+                                                            'manifest',
+                                                            )
+        manifest_key = manifest.write_batch_manifest('bucket', 'manifest',
+                                                     fnames_list, cursor,
+                                                     )
+        inputs_dict = {'manifest_directory': 'manifest',
+                       'manifest_key': manifest_key,
+                      }
+        fnames, list_state, num_names_left = manifest.next_fnames('bucket',
+                                                                  inputs_dict,
+                                                                  25,
+                                                                  )
+        self.assertEqual(num_names_left, 0)
+        if finish:
+            manifest.finish_batch('bucket', list_state)
+        
+        return fnames
+
+    def test_new_entries_only(self):
+        self.add_entry('20210317T110000000000', 'a.pkl')
+        self.add_entry('20210317T110500000000', 'b.pkl')
+        self.assertEqual(self.run_loader(), ['a.pkl', 'b.pkl'])
+        
+        self.add_entry('20210318T110000000000', 'c.pkl')
+        self.assertEqual(self.run_loader(), ['c.pkl'])
+        self.assertEqual(self.run_loader(), [])
+
+    def test_unfinished_batch_listed_again(self):
+        self.add_entry('20210317T110000000000', 'a.pkl')
+        self.assertEqual(self.run_loader(finish = False), ['a.pkl'])
+        self.assertIsNone(manifest.read_cursor('bucket', 'manifest'))
+        
+        self.assertEqual(self.run_loader(), ['a.pkl'])
+
+    def test_late_entry_within_overlap(self):
+        self.add_entry('20210317T110000000000', 'a.pkl')
+        self.add_entry('20210317T110500000000', 'b.pkl')
+        self.run_loader()
+        
+        # Timed before b.pkl's entry, but only written after it was listed
+        self.add_entry('20210317T110400000000', 'late.pkl')
+        self.assertEqual(self.run_loader(), ['late.pkl'])
+        self.assertEqual(self.run_loader(), [])
+
+
+    def test_requeued_file_listed_again(self):
+        self.add_entry('20210317T110000000000', 'a.pkl')
+        self.add_entry('20210317T110500000000', 'b.pkl')
+        self.run_loader()
+        
+        # b.pkl was loaded but couldn't be moved out of staging
+        manifest.requeue_fnames('bucket',
+                                {'manifest_directory': 'manifest',
+                                 'manifest_key': 'manifest/batches/1.json',
+                                },
+                                ['staging/b.pkl'],
+                                )
+        self.assertEqual(self.run_loader(), ['staging/b.pkl'])
+        self.assertEqual(self.run_loader(), [])
+
+    def test_requeue_without_manifest(self):
+        entry_keys = manifest.requeue_fnames('bucket',
+                                             {'fnames_list': []},
+                                             ['staging/b.pkl'],
+                                             )
+        
+        self.assertEqual(entry_keys, [])
+        self.assertEqual(self.s3.objects, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
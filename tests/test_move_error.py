@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'to_database'))
+
+import json
+import unittest
+from unittest import mock
+
+import move_error
+
+
+def make_event(**inputs):
+    inputs_dict = {'bucket_name': 'bucket',
+                   'staging_dir': 'staging',
+                   'completed_dir': 'completed',
+                   'error_dir': 'error',
+                   'schema_name': 'schema',
+                   'table_name': 'table',
+                  }
+    inputs_dict.update(inputs)
+    
+    return {'num_names_left': 5, 'body': json.dumps(inputs_dict)}
+
+
+class TestMoveToError(unittest.TestCase):
+    
+    def move(self, event, outcomes = {}):
+        with mock.patch.object(move_error, 'move_files',
+                               return_value = outcomes) as move_files:
+            response = move_error.move_to_error(event, None)
+        
+        return response, move_files.call_args[0][1]
+
+    def test_bulk_errors(self):
+        event = make_event(fnames_list = ['c', 'd'], fnames_error = ['a'])
+        
+        response, moved = self.move(event)
+        
+        self.assertEqual(moved, ['a'])
+        self.assertEqual(response['num_names_left'], 5)
+        self.assertEqual(json.loads(response['body'])['fnames_list'],
+                         ['c', 'd']
+                         )
+
+    def test_caught_failure_moves_next_batch(self):
+        # Input passed through from the previous batch, whose fnames_error
+        #   were already moved
+        event = make_event(fnames_list = ['a', 'b', 'c', 'd', 'e'],
+                           fnames_error = ['z'],
+                           batch_size = 2,
+                           )
+        event['error_info'] = {'Error': 'States.Timeout', 'Cause': ''}
+        
+        response, moved = self.move(event)
+        body = json.loads(response['body'])
+        
+        self.assertEqual(moved, ['a', 'b'])
+        self.assertEqual(response['num_names_left'], 3)
+        self.assertEqual(response['num_errors'], 2)
+        self.assertEqual(body['fnames_list'], ['c', 'd', 'e'])
+        self.assertEqual(body['fnames_error'], ['a', 'b'])
+
+
+    def test_failed_move_tried_again(self):
+        event = make_event(manifest_directory = 'manifest',
+                           manifest_key = 'manifest/batches/1.json',
+                           position = 2,
+                           fnames_error = ['a', 'b'],
+                           )
+        event['num_names_left'] = 0
+        outcomes = {'a': 'moved', 'b': 'copy failed: SlowDown'}
+        
+        calls = mock.Mock()
+        with mock.patch.object(move_error, 'requeue_fnames',
+                               calls.requeue_fnames), \
+             mock.patch.object(move_error, 'finish_batch',
+                               calls.finish_batch):
+            response, moved = self.move(event, outcomes)
+        
+        self.assertEqual(response['num_move_failures'], 1)
+        # The file still in staging is queued again before the cursor moves
+        self.assertEqual([call[0] for call in calls.mock_calls],
+                         ['requeue_fnames', 'finish_batch'])
+        self.assertEqual(calls.requeue_fnames.call_args[0][2], ['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
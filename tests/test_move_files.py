@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'to_database'))
+
+import threading
+import unittest
+from unittest import mock
+
+import move_files as mf
+
+
+class FakeS3Client:
+    """
+    Stands in for boto3.client('s3'). Copies of the keys in copy_errors
+    raise, and deleting the keys in delete_errors is refused (as reported by
+    delete_objects, not raised).
+    """
+
+    def __init__(self, copy_errors = (), delete_errors = ()):
+        self.copy_errors = set(copy_errors)
+        self.delete_errors = set(delete_errors)
+        self.copies = []
+        self.delete_batches = []
+        self.lock = threading.Lock()
+
+    def copy_object(self, Bucket, Key, CopySource):
+        if CopySource['Key'] in self.copy_errors:
+            raise RuntimeError('SlowDown')
+        with self.lock:
+            self.copies.append((CopySource['Key'], Key))
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [obj['Key'] for obj in Delete['Objects']]
+        self.delete_batches.append(keys)
+        return {'Errors': [{'Key': key, 'Code': 'AccessDenied',
+                            'Message': 'Access Denied'}
+                           for key in keys if key in self.delete_errors]}
+
+
+class TestMoveFiles(unittest.TestCase):
+
+    def move(self, s3, fnames):
+        with mock.patch.object(mf.boto3, 'client', return_value = s3):
+            return mf.move_files('bucket', fnames, 'completed')
+
+    def test_moved(self):
+        s3 = FakeS3Client()
+
+        outcomes = self.move(s3, ['staging/a.pkl', 'staging/b.pkl'])
+
+        self.assertEqual(outcomes, {'staging/a.pkl': 'moved',
+                                    'staging/b.pkl': 'moved'})
+        self.assertEqual(sorted(s3.copies),
+                         [('staging/a.pkl', 'completed/a.pkl'),
+                          ('staging/b.pkl', 'completed/b.pkl')])
+
+    def test_failed_copy_not_deleted(self):
+        s3 = FakeS3Client(copy_errors = ['staging/b.pkl'])
+
+        outcomes = self.move(s3, ['staging/a.pkl', 'staging/b.pkl'])
+
+        self.assertEqual(outcomes['staging/a.pkl'], 'moved')
+        self.assertEqual(outcomes['staging/b.pkl'], 'copy failed: SlowDown')
+        self.assertEqual(s3.delete_batches, [['staging/a.pkl']])
+
+    def test_partial_delete_errors(self):
+        s3 = FakeS3Client(delete_errors = ['staging/b.pkl'])
+
+        outcomes = self.move(s3, ['staging/a.pkl', 'staging/b.pkl',
+                                  'staging/c.pkl'])
+
+        self.assertEqual(outcomes, {'staging/a.pkl': 'moved',
+                                    'staging/b.pkl': 'delete failed: Access '
+                                                     'Denied',
+                                    'staging/c.pkl': 'moved'})
+
+    def test_delete_batches(self):
+        s3 = FakeS3Client()
+        fnames = ['staging/{}.pkl'.format(k) for k in range(2500)]
+
+        outcomes = self.move(s3, fnames)
+
+        self.assertEqual([len(batch) for batch in s3.delete_batches],
+                         [1000, 1000, 500])
+        self.assertEqual(sum(s3.delete_batches, []), fnames)
+        self.assertTrue(all(outcome == 'moved'
+                            for outcome in outcomes.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
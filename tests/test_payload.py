@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'get_data'))
+
+import io
+import json
+import unittest
+from unittest import mock
+
+import payload
+
+
+class FakeS3:
+    """
+    In-memory stand in for boto3.resource('s3'), only the Object calls used
+    by the payload functions.
+    """
+    
+    def __init__(self):
+        self.objects = {}
+    
+    def Object(self, bucket_name, key):
+        return FakeObject(self.objects, (bucket_name, key))
+
+
+class FakeObject:
+    
+    def __init__(self, objects, location):
+        self.objects = objects
+        self.location = location
+    
+    def put(self, Body):
+        self.objects[self.location] = Body
+    
+    def get(self):
+        return {'Body': io.BytesIO(self.objects[self.location])}
+    
+    def delete(self):
+        del self.objects[self.location]
+
+
+class TestPayload(unittest.TestCase):
+    
+    def setUp(self):
+        self.s3 = FakeS3()
+        patcher = mock.patch.object(payload.boto3, 'resource',
+                                    return_value = self.s3
+                                    )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_small_payload_inline(self):
+        columns = {'features': ['ID'], 'values': [['a', 'b']]}
+        
+        dumped = payload.dump_payload(columns, 'bucket', 'working', 'f')
+        
+        self.assertIs(dumped, columns)
+        self.assertEqual(self.s3.objects, {})
+        self.assertEqual(payload.load_payload(dumped), columns)
+
+    def test_large_payload_by_reference(self):
+        columns = {'features': ['Title'], 'values': [['x'*100]*50]}
+        
+        dumped = payload.dump_payload(columns, 'bucket', 'working', 'f',
+                                      max_inline_bytes = 1000
+                                      )
+        
+        self.assertEqual(dumped, {'s3_bucket': 'bucket',
+                                  's3_key': 'working/f.json.gz'
+                                 })
+        self.assertEqual(payload.load_payload(dumped), columns)
+        
+        payload.delete_payload(dumped)
+        self.assertEqual(self.s3.objects, {})
+
+    def test_size_includes_escaping(self):
+        # Short strings, so quotes are a large part of the encoded payload
+        columns = {'features': ['ID'], 'values': [['a']*100]}
+        once = len(json.dumps(columns))
+        twice = len(json.dumps(json.dumps(columns)))
+        
+        dumped = payload.dump_payload(columns, 'bucket', 'working', 'f',
+                                      max_inline_bytes = (once + twice)//2
+                                      )
+        
+        self.assertIn('s3_key', dumped)
+
+    def test_delete_inline_payload(self):
+        payload.delete_payload({'features': [], 'values': []})
+        self.assertEqual(self.s3.objects, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
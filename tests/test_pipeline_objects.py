@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'train_model'))
+
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+from scipy.sparse import issparse
+from xgboost.sklearn import XGBClassifier
+
+import pipeline_objects as po
+from feats_from_nlp import My_tfidf
+
+
+def client_error(code, message):
+    return ClientError({'Error': {'Code': code, 'Message': message}},
+                       'ExecuteStatement',
+                       )
+
+
+too_large = client_error('BadRequestException',
+                         'Database returned more than the allowed response '
+                         'size limit'
+                         )
+
+
+class FakeGetData(po.GetData):
+    """
+    GetData whose queries are answered by a function of the queried tags,
+    each response is just the list of tags.
+    """
+    
+    def __init__(self, answer):
+        self.answer = answer
+        self.queries = []
+    
+    def build_get_data_query(self, set_of_ids_to_query):
+        return list(set_of_ids_to_query)
+    
+    def make_sql_query(self, sql):
+        self.queries.append(sql)
+        return self.answer(sql)
+    
+    def response_to_frame(self, response):
+        return response
+
+
+class TestQueryBlock(unittest.TestCase):
+    
+    def test_response_too_large(self):
+        self.assertTrue(po.response_too_large(too_large))
+        self.assertFalse(po.response_too_large(
+                            client_error('BadRequestException',
+                                         'syntax error at or near "FROM"')
+                            ))
+        self.assertFalse(po.response_too_large(
+                            client_error('ThrottlingException',
+                                         'response size limit')
+                            ))
+
+    def test_split_until_small_enough(self):
+        def answer(tags):
+            if len(tags) > 2:
+                raise too_large
+            return tags
+        get_data = FakeGetData(answer)
+        
+        frames = get_data.query_block(list('abcdefg'))
+        
+        self.assertEqual(frames, [['a'], ['b', 'c'], ['d', 'e'], ['f', 'g']])
+
+    def test_other_errors_raised(self):
+        def answer(tags):
+            raise client_error('BadRequestException', 'syntax error')
+        get_data = FakeGetData(answer)
+        
+        with self.assertRaises(ClientError):
+            get_data.query_block(list('abcd'))
+        self.assertEqual(len(get_data.queries), 1)
+
+    def test_splits_capped(self):
+        def answer(tags):
+            raise too_large
+        get_data = FakeGetData(answer)
+        
+        with self.assertRaises(ClientError):
+            get_data.query_block(list('abcdefgh'), max_splits = 2)
+        # Halved twice, then the error is raised rather than splitting again
+        self.assertEqual(get_data.queries,
+                         [list('abcdefgh'), list('abcd'), list('ab')]
+                         )
+
+
+
+class TestDecodeColumn(unittest.TestCase):
+    
+    def decode(self, cells, type_name):
+        return po.decode_column([[cell] for cell in cells], 0, type_name)
+
+    def test_integers(self):
+        values = self.decode([{'longValue': 3}, {'longValue': -1}], 'int4')
+        
+        self.assertEqual(values.dtype, np.int64)
+        self.assertEqual(values.tolist(), [3, -1])
+
+    def test_integers_with_nulls(self):
+        values = self.decode([{'longValue': 3}, {'isNull': True}], 'int8')
+        
+        self.assertEqual(values.dtype, np.float64)
+        self.assertEqual(values[0], 3.0)
+        self.assertTrue(np.isnan(values[1]))
+
+    def test_floats(self):
+        values = self.decode([{'doubleValue': 0.5}, {'isNull': True}],
+                             'float4',
+                             )
+        
+        self.assertEqual(values.dtype, np.float64)
+        self.assertEqual(values[0], 0.5)
+        self.assertTrue(np.isnan(values[1]))
+
+    def test_bools(self):
+        values = self.decode([{'booleanValue': True},
+                              {'booleanValue': False}], 'bool')
+        
+        self.assertEqual(values.dtype, np.bool_)
+        self.assertEqual(values.tolist(), [True, False])
+        
+        values = self.decode([{'booleanValue': True}, {'isNull': True}],
+                             'bool',
+                             )
+        
+        self.assertEqual(values.dtype, object)
+        self.assertEqual(values.tolist(), [True, None])
+
+    def test_other_types(self):
+        values = self.decode([{'stringValue': 'a'}, {'isNull': True}],
+                             'varchar',
+                             )
+        
+        self.assertEqual(values.dtype, object)
+        self.assertEqual(values.tolist(), ['a', None])
+
+    def test_empty(self):
+        self.assertEqual(len(self.decode([], 'int4')), 0)
+        self.assertEqual(len(self.decode([], 'varchar')), 0)
+
+    def test_response_to_frame(self):
+        response = {'columnMetadata': [{'name': 'id', 'typeName': 'varchar'},
+                                       {'name': 'upvotes', 'typeName': 'int4'},
+                                      ],
+                    'records': [[{'stringValue': 'a'}, {'longValue': 3}],
+                                [{'stringValue': 'b'}, {'longValue': 5}],
+                               ],
+                   }
+        
+        df = po.GetData.response_to_frame(None, response)
+        
+        self.assertEqual(list(df.columns), ['id', 'upvotes'])
+        self.assertEqual(df['id'].tolist(), ['a', 'b'])
+        self.assertEqual(df['upvotes'].tolist(), [3, 5])
+
+
+def target_encoder_data():
+    X = pd.DataFrame({'sub': ['a', 'b', 'a', 'c', 'b', 'a', 'c', 'd'],
+                      'how': ['new', 'new', 'hot', 'hot',
+                              'hot', 'new', 'new', 'hot'],
+                     },
+                     index = [11, 5, 2, 9, 7, 3, 1, 4],
+                    )
+    y = pd.Series([1, 0, 0, 1, 1, 1, 0, 0], index = X.index)
+    
+    return X, y
+
+
+class TestMyTargetEncoder(unittest.TestCase):
+    
+    def test_vanilla_matches_groupby(self):
+        X, y = target_encoder_data()
+        
+        df = po.MyTargetEncoder().fit(X, y).transform(X)
+        
+        for feature in X.columns:
+            expected = y.groupby(X[feature]).transform('mean')
+            self.assertTrue(np.allclose(df[feature], expected))
+
+    def test_smoothing_matches_groupby(self):
+        X, y = target_encoder_data()
+        weight = 3
+        
+        encoder = po.MyTargetEncoder(how = 'additive_smoothing',
+                                     weight = weight,
+                                     ).fit(X, y)
+        df = encoder.transform(X)
+        
+        prior = y.mean()
+        for feature in X.columns:
+            grouped = y.groupby(X[feature]).agg(['count', 'sum'])
+            smoothed = ((grouped['sum'] + weight*prior)
+                        /(grouped['count'] + weight)
+                       )
+            self.assertTrue(np.allclose(df[feature],
+                                        X[feature].map(smoothed)
+                                        ))
+            self.assertEqual(set(encoder.all_means[feature]),
+                             set(grouped.index)
+                             )
+
+    def test_unseen_and_missing_get_prior(self):
+        X, y = target_encoder_data()
+        encoder = po.MyTargetEncoder().fit(X, y)
+        
+        X_new = pd.DataFrame({'sub': ['a', 'z', None], 'how': [None] * 3})
+        df = encoder.transform(X_new)
+        
+        self.assertAlmostEqual(df['sub'].iloc[0], y[X['sub'] == 'a'].mean())
+        self.assertTrue(np.allclose(df['sub'].iloc[1:], y.mean()))
+        self.assertTrue(np.allclose(df['how'], y.mean()))
+
+    def test_out_of_fold(self):
+        X, y = target_encoder_data()
+        folds = [(train, test) for train, test
+                 in po.KFold(n_splits = 2, shuffle = True,
+                             random_state = 0).split(X)
+                ]
+        
+        df = po.MyTargetEncoder(cv = 2, random_state = 0).fit_transform(X, y)
+        
+        # Each fold is encoded by the groupby means of the other fold
+        for train, test in folds:
+            X_train, y_train = X.iloc[train], y.iloc[train]
+            for feature in X.columns:
+                means = y_train.groupby(X_train[feature]).mean()
+                # Categories missing from the other fold take the prior
+                expected = (X[feature].iloc[test].map(means)
+                                                 .fillna(y.mean())
+                           )
+                self.assertTrue(np.allclose(df[feature].iloc[test],
+                                            expected
+                                            ))
+
+    def test_multipurpose_random_state(self):
+        X, y = target_encoder_data()
+        
+        encoder = po.MultipurposeEncoder(target_feats = ['sub', 'how'],
+                                         target_cv = 2,
+                                         target_random_state = 0,
+                                         )
+        df = encoder.fit_transform(X, y)
+        
+        self.assertEqual(encoder.target_enc.random_state, 0)
+        self.assertTrue(df.equals(po.MyTargetEncoder(cv = 2, random_state = 0)
+                                    .fit_transform(X, y)
+                                  ))
+
+
+class TestSparseOutput(unittest.TestCase):
+    
+    def setUp(self):
+        self.X = pd.DataFrame({'title': ['red fish', 'blue fish', 'one fish',
+                                         'two fish', 'red blue', 'one two',
+                                         ],
+                               'subreddit': ['a', 'b', 'c', 'a', 'b', 'c'],
+                               'upvotes': [1, 5, 2, 8, 3, 0],
+                               })
+        self.y = pd.Series([0, 1, 0, 1, 1, 0])
+
+    def test_one_hot_only(self):
+        encoder = po.MultipurposeEncoder(ohe_feats = ['subreddit'],
+                                         sparse_output = True,
+                                         )
+        encoded = encoder.fit_transform(self.X[['subreddit', 'upvotes']],
+                                        self.y,
+                                        )
+        
+        self.assertTrue(issparse(encoded))
+        self.assertEqual(encoder.feature_names,
+                         ['upvotes', 'subreddit_a', 'subreddit_b',
+                          'subreddit_c'],
+                         )
+        np.testing.assert_array_equal(encoded.toarray()[:3],
+                                      [[1, 1, 0, 0],
+                                       [5, 0, 1, 0],
+                                       [2, 0, 0, 1],
+                                       ],
+                                      )
+
+    def test_tfidf_through_to_classifier(self):
+        tfidf = My_tfidf('title', tfidf_num_feats = 4, preprocess = False)
+        encoder = po.MultipurposeEncoder(ohe_feats = ['subreddit'],
+                                         sparse_output = True,
+                                         )
+        
+        X = tfidf.fit(self.X).transform(self.X)
+        encoded = encoder.fit_transform(X, self.y)
+        
+        self.assertEqual(encoded.format, 'csr')
+        # 'one' and 'two' are stop words, only three words are left
+        self.assertEqual(encoder.feature_names,
+                         ['upvotes', 'tfidf_0', 'tfidf_1', 'tfidf_2',
+                          'subreddit_a', 'subreddit_b', 'subreddit_c'],
+                         )
+        # Tfidf values are stored sparse, only the words in each title
+        self.assertEqual(encoded[:, 1:4].nnz, 8)
+        
+        model = XGBClassifier(n_estimators = 2, max_depth = 2)
+        model.fit(encoded, self.y)
+        self.assertEqual(model.predict_proba(encoded).shape, (6, 2))
+
+
+class TestTargetFoldStats(unittest.TestCase):
+    
+    def setUp(self):
+        self.X, self.y = target_encoder_data()
+        self.X.loc[3, 'how'] = None
+        self.folds = list(po.KFold(n_splits = 4).split(self.X))
+        self.stats = po.TargetFoldStats(self.X, self.y, ['sub', 'how'],
+                                        self.folds,
+                                        )
+
+    def test_fit_from_stats_matches_data(self):
+        train, _ = self.folds[0]
+        X_train, y_train = self.X.iloc[train], self.y.iloc[train]
+        
+        encoder = po.MyTargetEncoder(stats = self.stats)
+        df = encoder.fit_transform(X_train, y_train)
+        
+        self.assertTrue(encoder.fit_from_stats)
+        # The folds of the statistics stand in for cv
+        expected = po.MyTargetEncoder().fit(X_train, y_train)
+        self.assertTrue(np.allclose(encoder.transform(self.X),
+                                    expected.transform(self.X)
+                                    ))
+        self.assertEqual(df.shape, X_train.shape)
+
+    def test_changed_values_not_taken_from_stats(self):
+        train, _ = self.folds[0]
+        X_train, y_train = self.X.iloc[train].copy(), self.y.iloc[train]
+        # Same index labels, other data
+        X_train['sub'] = X_train['sub'].iloc[::-1].to_numpy()
+        
+        encoder = po.MyTargetEncoder(stats = self.stats).fit(X_train, y_train)
+        
+        self.assertFalse(encoder.fit_from_stats)
+        expected = po.MyTargetEncoder().fit(X_train, y_train)
+        self.assertTrue(encoder.transform(X_train)
+                               .equals(expected.transform(X_train)))
+
+    def test_transform_checks_values(self):
+        train, _ = self.folds[0]
+        encoder = po.MyTargetEncoder(stats = self.stats)
+        encoder.fit(self.X.iloc[train], self.y.iloc[train])
+        expected = po.MyTargetEncoder().fit(self.X.iloc[train],
+                                            self.y.iloc[train]
+                                            )
+        
+        X_changed = self.X.copy()
+        X_changed['sub'] = 'b'
+        X_changed.loc[11, 'how'] = None
+        
+        self.assertIsNone(self.stats.row_codes(X_changed, 'sub',
+                                               np.arange(len(self.X))
+                                               ))
+        self.assertTrue(np.allclose(encoder.transform(X_changed),
+                                    expected.transform(X_changed)
+                                    ))
+
+
+class FakeTable(po.GetData):
+    """
+    GetData whose database table is a dataframe, holding just an id column.
+    """
+    
+    def __init__(self, ids):
+        self.set_ids(ids)
+    
+    def set_ids(self, ids):
+        self.table = pd.DataFrame({'id': pd.Series(ids, dtype = str)})
+        self.tags = self.table['id'].str.split('_', n = 1).str[1]
+    
+    def get_scrape_tag_counts(self):
+        return self.tags.value_counts().to_dict()
+    
+    def query_blocks(self, blocks, max_workers = 8):
+        return [self.table[self.tags.isin(block)] for block in blocks]
+
+
+class TestPartitions(unittest.TestCase):
+    
+    def setUp(self):
+        temp_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_directory.cleanup)
+        self.data_directory = temp_directory.name
+
+    def test_no_partitions(self):
+        df = FakeTable([]).load_partitions(self.data_directory)
+        
+        self.assertEqual(len(df), 0)
+        self.assertIn('id', df.columns)
+        self.assertIn('final_num_comments', df.columns)
+
+    def test_sync(self):
+        get_data = FakeTable(['a_tag1', 'b_tag1', 'c_tag2'])
+        
+        new_tags = get_data.sync_partitions(self.data_directory)
+        
+        self.assertEqual(sorted(new_tags), ['tag1', 'tag2'])
+        self.assertEqual(get_data.sync_partitions(self.data_directory), [])
+        
+        # A new tag, and rows added to an old one
+        get_data.set_ids(['a_tag1', 'b_tag1', 'c_tag2', 'd_tag2', 'e_tag3'])
+        
+        new_tags = get_data.sync_partitions(self.data_directory)
+        
+        self.assertEqual(sorted(new_tags), ['tag2', 'tag3'])
+        df = get_data.load_partitions(self.data_directory)
+        self.assertEqual(sorted(df['id']),
+                         ['a_tag1', 'b_tag1', 'c_tag2', 'd_tag2', 'e_tag3']
+                         )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'get_data'))
+
+import unittest
+
+import post_record as pr
+
+
+def post_features(k):
+    # A post part-way through the step function, as after pull_posts
+    return {'Title': 'Post number {}'.format(k),
+            'ID': 'id{}'.format(k),
+            'Gildings': {'gid_1': k},
+            'Upvotes': 10*k,
+            'Subreddit': 'aww',
+            'Edited': False if k % 2 else 1612137600.0,
+            'Post age': 1.5*k,
+           }
+
+
+class TestPostRecord(unittest.TestCase):
+    
+    def test_item_access(self):
+        record = pr.PostRecord.from_dict(post_features(3))
+        self.assertEqual(record['Upvotes'], 30)
+        self.assertEqual(record.Post_age, 4.5)
+        
+        record['Gold awarded'] = 2
+        self.assertEqual(record.to_dict()['Gold awarded'], 2)
+        
+        # Features not yet collected are unset
+        with self.assertRaises(KeyError):
+            record['Final upvotes']
+        self.assertNotIn('Final upvotes', record.to_dict())
+
+    def test_unknown_feature(self):
+        with self.assertRaises(KeyError):
+            pr.PostRecord.from_dict({'Not a feature': 1})
+
+
+class TestColumns(unittest.TestCase):
+    
+    def test_round_trip(self):
+        records = {'id{}'.format(k): pr.PostRecord.from_dict(post_features(k))
+                   for k in range(4)
+                  }
+        
+        columns = pr.records_to_columns(records)
+        
+        self.assertEqual(len(columns['features']), 7)
+        self.assertEqual(columns['values'][columns['features'].index('Upvotes')],
+                         [0, 10, 20, 30]
+                        )
+        
+        rebuilt = pr.records_from_columns(columns)
+        self.assertEqual(list(rebuilt), list(records))
+        for ID in records:
+            self.assertEqual(rebuilt[ID].to_dict(), records[ID].to_dict())
+
+    def test_missing_feature_is_none(self):
+        records = {'id1': pr.PostRecord.from_dict(post_features(1)),
+                   'id2': pr.PostRecord.from_dict({'ID': 'id2'}),
+                  }
+        columns = pr.records_to_columns(records)
+        self.assertEqual(columns['values'][columns['features'].index('Title')],
+                         ['Post number 1', None]
+                        )
+
+    def test_no_records(self):
+        self.assertEqual(pr.records_to_columns({}),
+                         {'features': [], 'values': []}
+                        )
+
+
+class TestFeaturesToColumns(unittest.TestCase):
+    
+    def test_matches_records_to_columns(self):
+        posts = [(features['ID'], features)
+                 for features in map(post_features, range(5))
+                ]
+        records = {ID: pr.PostRecord.from_dict(features)
+                   for ID, features in posts
+                  }
+        
+        columns = pr.features_to_columns(iter(posts))
+        
+        self.assertEqual(columns, pr.records_to_columns(records))
+        # Columns follow the order of feature_names, not of the dictionaries
+        self.assertEqual(columns['features'],
+                         ['Title', 'ID', 'Gildings', 'Upvotes', 'Edited',
+                          'Subreddit', 'Post age'
+                         ])
+
+    def test_skips_repeated_posts(self):
+        posts = [('id1', post_features(1)),
+                 ('id2', post_features(2)),
+                 ('id1', post_features(1)),
+                ]
+        columns = pr.features_to_columns(posts)
+        ID_column = columns['values'][columns['features'].index('ID')]
+        self.assertEqual(ID_column, ['id1', 'id2'])
+
+    def test_no_posts(self):
+        self.assertEqual(pr.features_to_columns([]),
+                         {'features': [], 'values': []}
+                        )
+
+
+if __name__ == '__main__':
+    unittest.main()
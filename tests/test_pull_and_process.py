@@ -5,28 +5,37 @@ Created on Fri Jan 15 13:12:37 2021
 @author: Dillo
 """
 
+import os
 import sys
-sys.path.append('../get_data')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'get_data'))
 
 import unittest
-import pull_and_process as pap
+import pull_posts as pap
 
 
 class TestPap(unittest.TestCase):
     
+    # Files are passed as the response of boto3's Object.get, {'Body': ...}
+    
     def test_get_auth(self):
-        test_auth = pap.get_auth('./test_auth.txt')
+        with open(os.path.join(os.path.dirname(__file__), 'test_auth.txt'),
+                  'rb'
+                  ) as f:
+            test_auth = pap.get_auth({'Body': f})
         self.assertEqual(test_auth.client_id, '555ABCD111')
         self.assertEqual(test_auth.client_secret, '1j5tr4katesttest')
         self.assertEqual(test_auth.user_agent, 'test_agent_please')
 
     def test_subreddit_list(self):
-        test_subreddit_list = (pap
-                               .get_subreddit_list('./test_subreddit_list.txt')
-                               )
+        with open(os.path.join(os.path.dirname(__file__),
+                               'test_subreddit_list.txt'
+                               ),
+                  'rb'
+                  ) as f:
+            test_subreddit_list = pap.get_subreddit_list({'Body': f})
         validation_list = ['subreddit1', 'subreddit2', 'subreddit3']
         self.assertEqual(test_subreddit_list, validation_list)
 
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
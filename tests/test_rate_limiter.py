@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'get_data'))
+
+from concurrent.futures import ThreadPoolExecutor
+import time
+import unittest
+
+from rate_limiter import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    
+    def test_waits_without_limit_state(self):
+        limiter = RateLimiter(min_remaining = 2)
+        start = time.monotonic()
+        limiter.wait()
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_reserves_from_budget(self):
+        limiter = RateLimiter(min_remaining = 2)
+        limiter.update({'X-Ratelimit-Remaining': '5',
+                        'X-Ratelimit-Reset': '60'
+                       })
+        limiter.wait()
+        self.assertEqual(limiter.remaining, 4)
+
+    def test_backoff_does_not_sleep(self):
+        limiter = RateLimiter()
+        start = time.monotonic()
+        limiter.backoff({'X-Ratelimit-Reset': '0.3'})
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.assertEqual(limiter.remaining, 0)
+
+    def test_workers_pause_together(self):
+        limiter = RateLimiter()
+        limiter.backoff({'X-Ratelimit-Reset': '0.3'})
+        
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers = 8) as executor:
+            for future in [executor.submit(limiter.wait) for _ in range(8)]:
+                future.result()
+        elapsed = time.monotonic() - start
+        
+        # One shared pause, not eight pauses one after another
+        self.assertGreaterEqual(elapsed, 0.25)
+        self.assertLess(elapsed, 1.0)
+        self.assertIsNone(limiter.remaining)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'get_data'))
+
+import time
+import unittest
+from types import SimpleNamespace
+
+from exceptions import ApiRetryAttemptsExceeded
+from reddit_session import RedditSession
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, body = None, headers = None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError('HTTP {}'.format(self.status_code))
+
+
+class FakeHttp:
+    """
+    Stands in for the session's requests.Session. Tokens are handed out in
+    turn, GET requests are answered from a list of responses (the last is
+    repeated).
+    """
+
+    def __init__(self, responses, expires_in = 3600):
+        self.responses = list(responses)
+        self.expires_in = expires_in
+        self.tokens = []
+        self.gets = []
+
+    def post(self, url, data, auth):
+        self.tokens.append('token{}'.format(len(self.tokens)))
+        return FakeResponse(200, {'access_token': self.tokens[-1],
+                                  'expires_in': self.expires_in,
+                                 })
+
+    def get(self, url, params, headers):
+        self.gets.append(headers['Authorization'])
+        if len(self.responses) > 1:
+            return self.responses.pop(0)
+        return self.responses[0]
+
+
+def make_session(responses, **kwargs):
+    auth = SimpleNamespace(client_id = 'id', client_secret = 'secret',
+                           user_agent = 'test_agent',
+                           )
+    session = RedditSession(auth, pool_size = 2)
+    session.http = FakeHttp(responses, **kwargs)
+
+    return session
+
+
+class TestRedditSession(unittest.TestCase):
+
+    def test_token_reused_until_expiry(self):
+        session = make_session([FakeResponse(200, {'data': 1})])
+
+        self.assertEqual(session.get('url'), {'data': 1})
+        session.get('url')
+        self.assertEqual(session.http.tokens, ['token0'])
+
+        # Within the expiry margin, a new token is requested first
+        session.token_expires_at = time.monotonic() + 30
+        session.get('url')
+        self.assertEqual(session.http.tokens, ['token0', 'token1'])
+        self.assertEqual(session.http.gets[-1], 'bearer token1')
+
+    def test_401_reauthenticates_once(self):
+        session = make_session([FakeResponse(401),
+                                FakeResponse(200, {'data': 1}),
+                                ])
+
+        self.assertEqual(session.get('url'), {'data': 1})
+        self.assertEqual(session.http.tokens, ['token0', 'token1'])
+        self.assertEqual(session.http.gets, ['bearer token0',
+                                             'bearer token1',
+                                             ])
+
+    def test_429_waits_for_reset(self):
+        session = make_session([FakeResponse(429, headers = {
+                                                'X-Ratelimit-Reset': '0.3'
+                                                }),
+                                FakeResponse(200, {'data': 1}),
+                                ])
+
+        start = time.monotonic()
+        self.assertEqual(session.get('url'), {'data': 1})
+        elapsed = time.monotonic() - start
+
+        # Paused for the reset given, not the 10s default
+        self.assertGreaterEqual(elapsed, 0.3)
+        self.assertLess(elapsed, 2)
+        self.assertEqual(len(session.http.gets), 2)
+
+    def test_retries_exceeded(self):
+        session = make_session([FakeResponse(429, headers = {
+                                                'X-Ratelimit-Reset': '0'
+                                                })])
+
+        with self.assertRaises(ApiRetryAttemptsExceeded):
+            session.get('url', max_attempts = 3)
+        self.assertEqual(len(session.http.gets), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
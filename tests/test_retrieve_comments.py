@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'get_data'))
+
+import unittest
+
+import numpy as np
+
+import retrieve_comments as rc
+
+
+def comment(created_utc, ups, gilded = 0, distinguished = None,
+            is_submitter = False, author_premium = False
+            ):
+    # Only the fields used by toplevel_comment_features
+    return {'data': {'created_utc': created_utc,
+                     'ups': ups,
+                     'gilded': gilded,
+                     'distinguished': distinguished,
+                     'is_submitter': is_submitter,
+                     'author_premium': author_premium,
+                    }}
+
+
+class TestToplevelCommentFeatures(unittest.TestCase):
+    
+    def test_features_per_post(self):
+        now = 1000.0
+        all_comments = [[comment(900, 10, gilded = 1, is_submitter = True),
+                         comment(800, 40, distinguished = 'moderator',
+                                 author_premium = True
+                                 ),
+                        ],
+                        [],
+                        [comment(990, 5, distinguished = 'special')],
+                       ]
+        
+        features = rc.toplevel_comment_features(all_comments, now = now)
+        
+        self.assertEqual(features.shape, (3, 6))
+        
+        # Upvote rates of the first post's comments are 0.1 and 0.2, note
+        #   that Std_up_rate has always held their variance
+        np.testing.assert_allclose(features[0],
+                                   [0.15, 0.0025, 0.5, 0.5, 0.5, 0.5]
+                                  )
+        # No comments, all features zero
+        np.testing.assert_allclose(features[1], np.zeros(6))
+        np.testing.assert_allclose(features[2], [0.5, 0, 0, 1, 0, 0])
+
+    def test_matches_single_post(self):
+        now = 5000.0
+        all_comments = [[comment(4000 + k, 3*k + 1, gilded = k % 2)
+                         for k in range(7)
+                        ],
+                        [comment(4500, 2)],
+                       ]
+        
+        batch = rc.toplevel_comment_features(all_comments, now = now)
+        for k, comments in enumerate(all_comments):
+            single = rc.toplevel_comment_features([comments], now = now)
+            np.testing.assert_allclose(batch[k], single[0])
+
+    def test_comment_value_missing_and_none(self):
+        self.assertEqual(rc.comment_value({}, 'gilded'), 0)
+        self.assertEqual(rc.comment_value({'ups': None}, 'ups'), 0)
+        self.assertEqual(rc.comment_value({'distinguished': 'admin'},
+                                          'distinguished'
+                                          ),
+                         1)
+
+
+class FakeSession:
+    """
+    Stands in for RedditSession, answering the three kinds of request made by
+    fetch_all_toplevel_comment_info_bulk and recording each url requested.
+    """
+    
+    def __init__(self, stream, num_comments, post_comments):
+        self.stream = stream
+        self.num_comments = num_comments
+        self.post_comments = post_comments
+        self.urls = []
+    
+    def get(self, url, params = None):
+        self.urls.append(url)
+        if url.endswith('/comments.json'):
+            return {'data': {'children': self.stream, 'after': None}}
+        if url.endswith('api/info.json'):
+            IDs = [fullname[3:] for fullname in params['id'].split(',')]
+            return {'data': {'children': [{'data': {'id': ID,
+                                                    'num_comments':
+                                                        self.num_comments[ID]
+                                                   }}
+                                          for ID in IDs
+                                         ]}}
+        ID = url.split('/comments/')[1][:-len('.json')]
+        return [{}, {'data': {'children': self.post_comments[ID]}}]
+
+
+def stream_comment(submission_id, created_utc, score, ups, gilded,
+                   top_level = True
+                   ):
+    data = comment(created_utc, ups, gilded = gilded)['data']
+    data['score'] = score
+    data['link_id'] = 't3_' + submission_id
+    data['parent_id'] = data['link_id'] if top_level else 't1_abc'
+    return {'data': data}
+
+
+class TestBulkComments(unittest.TestCase):
+    
+    def test_stream_then_fallback(self):
+        # new1 is within the stream window, old1 and old2 are older than it
+        posts_created = {'new1': 1000, 'old1': 100, 'old2': 100}
+        subm_IDs = [['new1', 'a'], ['old1', 'b'], ['old2', 'a']]
+        stream = [stream_comment('new1', 1200, score = 5, ups = 50,
+                                 gilded = 0
+                                 ),
+                  stream_comment('new1', 1100, score = 9, ups = 9,
+                                 gilded = 1
+                                 ),
+                  stream_comment('new1', 1050, score = 99, ups = 99,
+                                 gilded = 0, top_level = False
+                                 ),
+                  stream_comment('other', 500, score = 1, ups = 1,
+                                 gilded = 0
+                                 ),
+                 ]
+        session = FakeSession(stream,
+                              {'old1': 2, 'old2': 0},
+                              {'old1': [comment(200, 4, gilded = 1),
+                                        comment(300, 4, gilded = 1)
+                                       ]},
+                             )
+        
+        data = rc.fetch_all_toplevel_comment_info_bulk(session, subm_IDs,
+                                                       posts_created,
+                                                       num_top_comments = 1,
+                                                       base_url = 'api/'
+                                                       )
+        
+        # One stream page, one count lookup, one post with comments
+        self.assertEqual(len(session.urls), 3)
+        self.assertEqual(session.urls[2], 'api/r/b/comments/old1.json')
+        
+        # Highest-scoring top-level comment kept, not the most upvoted
+        self.assertEqual(data['new1'][2], 1.0)
+        self.assertEqual(data['old1'][2], 1.0)
+        self.assertEqual(data['old2'], (0.0, 0.0, 0.0, 0.0, 0.0, 0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'to_database'))
+
+import unittest
+
+import row_encoder
+
+
+class TestEncodeRows(unittest.TestCase):
+    
+    def test_sequences_put_in_table_order(self):
+        columns, values = row_encoder.encode_rows(['Upvotes', 'ID', 'Title'],
+                                                  [(10, 'a', 'x'),
+                                                   (20, 'b', 'y'),
+                                                  ])
+        
+        # Title, ID, Upvotes is the order of the schema
+        self.assertEqual(columns, ('Title', 'ID', 'Upvotes'))
+        self.assertEqual(values, [('x', 'a', 10), ('y', 'b', 20)])
+
+    def test_dicts(self):
+        rows = [{'Upvotes': 10, 'ID': 'a'}, {'ID': 'b', 'Upvotes': 20}]
+        
+        columns, values = row_encoder.encode_rows(['Upvotes', 'ID'], rows,
+                                                  rows_are_dicts = True,
+                                                  )
+        
+        self.assertEqual(columns, ('ID', 'Upvotes'))
+        self.assertEqual(values, [('a', 10), ('b', 20)])
+
+    def test_single_column(self):
+        columns, values = row_encoder.encode_rows(['ID'], [('a',), ('b',)])
+        
+        self.assertEqual(columns, ('ID',))
+        self.assertEqual(values, [('a',), ('b',)])
+
+    def test_encoder_reused(self):
+        columns, encode = row_encoder.compile_encoder(['ID', 'Title'])
+        
+        self.assertIs(row_encoder.compile_encoder(['ID', 'Title'])[1], encode)
+        self.assertIsNot(row_encoder.compile_encoder(['ID', 'Title'],
+                                                     rows_are_dicts = True)[1],
+                         encode)
+
+    def test_rejected_rows(self):
+        with self.assertRaises(ValueError):
+            row_encoder.encode_rows(['ID', 'Not_a_column'], [('a', 1)])
+        with self.assertRaises(ValueError):
+            row_encoder.encode_rows(['ID', 'ID'], [('a', 'a')])
+        with self.assertRaises(ValueError):
+            row_encoder.encode_rows(['ID', 'Title'], [('a', 'x'), ('b',)])
+        with self.assertRaises(ValueError):
+            row_encoder.encode_rows(['ID', 'Title'],
+                                    [{'ID': 'a', 'Author': 'x'}],
+                                    rows_are_dicts = True,
+                                    )
+
+
+if __name__ == '__main__':
+    unittest.main()
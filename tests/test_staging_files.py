@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'get_data'))
+
+import io
+import json
+import unittest
+
+import staging_files as sf
+from post_record import PostRecord
+
+
+def read_parquet(body):
+    import pyarrow.parquet as pq
+    
+    table = pq.read_table(io.BytesIO(body))
+    json_columns = json.loads(table.schema.metadata[b'json_columns'])
+    
+    return table.to_pydict(), json_columns
+
+
+class TestRecordsToParquet(unittest.TestCase):
+    
+    def test_column_types(self):
+        records = {'a': PostRecord.from_dict({'ID': 'a',
+                                              'Edited': False,
+                                              'Upvotes': 3,
+                                              'Upvote ratio': 0.5,
+                                              'Gildings': {'gid_1': 1},
+                                              'Title': None,
+                                             }),
+                   'b': PostRecord.from_dict({'ID': 'b',
+                                              'Edited': 1616426570.0,
+                                              'Upvotes': 4.0,
+                                              'Upvote ratio': None,
+                                              'Gildings': {},
+                                              'Title': 'A title',
+                                             }),
+                  }
+        
+        columns, json_columns = read_parquet(sf.records_to_parquet(records))
+        
+        self.assertEqual(sorted(json_columns), ['Edited', 'Gildings'])
+        self.assertEqual([json.loads(value) for value in columns['Edited']],
+                         [False, 1616426570.0]
+                         )
+        self.assertIs(json.loads(columns['Edited'][0]), False)
+        self.assertEqual(columns['Upvotes'], [3, 4])
+        self.assertEqual(columns['Upvote ratio'], [0.5, None])
+        self.assertEqual(columns['Title'], [None, 'A title'])
+
+    def test_is_plain_column(self):
+        self.assertTrue(sf.is_plain_column([1, 2.5, None]))
+        self.assertTrue(sf.is_plain_column([True, None, False]))
+        self.assertTrue(sf.is_plain_column([None, None]))
+        self.assertFalse(sf.is_plain_column([False, 1.5]))
+        self.assertFalse(sf.is_plain_column([1, 'one']))
+        self.assertFalse(sf.is_plain_column([[1], [2]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'to_database'))
+
+from datetime import datetime, timezone
+import unittest
+
+import transform_data_dicts_for_sql as tds
+
+
+fname = 'staging/gilded_data_sortedby_rising_03-17_at_1105utc.parquet'
+
+
+def make_post(ID, **changes):
+    post = {'Title': 'A title', 'Author': 'someone', 'ID': ID, 'Gilded': 0,
+            'Gildings': {'gid_1': 2}, 'Upvotes': 10, 'Upvote ratio': 0.9,
+            'Post time': 1616000000, 'Views': None, 'Discussion type': None,
+            'Distinguished': None, 'Contest mode': False,
+            'Content categories': None, 'Edited': False, 'Hidden': False,
+            'Crosspostable': True, 'Crossposts': 0, 'Meta': False,
+            'OC': False, 'Reddit media': False, 'Robot indexable': True,
+            'Selfpost': True, 'Video': False, 'Likes': None, 'Comments': 3,
+            'Adult content': False, 'Subreddit': 'pics',
+            'Created utc': 1615975000.0, 'Post age': 12.5,
+            'Upvote rate': 0.8, 'Comment rate': 0.24, 'avg_up_rate': 1,
+            'std_up_rate': 0, 'gild_rate': 0, 'distinguished_rate': 0,
+            'op_comment_rate': 0, 'premium_auth_rate': 0,
+            'Silver awarded': 0, 'Gold awarded': 1, 'Platinum awarded': 0,
+            'Final upvotes': 52, 'Final num comments': 9,
+           }
+    post.update(changes)
+    
+    return post
+
+
+class TestTransformColumns(unittest.TestCase):
+    
+    def setUp(self):
+        self.posts = [make_post('aaaaaa'),
+                      make_post('bbbbbb',
+                                Gildings = {'gid_2': 1, 'gid_3': 4},
+                                Views = '12',
+                                Likes = 'not a number',
+                                Distinguished = 'moderator',
+                                **{'Discussion type': 'CHAT',
+                                   'Content categories': ['drawing', 'art'],
+                                   'Edited': 1615976000.0,
+                                   'Created utc': 1615976500.0,
+                                  }),
+                     ]
+        self.data_columns = {name: [post[name] for post in self.posts]
+                             for name in self.posts[0]
+                            }
+
+    def test_matches_row_by_row(self):
+        columns, rows = tds.transform_columns_for_sql_schema(fname,
+                                                             self.data_columns,
+                                                             )
+        
+        expected = [tds.transform_dict_dtypes_for_sql_schema(fname, post)
+                    for post in self.posts
+                   ]
+        self.assertEqual(columns, list(expected[0].keys()))
+        self.assertEqual([dict(zip(columns, row)) for row in rows], expected)
+
+    def test_values(self):
+        columns, rows = tds.transform_columns_for_sql_schema(fname,
+                                                             self.data_columns,
+                                                             )
+        first, second = [dict(zip(columns, row)) for row in rows]
+        
+        self.assertNotIn('Gildings', columns)
+        self.assertEqual(first['ID'], 'aaaaaa_rising03171105')
+        self.assertEqual(first['Scrape_tag'], 'rising03171105')
+        self.assertEqual(first['How_sorted'], 'rising')
+        self.assertEqual(first['Scrape_time'],
+                         datetime(2021, 3, 17, 11, 5,
+                                  tzinfo = timezone.utc).timestamp()
+                         )
+        self.assertEqual((first['Initial_silver'],
+                          first['Initial_gold'],
+                          first['Initial_platinum']), (2, 0, 0))
+        self.assertEqual((second['Initial_silver'],
+                          second['Initial_gold'],
+                          second['Initial_platinum']), (0, 1, 4))
+        self.assertEqual((first['Views'], second['Views']), (0, 12))
+        self.assertEqual((first['Likes'], second['Likes']), (0, -1))
+        self.assertEqual((first['Distinguished'], second['Distinguished']),
+                         (False, True))
+        self.assertEqual(second['Discussion_type'], 'CHAT')
+        self.assertEqual((first['Content_categories'],
+                          second['Content_categories']), ('None', 'drawing'))
+        self.assertEqual((first['Edited'], second['Edited']), (False, True))
+        self.assertIsInstance(first['avg_up_rate'], float)
+        self.assertEqual(first['Upvote_ratio'], 0.9)
+
+    def test_empty_file(self):
+        data_columns = {name: [] for name in self.data_columns}
+        
+        columns, rows = tds.transform_columns_for_sql_schema(fname,
+                                                             data_columns,
+                                                             )
+        
+        self.assertIn('Scrape_time', columns)
+        self.assertEqual(rows, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,16 +5,21 @@ Created on Tue Feb  2 10:42:34 2021
 @author: Dillo
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import json
-import pickle as pkl
 
 import boto3
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
 
 from make_connection import make_connection_if_cold
-from transform_data_dicts_for_sql import transform_all_data_dicts_for_sql_schema
-from schema import create_table_string
+from transform_data_dicts_for_sql import transform_columns_for_sql_schema
+from ensure_table import ensure_table, forget_table
+from manifest import next_fnames
+from copy_rows import copy_rows_to_table
+from row_encoder import encode_rows
+from staging_files import read_staging_columns
         
 
 
@@ -22,13 +27,28 @@ from schema import create_table_string
 """
 Will only re-open connection to SQL table if one isn't already established,
 this takes advantage of the fact that AWS Lambda functions don't 
-necessarily terminate connections immediately after Lambda function completion
+necessarily terminate connections immediately after Lambda function completion.
+The connection is made while the function initializes, and checked again at
+the start of each invocation.
 """
 conn = make_connection_if_cold()
 
 
 
 
+"""
+Errors which mean the table no longer matches the one checked by ensure_table
+(it, its schema, or one of its columns was dropped), so it must be checked
+again. Any other error leaves the table as it was.
+"""
+table_changed_errors = (psycopg2.errors.InvalidSchemaName,
+                        psycopg2.errors.UndefinedTable,
+                        psycopg2.errors.UndefinedColumn,
+                        )
+
+
+
+
 def add_top_file_to_dbase(event, context):
     inputs_dict = json.loads(event['body'])    
     
@@ -37,9 +57,9 @@ def add_top_file_to_dbase(event, context):
     completed_dir = inputs_dict['completed_dir']
     error_dir = inputs_dict['error_dir']
     
-    fnames_list = inputs_dict['fnames_list']
     schema_name = inputs_dict['schema_name']
     table_name = inputs_dict['table_name']
+    ingest_mode = inputs_dict.get('ingest_mode', 'insert')
     """
     Given a list of file keys within the staging directory, grab the key at the
     top of the list, load it from s3 bucket, parse and transform the contents,
@@ -61,10 +81,18 @@ def add_top_file_to_dbase(event, context):
     fnames_list : list
         List of strings, the keys of all files within staging directory. Note 
         that the key strings also contain directory information.
+    manifest_directory, manifest_key, position : str, str, int
+        Passed instead of fnames_list when the files were found using the
+        manifest: the directory holding the manifest, the key of the saved
+        list of files, and the position in that list of the next file to be
+        loaded (see next_fnames).
     schema_name : str
         Name of the SQL table schema for data to be loaded in to.
     table_name : str
         Name of the SQL table name for data to be loaded in to.
+    ingest_mode : str, optional
+        How rows are written to the table, see write_rows. The default is
+        'insert'.
 
        
     Returns
@@ -85,41 +113,41 @@ def add_top_file_to_dbase(event, context):
 
     # Default is that there was no error in the procedure
     error = False
+    top_fname = None
     try:
         # Retrieve one file from list, to be added to dbase, then remove key
-        top_fname = fnames_list[0]
-        fnames_list.remove(top_fname)
+        fnames, list_state, num_names_left = next_fnames(bucket_name,
+                                                         inputs_dict,
+                                                         1,
+                                                         )
+        if len(fnames) == 0:
+            raise IndexError('No files left in the list to load')
+        top_fname = fnames[0]
         
         # Import data from file
         s3 = boto3.resource('s3')
         data_obj = s3.Object(bucket_name, top_fname)
         data_fetched = data_obj.get()
-        data_pickle = data_fetched['Body'].read()
-        data = pkl.loads(data_pickle)
-
-        # Transform data to fit table schema
-        transformed_data = transform_all_data_dicts_for_sql_schema(top_fname,
-                                                                   data,
-                                                                   )
-        # Create Posgresql commands to insert data
-        insert_str, values = convert_dict_to_insert_statement(schema_name,
-                                                              table_name,
-                                                              transformed_data,
-                                                              conn
-                                                             )
+        data_body = data_fetched['Body'].read()
+        data_columns = read_staging_columns(top_fname, data_body)
+
+        # Transform data to fit table schema, as rows in table order
+        columns, values = encode_rows(*transform_columns_for_sql_schema(
+                                                                top_fname,
+                                                                data_columns,
+                                                                ))
+        
+        # Re-use the connection if it is still alive, otherwise reconnect
+        conn = make_connection_if_cold()
+        
         # Open cursor within connection
         cur = conn.cursor()
         
-        # Create schema, if it doesn't exist
-        create_schema = "CREATE SCHEMA IF NOT EXISTS {}".format(schema_name)
-        cur.execute(create_schema)
-    
-        # Create table, if it doesn't exist
-        create_table  = create_table_string(schema_name, table_name)
-        cur.execute(create_table)
+        # Create schema and table, if not already done by this process
+        ensure_table(cur, schema_name, table_name)
         
-        # Execute insert command and commit to table
-        psycopg2.extras.execute_values(cur, insert_str, values)
+        # Write rows and commit to table
+        write_rows(cur, schema_name, table_name, columns, values, ingest_mode)
         conn.commit()
         
         # Close cursor
@@ -131,6 +159,13 @@ def add_top_file_to_dbase(event, context):
         print('Exception args: ', e.args)
         print('Exception ', e)
         error = True
+        # Without a file taken from the list there is nothing to move, so fail
+        #   the step function run rather than loop on the same list
+        if top_fname is None:
+            raise
+        # The table may have changed, check it again next time
+        if isinstance(e, table_changed_errors):
+            forget_table(schema_name, table_name)
     
     
     return_dict = {'bucket_name': bucket_name,
@@ -139,13 +174,14 @@ def add_top_file_to_dbase(event, context):
                    'error_dir': error_dir,
                    'schema_name': schema_name,
                    'table_name': table_name,
-                   'fnames_list': fnames_list,
+                   'ingest_mode': ingest_mode,
                    'fname_processed': top_fname
                    }
+    return_dict.update(list_state)
     
     return {
             'statusCode': 200,
-            'num_names_left': len(fnames_list),
+            'num_names_left': num_names_left,
             'error': error,
             'body': json.dumps(return_dict)
             }
@@ -153,6 +189,272 @@ def add_top_file_to_dbase(event, context):
 
 
 
+def add_top_files_to_dbase(event, context):
+    inputs_dict = json.loads(event['body'])    
+    
+    bucket_name = inputs_dict['bucket_name']
+    staging_dir = inputs_dict['staging_dir']
+    completed_dir = inputs_dict['completed_dir']
+    error_dir = inputs_dict['error_dir']
+    
+    schema_name = inputs_dict['schema_name']
+    table_name = inputs_dict['table_name']
+    batch_size = inputs_dict.get('batch_size', 25)
+    max_workers = inputs_dict.get('max_workers', 8)
+    ingest_mode = inputs_dict.get('ingest_mode', 'insert')
+    """
+    Bulk version of add_top_file_to_dbase: grab the top batch_size keys from
+    the list, load and transform those files concurrently, then insert the
+    rows of every file with a single statement. Files which cannot be loaded or
+    transformed, or whose rows cannot be inserted, are returned separately so
+    that they can be moved to the error directory; the rest of the batch is
+    still loaded.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    staging_dir : str
+        Name of directory inside bucket where files are currently located.
+    completed_dir : str
+        Name of directory inside bucket where files are to be moved if they are
+        correctly parsed and loaded in to SQL table.
+    error_dir : str
+        Name of directory inside bucket where files are to be moved if there is
+        an error in the process of parsing and loading.
+    fnames_list : list
+        List of strings, the keys of all files within staging directory. Note 
+        that the key strings also contain directory information.
+    manifest_directory, manifest_key, position : str, str, int
+        Passed instead of fnames_list when the files were found using the
+        manifest: the directory holding the manifest, the key of the saved
+        list of files, and the position in that list of the next file to be
+        loaded (see next_fnames).
+    schema_name : str
+        Name of the SQL table schema for data to be loaded in to.
+    table_name : str
+        Name of the SQL table name for data to be loaded in to.
+    batch_size : int, optional
+        The number of files to be loaded per invocation. The default is 25.
+    max_workers : int, optional
+        The number of files to be fetched from s3 at once. The default is 8.
+    ingest_mode : str, optional
+        How rows are written to the table, see write_rows. The default is
+        'insert'.
+
+       
+    Returns
+    -------
+    dict
+        Passes through all input values, with the batch of file keys removed
+        from fnames_list and instead passed as fnames_completed (loaded in to
+        the table) and fnames_error (an error occured). The dictionary also
+        explicitly passes the number of files left in the list and the number
+        of files with errors, for use by the AWS step function.
+        
+    """
+
+    # Retrieve a batch of files from list, to be added to dbase
+    batch_fnames, list_state, num_names_left = next_fnames(bucket_name,
+                                                           inputs_dict,
+                                                           batch_size,
+                                                           )
+
+    # Import and transform all files in the batch
+    transformed_files, fnames_error = load_and_transform_files(bucket_name,
+                                                               batch_fnames,
+                                                               max_workers,
+                                                               )
+    
+    fnames_completed = []
+    try:
+        # Re-use the connection if it is still alive, otherwise reconnect
+        conn = make_connection_if_cold()
+        
+        # Open cursor within connection
+        cur = conn.cursor()
+        
+        # Create schema and table, if not already done by this process
+        ensure_table(cur, schema_name, table_name)
+        
+        completed, failed = insert_transformed_files(cur,
+                                                     schema_name,
+                                                     table_name,
+                                                     transformed_files,
+                                                     ingest_mode,
+                                                     )
+        fnames_completed += completed
+        fnames_error += failed
+        
+        # Close cursor
+        cur.close()
+    
+    # If the table itself can't be reached, nothing in the batch was loaded
+    except Exception as e:
+        print('Exception type: ', type(e))
+        print('Exception args: ', e.args)
+        print('Exception ', e)
+        if isinstance(e, table_changed_errors):
+            forget_table(schema_name, table_name)
+        fnames_error += [fname for fname in transformed_files.keys()
+                         if fname not in fnames_completed
+                        ]
+    
+    print('{} files loaded, {} errors'.format(len(fnames_completed),
+                                              len(fnames_error)
+                                             ))
+    
+    return_dict = {'bucket_name': bucket_name,
+                   'staging_dir': staging_dir,
+                   'completed_dir': completed_dir,
+                   'error_dir': error_dir,
+                   'schema_name': schema_name,
+                   'table_name': table_name,
+                   'batch_size': batch_size,
+                   'max_workers': max_workers,
+                   'ingest_mode': ingest_mode,
+                   'fnames_completed': fnames_completed,
+                   'fnames_error': fnames_error,
+                   }
+    return_dict.update(list_state)
+    
+    return {
+            'statusCode': 200,
+            'num_names_left': num_names_left,
+            'num_errors': len(fnames_error),
+            'body': json.dumps(return_dict)
+            }
+
+
+
+
+def load_and_transform_files(bucket_name, fnames, max_workers = 8):
+    """
+    Load a set of staged files from the s3 bucket concurrently, and transform
+    each to fit the SQL table schema.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    fnames : list
+        List of strings, the keys of the files to be loaded.
+    max_workers : int, optional
+        The number of files to be fetched at once. The default is 8.
+
+    Returns
+    -------
+    transformed_files : dict
+        Keys are the file keys which were loaded and transformed, values are
+        tuples of the column names and rows of the transformed data, in table
+        order (see transform_columns_for_sql_schema and encode_rows).
+    fnames_error : list
+        The file keys which could not be loaded or transformed.
+
+    """
+    
+    # Clients (unlike resources) may be shared between threads
+    s3_client = boto3.client('s3')
+    
+    def load_and_transform_file(fname):
+        data_fetched = s3_client.get_object(Bucket = bucket_name, Key = fname)
+        data_body = data_fetched['Body'].read()
+        data_columns = read_staging_columns(fname, data_body)
+        
+        return encode_rows(*transform_columns_for_sql_schema(fname,
+                                                             data_columns,
+                                                             ))
+    
+    transformed_files = {}
+    fnames_error = []
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {fname: executor.submit(load_and_transform_file, fname)
+                   for fname in fnames
+                  }
+        for fname, future in futures.items():
+            try:
+                transformed_files[fname] = future.result()
+            except Exception as e:
+                print('Error loading {}: {}'.format(fname, e))
+                fnames_error.append(fname)
+    
+    return transformed_files, fnames_error
+
+
+
+
+def insert_transformed_files(cur, schema_name, table_name, transformed_files,
+                             ingest_mode = 'insert'
+                             ):
+    """
+    Insert the rows of many transformed files in to the SQL table. The rows of
+    all files sharing the same columns are merged and inserted with a single
+    statement; if that statement fails then each file is inserted on its own,
+    so that only the files at fault are reported as errors.
+
+    Parameters
+    ----------
+    cur : psycopg2 cursor object
+        Cursor of an autocommit connection to the database.
+    schema_name : str
+        Name of the SQL table schema for data to be loaded in to.
+    table_name : str
+        Name of the SQL table name for data to be loaded in to.
+    transformed_files : dict
+        Keys are file keys, values are tuples of the column names and rows of
+        the transformed data of that file.
+    ingest_mode : str, optional
+        How rows are written to the table, see write_rows. The default is
+        'insert'.
+
+    Returns
+    -------
+    fnames_completed : list
+        The file keys whose rows were inserted.
+    fnames_error : list
+        The file keys whose rows could not be inserted.
+
+    """
+    
+    # Group the files by their set of columns
+    batches = {}
+    for fname, (columns, values) in transformed_files.items():
+        if len(values) == 0:
+            # Nothing to insert
+            batches.setdefault(None, {})[fname] = []
+            continue
+        batches.setdefault(tuple(columns), {})[fname] = values
+    
+    fnames_completed = list(batches.pop(None, {}).keys())
+    fnames_error = []
+    for columns, files_values in batches.items():
+        all_values = [row for values in files_values.values()
+                          for row in values
+                     ]
+        try:
+            write_rows(cur, schema_name, table_name, columns, all_values,
+                       ingest_mode,
+                       )
+            fnames_completed += list(files_values.keys())
+        except Exception as e:
+            print('Merged insert failed, inserting file-by-file: ', e)
+            if isinstance(e, table_changed_errors):
+                forget_table(schema_name, table_name)
+            for fname, values in files_values.items():
+                try:
+                    write_rows(cur, schema_name, table_name, columns, values,
+                               ingest_mode,
+                               )
+                    fnames_completed.append(fname)
+                except Exception as e:
+                    print('Error inserting {}: {}'.format(fname, e))
+                    fnames_error.append(fname)
+    
+    return fnames_completed, fnames_error
+
+
+
+
 def convert_dict_to_insert_statement(schema_name, table_name, data_dict, conn):
     """
     Given a python dictionary, build an insert statement that inserts all dict
@@ -183,26 +485,128 @@ def convert_dict_to_insert_statement(schema_name, table_name, data_dict, conn):
 
     """
     
-    # Get a Reddit submission ID to access one of the internal data-dicts
-    a_key = list(data_dict.keys())[0]
+    columns, values = convert_dict_to_rows(data_dict)
+    insert_str = insert_statement(schema_name, table_name, columns)
+    
+    return insert_str, values
+
+
+
+
+def convert_dict_to_rows(data_dict):
+    """
+    Unpack a python dictionary of instance data in to a list of columns and a
+    list of rows, using the schema to fix the order of the columns (see
+    encode_rows).
+
+    Parameters
+    ----------
+    data_dict : dict
+        Python dictionary containing all data to be inserted, as in
+        convert_dict_to_insert_statement.
+
+    Raises
+    ------
+    ValueError
+        An instance doesn't have the same keys as the first, or has a key which
+        isn't a column of the table.
+
+    Returns
+    -------
+    columns : tuple
+        The column names, those of the first instance in table order.
+    values : list
+        One tuple of values per instance, in the same order as columns.
+
+    """
+    
+    # Use the first internal dict (containing all instance/Reddit post data)
+    #   to find the set of column names, every other dict must match it
+    a_key = next(iter(data_dict))
     
-    # Use the internal dict (containing all instance/Reddit post data) to 
-    #   build the set of column names for the table
-    columns = data_dict[a_key].keys()
+    columns, values = encode_rows(list(data_dict[a_key].keys()),
+                                  list(data_dict.values()),
+                                  rows_are_dicts = True,
+                                  )
+    
+    return columns, values
+
+
+
+
+def insert_statement(schema_name, table_name, columns):
+    """
+    Build the insert statement used by psycopg2.extras.execute_values, rows
+    whose ID is already in the table are skipped.
+
+    Parameters
+    ----------
+    schema_name : str
+        The name of the sql schema data is to be inserted in to.
+    table_name : str
+        The name of the sql table within the schema.
+    columns : list
+        The names of the columns to be inserted.
+
+    Returns
+    -------
+    insert_str : str
+        The SQL insert command, with a placeholder for the values.
+
+    """
     
-    # Construct the insert statement
     insert_str = '''INSERT INTO {}.{} ({}) VALUES %s 
                     ON CONFLICT (ID) DO NOTHING'''.format(schema_name,
                                                           table_name,
                                                           ','.join(columns)
                                                          )
     
-    # Unpack the values to be inserted
-    values = [[value for value in data_dict[key].values()] 
-              for key in data_dict.keys()]
-    
-    return insert_str, values
+    return insert_str
+
+
+
+
+def write_rows(cur, schema_name, table_name, columns, values,
+               ingest_mode = 'insert'
+               ):
+    """
+    Write rows to the SQL table, skipping any whose ID is already present.
 
+    Parameters
+    ----------
+    cur : psycopg2 cursor object
+        Cursor of an autocommit connection to the database.
+    schema_name : str
+        Name of the SQL table schema for data to be loaded in to.
+    table_name : str
+        Name of the SQL table name for data to be loaded in to.
+    columns : list
+        The names of the columns to be written.
+    values : list
+        One list of values per row, in the same order as columns.
+    ingest_mode : str, optional
+        Either 'insert', a multi-row INSERT statement built by
+        psycopg2.extras.execute_values, or 'copy', which streams the rows in
+        to a temporary table (see copy_rows_to_table). The default is 'insert'.
 
+    Raises
+    ------
+    ValueError
+        The ingest mode is not recognised.
 
+    Returns
+    -------
+    None.
 
+    """
+    
+    if ingest_mode == 'insert':
+        insert_str = insert_statement(schema_name, table_name, columns)
+        # One page, so that all rows are sent as one statement
+        psycopg2.extras.execute_values(cur, insert_str, values,
+                                       page_size = max(len(values), 1),
+                                       )
+    elif ingest_mode == 'copy':
+        copy_rows_to_table(cur, schema_name, table_name, columns, values)
+    else:
+        raise ValueError('Unknown ingest mode: ' + ingest_mode)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+
+
+
+def copy_rows_to_table(cur, schema_name, table_name, columns, values):
+    """
+    Stream rows to the database with COPY FROM STDIN, which avoids building
+    and parsing a large INSERT statement. The rows are copied in to a
+    temporary table shaped like the target table, then merged in to it with
+    INSERT ... SELECT ... ON CONFLICT (ID) DO NOTHING, so that duplicate IDs
+    are skipped exactly as in the 'insert' mode. Everything happens within one
+    transaction, the temporary table is dropped when it commits.
+
+    Parameters
+    ----------
+    cur : psycopg2 cursor object
+        Cursor of an autocommit connection to the database.
+    schema_name : str
+        Name of the SQL table schema for data to be loaded in to.
+    table_name : str
+        Name of the SQL table name for data to be loaded in to.
+    columns : list
+        The names of the columns to be written.
+    values : list
+        One list of values per row, in the same order as columns.
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    column_str = ','.join(columns)
+    
+    # Encode all rows as CSV, held in memory
+    buffer = rows_to_csv(values)
+    
+    # Connection is autocommit, so the transaction must be opened explicitly
+    cur.execute('BEGIN')
+    try:
+        cur.execute('''CREATE TEMP TABLE copy_staging
+                       (LIKE {}.{} INCLUDING DEFAULTS)
+                       ON COMMIT DROP'''.format(schema_name, table_name)
+                    )
+        cur.copy_expert('''COPY copy_staging ({}) FROM STDIN
+                           WITH (FORMAT csv)'''.format(column_str),
+                        buffer,
+                        )
+        cur.execute('''INSERT INTO {}.{} ({})
+                       SELECT {} FROM copy_staging
+                       ON CONFLICT (ID) DO NOTHING'''.format(schema_name,
+                                                             table_name,
+                                                             column_str,
+                                                             column_str,
+                                                            )
+                    )
+        cur.execute('COMMIT')
+    except Exception:
+        cur.execute('ROLLBACK')
+        raise
+
+
+
+
+def rows_to_csv(values):
+    """
+    Encode rows as the CSV text read by COPY ... WITH (FORMAT csv).
+
+    Parameters
+    ----------
+    values : list
+        One list of values per row.
+
+    Returns
+    -------
+    buffer : io.StringIO
+        The CSV text, positioned at its start.
+
+    """
+    
+    buffer = io.StringIO()
+    for row in values:
+        buffer.write(','.join(csv_field(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    
+    return buffer
+
+
+
+
+def csv_field(value):
+    """
+    Encode a single value as a field of a CSV row for COPY. Strings are always
+    quoted, so that an empty string is distinguished from NULL (an empty,
+    unquoted field).
+
+    Parameters
+    ----------
+    value : (any)
+        The value to be encoded, None is written as NULL.
+
+    Returns
+    -------
+    field : str
+        The CSV field.
+
+    """
+    
+    if value is None:
+        return ''
+    elif isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    elif isinstance(value, float) and value.is_integer():
+        # Integral floats are also accepted by integer columns this way
+        return str(int(value))
+    else:
+        return str(value)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+from schema import (create_table_string, column_definitions, indexed_columns,
+                    column_backfills
+                    )
+
+
+
+
+"""
+Tables which have already been checked against the schema by this process.
+Kept alive between warm invocations of a Lambda function, in the same way as
+the database connection, so that steady-state loads skip DDL entirely.
+"""
+ensured_tables = set()
+
+
+
+
+def ensure_table(cur, schema_name, table_name):
+    """
+    Make sure the table exists and has every column and index in the schema,
+    the first time it is used by this process. The table's columns are read
+    from the Postgresql catalog: if there are none then the schema and table
+    are created, otherwise any columns added to schema.columns since the table
+    was built are added to it (and filled in for existing rows, where
+    schema.column_backfills says how).
+
+    Parameters
+    ----------
+    cur : psycopg2 cursor object
+        Cursor of an autocommit connection to the database.
+    schema_name : str
+        Name of the SQL table schema.
+    table_name : str
+        Name of the SQL table.
+
+    Returns
+    -------
+    checked : bool
+        Whether the catalog was checked, False if the table had already been
+        ensured by this process.
+
+    """
+    
+    if (schema_name, table_name) in ensured_tables:
+        return False
+    
+    existing = existing_columns(cur, schema_name, table_name)
+    
+    if len(existing) == 0:
+        print('Creating table {}.{}'.format(schema_name, table_name))
+        cur.execute('CREATE SCHEMA IF NOT EXISTS {}'.format(schema_name))
+        cur.execute(create_table_string(schema_name, table_name))
+    else:
+        # Unquoted names are stored in lower case by Postgresql
+        missing = [definition for name, definition in column_definitions()
+                   if name.lower() not in existing
+                  ]
+        for definition in missing:
+            print('Adding column to {}.{}: {}'.format(schema_name, table_name,
+                                                       definition
+                                                      ))
+            cur.execute('''ALTER TABLE {}.{}
+                           ADD COLUMN IF NOT EXISTS {}'''.format(schema_name,
+                                                                 table_name,
+                                                                 definition,
+                                                                )
+                        )
+            name = definition.split()[0]
+            if name in column_backfills:
+                print('Filling in column', name)
+                cur.execute('''UPDATE {}.{} SET {} = {}
+                               WHERE {} IS NULL'''.format(schema_name,
+                                                          table_name,
+                                                          name,
+                                                          column_backfills[name],
+                                                          name,
+                                                         )
+                            )
+    
+    ensure_indexes(cur, schema_name, table_name)
+    
+    ensured_tables.add((schema_name, table_name))
+    
+    return True
+
+
+
+
+def ensure_indexes(cur, schema_name, table_name):
+    """
+    Create any of the indexes in schema.indexed_columns which the table is
+    missing.
+
+    Parameters
+    ----------
+    cur : psycopg2 cursor object
+        Cursor of an autocommit connection to the database.
+    schema_name : str
+        Name of the SQL table schema.
+    table_name : str
+        Name of the SQL table.
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    cur.execute('''SELECT indexname FROM pg_catalog.pg_indexes
+                   WHERE schemaname = %s AND tablename = %s''',
+                (schema_name.lower(), table_name.lower()),
+                )
+    existing = {row[0] for row in cur.fetchall()}
+    
+    for column in indexed_columns:
+        index_name = '{}_{}_idx'.format(table_name, column).lower()
+        if index_name not in existing:
+            print('Creating index', index_name)
+            cur.execute('''CREATE INDEX IF NOT EXISTS {}
+                           ON {}.{} ({})'''.format(index_name,
+                                                   schema_name,
+                                                   table_name,
+                                                   column,
+                                                  )
+                        )
+
+
+
+
+def forget_table(schema_name, table_name):
+    """
+    Remove a table from the registry so that it is checked again on next use,
+    e.g. after an error which may mean the table was dropped.
+
+    Parameters
+    ----------
+    schema_name : str
+        Name of the SQL table schema.
+    table_name : str
+        Name of the SQL table.
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    ensured_tables.discard((schema_name, table_name))
+
+
+
+
+def existing_columns(cur, schema_name, table_name):
+    """
+    Query the Postgresql catalog for the columns of a table.
+
+    Parameters
+    ----------
+    cur : psycopg2 cursor object
+        Cursor of a connection to the database.
+    schema_name : str
+        Name of the SQL table schema.
+    table_name : str
+        Name of the SQL table.
+
+    Returns
+    -------
+    columns : set
+        The (lower case) names of the table's columns, empty if the table does
+        not exist.
+
+    """
+    
+    cur.execute('''SELECT a.attname
+                   FROM pg_catalog.pg_attribute a
+                   JOIN pg_catalog.pg_class c ON a.attrelid = c.oid
+                   JOIN pg_catalog.pg_namespace n ON c.relnamespace = n.oid
+                   WHERE n.nspname = %s AND c.relname = %s
+                     AND a.attnum > 0 AND NOT a.attisdropped''',
+                (schema_name.lower(), table_name.lower()),
+                )
+    
+    return {row[0] for row in cur.fetchall()}
@@ -9,6 +9,8 @@ import json
 
 import boto3
 
+from manifest import new_manifest_entries, write_batch_manifest
+
 
 def get_fnames(event, context):
     
@@ -19,6 +21,7 @@ def get_fnames(event, context):
     
     schema_name = event['schema_name']
     table_name = event['table_name']
+    manifest_directory = event.get('manifest_directory')
     
     """
     Retrieves list of file keys within an AWS s3 bucket, these files will
@@ -41,28 +44,55 @@ def get_fnames(event, context):
         Name of the SQL table schema for data to be loaded in to.
     table_name : str
         Name of the SQL table name for data to be loaded in to.
+    manifest_directory : str, optional
+        Name of directory inside bucket holding the manifest of staged files
+        (see manifest.py). If given, only files staged since the last run
+        which finished are loaded, and they are passed on by reference to a
+        saved list rather than listed in the response. The default is None,
+        list every file in staging_dir.
 
     Returns
     -------
     dict
         Returns all the above info for next function in the procedure, with the
-        addition of the list of file keys located within staging_dir.
+        addition of the list of file keys located within staging_dir (or the
+        manifest_key of the saved list, and the position within it). The
+        number of files to be loaded is also passed explicitly.
 
     """    
     
     
-    files_iterator = bucket_contents_iterator(bucket_name, staging_dir)
+    if manifest_directory is None:
+        files_iterator = bucket_contents_iterator(bucket_name, staging_dir)
     
-    # Iterate through files, append their keys to a list
-    fnames_list = []
-    for metadata in files_iterator:
-        fname = metadata['Key']
-        fnames_list.append(fname)
+        # Iterate through files, append their keys to a list
+        fnames_list = []
+        for metadata in files_iterator:
+            fname = metadata['Key']
+            fnames_list.append(fname)
     
-    # Occasionally will pick up the directory name itself inside list, not sure
-    #   why, but if its there it must be deleted from list
-    if staging_dir + '/' in fnames_list:
-        fnames_list.remove(staging_dir + '/')
+        # Occasionally will pick up the directory name itself inside list, not
+        #   sure why, but if its there it must be deleted from list
+        if staging_dir + '/' in fnames_list:
+            fnames_list.remove(staging_dir + '/')
+        
+        list_state = {'fnames_list': fnames_list}
+    else:
+        fnames_list, cursor = new_manifest_entries(bucket_name,
+                                                   manifest_directory,
+                                                   )
+        # The cursor is saved with the list, and only moves past these files
+        #   once they have all been loaded (see finish_batch)
+        manifest_key = write_batch_manifest(bucket_name,
+                                            manifest_directory,
+                                            fnames_list,
+                                            cursor,
+                                            )
+        
+        list_state = {'manifest_directory': manifest_directory,
+                      'manifest_key': manifest_key,
+                      'position': 0,
+                     }
     
     
     return_dict = {'bucket_name': bucket_name,
@@ -71,11 +101,17 @@ def get_fnames(event, context):
                    'error_dir': error_dir,
                    'schema_name': schema_name,
                    'table_name': table_name,
-                   'fnames_list': fnames_list
                    }
+    return_dict.update(list_state)
+    
+    # Loading settings (see add_top_files_to_dbase), if given
+    for key in ['batch_size', 'max_workers', 'ingest_mode']:
+        if key in event:
+            return_dict[key] = event[key]
     
     return {
             'statusCode': 200,
+            'num_names_left': len(fnames_list),
             'body': json.dumps(return_dict)
             }
     
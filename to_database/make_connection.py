@@ -15,15 +15,28 @@ from get_db_auth import get_db_auth
 
 
 
+"""
+Module-level connection and credentials. AWS Lambda keeps these alive between
+warm invocations of a function, so a warm invocation needs neither the S3 GET
+of the auth file nor a new connection.
+"""
+conn = None
+db_auth = None
+
+
+
+
 def make_connection_if_cold():
 
     bucket_name = os.environ['bucket_name']
     db_auth_fname = os.environ['db_auth_fname']
     """
-    Make connection if connection doesn't already exist. This takes advantage of 
+    Make connection if connection doesn't already exist. This takes advantage of
     AWS Lambda's ability to leave connections open temporarily if the function
     is called regularly. No need to wait to establish connection if its still open.
- 
+    The existing connection is pinged first, since the database may have
+    dropped it while the Lambda function was idle.
+
     Parameters
     ----------
     bucket_name : str
@@ -31,42 +44,72 @@ def make_connection_if_cold():
     db_auth_fname : str
         Filename/AWS s3 object key for txt file containing keys for AWS Aurora
         Posgresql database access.
-    
+
     Returns
     -------
     conn : psycopg2 connection object
         Contains database connection data and authorization.
 
     """
-    
-    try:
-        if conn.closed == 0: # Zero if connection is still open
-            pass
-        else:
-            # Nonzero if no connection established
-            print('No connection, now establishing')
-            conn = make_connection(bucket_name, db_auth_fname)
-            print('Connection to dbase made')
-    except NameError:
-            # If no connection then 'conn' doesn't exist
-            print('Error when searching for connection - now establishing')
-            conn = make_connection(bucket_name, db_auth_fname)
-            print('Connection to dbase made, moving to handler function')
+
+    global conn
+
+    if conn is None:
+        print('No connection, now establishing')
+        conn = make_connection(bucket_name, db_auth_fname)
+        print('Connection to dbase made')
+    elif not connection_is_alive(conn):
+        print('Connection lost, now re-establishing')
+        close_quietly(conn)
+        conn = make_connection(bucket_name, db_auth_fname)
+        print('Connection to dbase made')
+
     return conn
 
 
 
 
-def make_connection(bucket_name, db_auth_fname):
+def connection_is_alive(conn):
     """
-    Connect to AWS Aurora Postgresql database.
+    Check that a connection is open and that the database still answers on it.
 
     Parameters
     ----------
-    bucket_name : TYPE
-        DESCRIPTION.
-    db_auth_fname : TYPE
-        DESCRIPTION.
+    conn : psycopg2 connection object
+        The connection to be checked.
+
+    Returns
+    -------
+    bool
+        Whether the connection can be used.
+
+    """
+
+    if conn.closed != 0: # Zero if connection is still open
+        return False
+
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.fetchone()
+        cur.close()
+    except psycopg2.Error:
+        return False
+
+    return True
+
+
+
+
+def close_quietly(conn):
+    """
+    Close a connection which is no longer wanted, ignoring any error (it is
+    most likely already broken).
+
+    Parameters
+    ----------
+    conn : psycopg2 connection object
+        The connection to be closed.
 
     Returns
     -------
@@ -74,31 +117,105 @@ def make_connection(bucket_name, db_auth_fname):
 
     """
 
-    
-    """ 
-    Set up call to AWS S3 bucket that contains the file for Reddit API 
-    authorization.
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+
+
+def get_db_auth_if_cold(bucket_name, db_auth_fname):
     """
-    s3 = boto3.resource('s3')
-    
-    # Load Reddit auth data
-    db_auth_obj = s3.Object(bucket_name, db_auth_fname)
-    db_auth_file = db_auth_obj.get()
-    
-    # Get auth object
-    db_auth = get_db_auth(db_auth_file)
+    Load the database credentials from the s3 bucket, unless they have already
+    been loaded by this process.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    db_auth_fname : str
+        Filename/AWS s3 object key for txt file containing keys for AWS Aurora
+        Posgresql database access.
+
+    Returns
+    -------
+    db_auth : get_db_auth
+        Authorization object with properites needed to access the SQL table.
+
+    """
+
+    global db_auth
+
+    if db_auth is None:
+        """
+        Set up call to AWS S3 bucket that contains the file for database
+        authorization.
+        """
+        s3 = boto3.resource('s3')
+
+        # Load database auth data
+        db_auth_obj = s3.Object(bucket_name, db_auth_fname)
+        db_auth_file = db_auth_obj.get()
+
+        # Get auth object
+        db_auth = get_db_auth(db_auth_file)
+
+    return db_auth
+
+
+
+
+def connection_kwargs(db_auth):
+    """
+    Keyword arguments of psycopg2.connect for a set of credentials.
+
+    Parameters
+    ----------
+    db_auth : get_db_auth
+        Authorization object with properites needed to access the SQL table.
+
+    Returns
+    -------
+    dict
+        Keyword arguments to be passed to psycopg2.connect.
+
+    """
+
+    return {'host':     db_auth.ENDPOINT,
+            'port':     db_auth.PORT,
+            'dbname':   db_auth.DBNAME,
+            'user':     db_auth.USR,
+            'password': db_auth.DBPWD,
+           }
 
-    # Make connection
-    conn = psycopg2.connect(host     = db_auth.ENDPOINT,
-                            port     = db_auth.PORT,
-                            dbname   = db_auth.DBNAME,
-                            user     = db_auth.USR,
-                            password = db_auth.DBPWD,
-                           )
 
-    conn.autocommit = True
-    
-    return conn
 
 
+def make_connection(bucket_name, db_auth_fname):
+    """
+    Connect to AWS Aurora Postgresql database.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    db_auth_fname : str
+        Filename/AWS s3 object key for txt file containing keys for AWS Aurora
+        Posgresql database access.
+
+    Returns
+    -------
+    conn : psycopg2 connection object
+        Contains database connection data and authorization.
+
+    """
 
+    db_auth = get_db_auth_if_cold(bucket_name, db_auth_fname)
+
+    # Make connection
+    conn = psycopg2.connect(**connection_kwargs(db_auth))
+
+    conn.autocommit = True
+
+    return conn
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import datetime, timedelta
+
+import boto3
+
+
+
+
+"""
+Layout of the manifest directory within the s3 bucket:
+    entries/  one object per staged file, written by fetch_gilds. Keys begin
+              with the time the file was staged, bodies are the staging key.
+    cursor    json, the key of the last entry handed to the loader and the
+              keys of the entries handed out shortly before it (see
+              overlap_seconds).
+    batches/  one json object per run of the loader, the list of staging keys
+              to be loaded and the cursor to be saved once they have been.
+"""
+entries_subdir = 'entries'
+cursor_name = 'cursor'
+batches_subdir = 'batches'
+timestamp_format = '%Y%m%dT%H%M%S%f'
+
+
+
+
+"""
+An entry's key is timed before the entry is written, so an entry may only
+appear in a listing after entries with later keys. Each listing therefore
+starts this many seconds before the cursor, and skips the entries in that
+window which were already handed out.
+"""
+overlap_seconds = 600
+
+
+
+
+"""
+Batch manifests already read by this process, keyed by s3 key. Each is written
+once and never changed, so may be kept between warm invocations.
+"""
+batch_manifests = {}
+
+
+
+
+def new_manifest_entries(bucket_name, manifest_directory):
+    """
+    Find the staging keys of all files recorded in the manifest since the
+    cursor. Only entries after (or shortly before) the cursor are listed, so
+    the cost doesn't grow with the number of files staged in the past.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    manifest_directory : str
+        Name of directory inside bucket holding the manifest.
+
+    Returns
+    -------
+    fnames_list : list
+        List of strings, the staging keys of the new files, in the order they
+        were staged.
+    cursor : dict or None
+        The cursor to be saved once the new files have been loaded (see
+        write_cursor), None if there are no new entries.
+
+    """
+    
+    s3_client = boto3.client('s3')
+    cursor = read_cursor(bucket_name, manifest_directory)
+    
+    prefix = '/'.join([manifest_directory, entries_subdir]) + '/'
+    list_kwargs = {'Bucket': bucket_name, 'Prefix': prefix}
+    handed_out = set()
+    if cursor is not None:
+        window_start = (entry_time(cursor['last_entry'])
+                        - timedelta(seconds = overlap_seconds)
+                        )
+        list_kwargs['StartAfter'] = prefix + window_start.strftime(
+                                                            timestamp_format
+                                                            )
+        handed_out.update(cursor['recent_entries'])
+        handed_out.add(cursor['last_entry'])
+    
+    entry_keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**list_kwargs):
+        for item in page.get('Contents', []):
+            entry_keys.append(item['Key'])
+    
+    # Entry keys begin with a timestamp, so this is the order files were staged
+    entry_keys.sort()
+    new_keys = [key for key in entry_keys if key not in handed_out]
+    
+    if len(new_keys) == 0:
+        return [], None
+    
+    fnames_list = []
+    for entry_key in new_keys:
+        entry = s3_client.get_object(Bucket = bucket_name, Key = entry_key)
+        fnames_list.append(entry['Body'].read().decode('utf-8'))
+    
+    # Remember every entry within the window of the new cursor, whether handed
+    #   out by this run or an earlier one
+    last_entry = max(entry_keys + list(handed_out))
+    window_start = entry_time(last_entry) - timedelta(seconds = overlap_seconds)
+    recent_entries = sorted(key for key in set(entry_keys) | handed_out
+                            if entry_time(key) >= window_start
+                            and key != last_entry
+                           )
+    cursor = {'last_entry': last_entry, 'recent_entries': recent_entries}
+    
+    return fnames_list, cursor
+
+
+
+
+def entry_time(entry_key):
+    """
+    The time at which a manifest entry was recorded, from its key.
+
+    Parameters
+    ----------
+    entry_key : str
+        The s3 key of the entry.
+
+    Returns
+    -------
+    datetime
+        The (UTC) time the entry was recorded.
+
+    """
+    
+    timestamp = entry_key.rsplit('/', 1)[-1].split('_', 1)[0]
+    
+    return datetime.strptime(timestamp, timestamp_format)
+
+
+
+
+def read_cursor(bucket_name, manifest_directory):
+    """
+    Read the cursor, which records the manifest entries already handed to the
+    loader.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    manifest_directory : str
+        Name of directory inside bucket holding the manifest.
+
+    Returns
+    -------
+    cursor : dict or None
+        The key of the last entry handed out ('last_entry') and the keys of
+        those handed out shortly before it ('recent_entries'). None if the
+        loader has never read the manifest.
+
+    """
+    
+    s3_client = boto3.client('s3')
+    try:
+        cursor_obj = s3_client.get_object(Bucket = bucket_name,
+                                          Key = '/'.join([manifest_directory,
+                                                          cursor_name
+                                                         ]),
+                                          )
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    
+    return json.loads(cursor_obj['Body'].read())
+
+
+
+
+def write_cursor(bucket_name, manifest_directory, cursor):
+    """
+    Save the cursor, see read_cursor.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    manifest_directory : str
+        Name of directory inside bucket holding the manifest.
+    cursor : dict
+        The cursor, as returned by new_manifest_entries.
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    boto3.client('s3').put_object(Bucket = bucket_name,
+                                  Key = '/'.join([manifest_directory,
+                                                  cursor_name
+                                                 ]),
+                                  Body = json.dumps(cursor).encode('utf-8'),
+                                  )
+
+
+
+
+def write_batch_manifest(bucket_name, manifest_directory, fnames_list, cursor):
+    """
+    Save the list of files to be loaded by one run of the loader, so that the
+    list itself needn't be passed between the states of the step function.
+    The new cursor is saved alongside it, and only written once every file in
+    the list has been loaded and moved (see finish_batch). Should a run fail
+    part way then the next run lists the same entries again.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    manifest_directory : str
+        Name of directory inside bucket holding the manifest.
+    fnames_list : list
+        List of strings, the staging keys of the files to be loaded.
+    cursor : dict or None
+        The cursor once these files are loaded, see new_manifest_entries.
+
+    Returns
+    -------
+    manifest_key : str
+        The s3 key of the batch manifest.
+
+    """
+    
+    batch = {'fnames_list': fnames_list, 'cursor': cursor}
+    
+    timestamp = datetime.utcnow().strftime(timestamp_format)
+    manifest_key = '/'.join([manifest_directory,
+                             batches_subdir,
+                             timestamp + '.json',
+                            ])
+    
+    boto3.client('s3').put_object(Bucket = bucket_name,
+                                  Key = manifest_key,
+                                  Body = json.dumps(batch).encode('utf-8'),
+                                  )
+    batch_manifests[manifest_key] = batch
+    
+    return manifest_key
+
+
+
+
+def read_batch_manifest(bucket_name, manifest_key):
+    """
+    Read a batch manifest, see write_batch_manifest.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    manifest_key : str
+        The s3 key of the batch manifest.
+
+    Returns
+    -------
+    batch : dict
+        The staging keys of the files to be loaded ('fnames_list') and the
+        cursor to be saved once they are ('cursor').
+
+    """
+    
+    if manifest_key not in batch_manifests:
+        manifest_obj = boto3.client('s3').get_object(Bucket = bucket_name,
+                                                     Key = manifest_key,
+                                                     )
+        batch_manifests[manifest_key] = json.loads(manifest_obj['Body'].read())
+    
+    return batch_manifests[manifest_key]
+
+
+
+
+def finish_batch(bucket_name, inputs_dict):
+    """
+    Once the last file of a batch manifest has been loaded and moved out of
+    the staging directory, save the cursor so that the next run of the loader
+    starts after these files. Does nothing for an explicit 'fnames_list'.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    inputs_dict : dict
+        The inputs of the loader, as passed between states.
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    if 'manifest_key' not in inputs_dict:
+        return
+    
+    batch = read_batch_manifest(bucket_name, inputs_dict['manifest_key'])
+    if batch['cursor'] is not None:
+        write_cursor(bucket_name,
+                     inputs_dict['manifest_directory'],
+                     batch['cursor'],
+                     )
+
+
+
+
+def requeue_fnames(bucket_name, inputs_dict, fnames):
+    """
+    Record files which couldn't be moved out of the staging directory as new
+    manifest entries, so that the next run of the loader tries them again once
+    the cursor has moved past their original entries (see finish_batch). Rows
+    already loaded are skipped by the table's primary key. Does nothing for an
+    explicit 'fnames_list', whose files are listed from staging again anyway.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    inputs_dict : dict
+        The inputs of the loader, as passed between states.
+    fnames : list
+        List of strings, the staging keys of the files to be tried again.
+
+    Returns
+    -------
+    entry_keys : list
+        List of strings, the s3 keys of the new manifest entries.
+
+    """
+    
+    if 'manifest_key' not in inputs_dict:
+        return []
+    
+    s3_client = boto3.client('s3')
+    entry_keys = []
+    for fname in fnames:
+        timestamp = datetime.utcnow().strftime(timestamp_format)
+        entry_key = '/'.join([inputs_dict['manifest_directory'],
+                              entries_subdir,
+                              timestamp + '_' + fname.rsplit('/', 1)[-1],
+                             ])
+        s3_client.put_object(Bucket = bucket_name,
+                             Key = entry_key,
+                             Body = fname.encode('utf-8'),
+                             )
+        entry_keys.append(entry_key)
+    
+    return entry_keys
+
+
+
+
+def next_fnames(bucket_name, inputs_dict, num_files):
+    """
+    Take the next files to be loaded, from either a batch manifest (referenced
+    by 'manifest_key' and 'position' in the inputs) or an explicit
+    'fnames_list'.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    inputs_dict : dict
+        The inputs of the loader, as passed between states.
+    num_files : int
+        The most files to be taken.
+
+    Returns
+    -------
+    fnames : list
+        List of strings, the staging keys of the files taken.
+    list_state : dict
+        The entries of the inputs which track the remaining files, updated to
+        exclude those taken. To be passed on to the next state.
+    num_names_left : int
+        The number of files still to be loaded.
+
+    """
+    
+    if 'manifest_key' in inputs_dict:
+        manifest_key = inputs_dict['manifest_key']
+        fnames_list = read_batch_manifest(bucket_name,
+                                          manifest_key,
+                                          )['fnames_list']
+        position = inputs_dict.get('position', 0)
+        fnames = fnames_list[position:position + num_files]
+        position += len(fnames)
+        list_state = {'manifest_directory': inputs_dict['manifest_directory'],
+                      'manifest_key': manifest_key,
+                      'position': position,
+                     }
+        num_names_left = len(fnames_list) - position
+    else:
+        fnames_list = inputs_dict['fnames_list']
+        fnames = fnames_list[:num_files]
+        list_state = {'fnames_list': fnames_list[num_files:]}
+        num_names_left = len(list_state['fnames_list'])
+    
+    return fnames, list_state, num_names_left
@@ -7,7 +7,8 @@ Created on Tue Feb  2 15:36:51 2021
 
 import json
 
-import boto3
+from manifest import finish_batch, next_fnames, requeue_fnames
+from move_files import move_files
 
 
 
@@ -24,8 +25,23 @@ def move_to_error(event, context):
     
     schema_name = inputs_dict['schema_name']
     table_name = inputs_dict['table_name']
-    fnames_list = inputs_dict['fnames_list']
-    fname_processed = inputs_dict['fname_processed']
+    # If the bulk loader itself failed (caught by the step function, which
+    #   adds error_info) none of the batch it was given was loaded: take that
+    #   batch from the list here. Bulk loading otherwise passes a list of
+    #   processed files, and loading one file at a time passes just one
+    if 'error_info' in event:
+        print('Loading failed: ', event['error_info'])
+        fnames_processed, list_state, num_names_left = next_fnames(
+                                                bucket_name,
+                                                inputs_dict,
+                                                inputs_dict.get('batch_size', 25),
+                                                )
+        inputs_dict.update(list_state)
+        inputs_dict['fnames_error'] = fnames_processed
+    elif 'fnames_error' in inputs_dict:
+        fnames_processed = inputs_dict['fnames_error']
+    else:
+        fnames_processed = [inputs_dict['fname_processed']]
     
     """
     Moves files from AWS s3 staging directory to error directory if there was
@@ -51,38 +67,47 @@ def move_to_error(event, context):
         Name of the SQL table name for data to be loaded in to.
     fnames_list : list
         List of strings, the keys of all files within staging directory. Note 
-        that the key strings also contain directory information.
-    fnames_processed : str
+        that the key strings also contain directory information. Either this
+        or manifest_directory, manifest_key and position are passed through,
+        see next_fnames.
+    fname_processed : str
         The filename/AWS s3 object key of the file which was just processed and
         now needs to be moved
+    fnames_error : list, optional
+        Passed instead of fname_processed when files are loaded in bulk (see
+        add_top_files_to_dbase), the keys of all files to be moved.
+    error_info : dict, optional
+        Added to the event by the step function when the bulk loader fails
+        outright. Neither of the above is passed, the next batch_size files in
+        the list are moved instead.
 
     Returns
     -------
     dict
         Passes through most input values. The dictionary explicitly passes the 
         number of files left in the list which still need to be processed (for
-        use by AWS step function to determine whether to continue iteration).
+        use by AWS step function to determine whether to continue iteration),
+        and the outcome of moving each file (see move_files). Files which
+        failed to move are counted, and recorded in the manifest again to be
+        tried by the next run (see requeue_fnames).
 
     """    
     
-    s3_resource = boto3.resource('s3')
+    # Copy all files concurrently, then delete them from staging in batches
+    outcomes = move_files(bucket_name, fnames_processed, error_dir)
     
-    # Split directory name from full key, only keep fname
-    fname_proc_wo_dir = fname_processed.split('/')[-1]
+    # Files still in staging would otherwise be skipped once the manifest
+    #   cursor moves past them, so record them again to be retried next run
+    fnames_failed = [fname for fname, outcome in outcomes.items()
+                     if outcome != 'moved']
+    if len(fnames_failed) > 0:
+        print('Failed to move: ', fnames_failed)
+        requeue_fnames(bucket_name, inputs_dict, fnames_failed)
     
-    # Append bucket name to create full AWS s3 filepath of file to be copied
-    old_key = '/'.join([bucket_name, fname_processed])
-    
-    # Adderror directory to filename to indicate location where file copied to
-    new_key = '/'.join([error_dir, fname_proc_wo_dir])
-    
-    # Copy
-    (s3_resource.Object(bucket_name, new_key)
-                .copy_from(CopySource = old_key)
-                )
-    
-    # Delete the old file from staging directory
-    s3_resource.Object(bucket_name, fname_processed).delete()
+    # Once the last file of the list is loaded and out of staging, or queued
+    #   to be tried again, the manifest cursor may move past the list
+    if num_names_left == 0:
+        finish_batch(bucket_name, inputs_dict)
     
     
     return_dict = {'bucket_name': bucket_name,
@@ -91,11 +116,21 @@ def move_to_error(event, context):
                    'error_dir': error_dir,
                    'schema_name': schema_name,
                    'table_name': table_name,
-                   'fnames_list': fnames_list,
                    }
     
+    # Pass through the remaining files, the loading settings and the results
+    #   of bulk loading
+    for key in ['fnames_list', 'manifest_directory', 'manifest_key',
+                'position', 'batch_size', 'max_workers', 'ingest_mode',
+                'fnames_error']:
+        if key in inputs_dict:
+            return_dict[key] = inputs_dict[key]
+    
     return {
             'statusCode': 200,
             'num_names_left': num_names_left,
+            'num_errors': len(fnames_processed),
+            'move_outcomes': outcomes,
+            'num_move_failures': len(fnames_failed),
             'body': json.dumps(return_dict)
             }
\ No newline at end of file
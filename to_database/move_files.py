@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+
+
+
+def move_files(bucket_name, fnames, destination_dir, max_workers = 16,
+               delete_batch_size = 1000
+               ):
+    """
+    Move many files within an AWS s3 bucket to a new directory. Objects can't
+    be moved directly, so each is copied (server-side, concurrently) to the
+    new directory and the originals are then deleted in batches. A file is
+    only deleted if its copy succeeded.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of s3 bucket where all files live.
+    fnames : list
+        List of strings, the keys of the files to be moved. Note that the key
+        strings also contain directory information.
+    destination_dir : str
+        Name of directory inside bucket where files are to be moved.
+    max_workers : int, optional
+        The number of copies to be made at once. The default is 16.
+    delete_batch_size : int, optional
+        The number of files deleted per request, at most 1000 (the limit set
+        by AWS). The default is 1000.
+
+    Returns
+    -------
+    outcomes : dict
+        Keys are the file keys, values are either 'moved' or a description of
+        the error which prevented the file being moved.
+
+    """
+    
+    # Clients (unlike resources) may be shared between threads
+    s3_client = boto3.client('s3')
+    
+    def copy_file(fname):
+        # Split directory name from full key, only keep fname
+        fname_wo_dir = fname.split('/')[-1]
+        
+        # Add directory to filename to indicate location where file copied to
+        new_key = '/'.join([destination_dir, fname_wo_dir])
+        
+        s3_client.copy_object(Bucket = bucket_name,
+                              Key = new_key,
+                              CopySource = {'Bucket': bucket_name,
+                                            'Key': fname,
+                                           },
+                              )
+    
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {fname: executor.submit(copy_file, fname)
+                   for fname in fnames
+                  }
+        for fname, future in futures.items():
+            try:
+                future.result()
+                outcomes[fname] = 'copied'
+            except Exception as e:
+                outcomes[fname] = 'copy failed: {}'.format(e)
+    
+    # Delete the old files from staging directory, only if they were copied
+    copied = [fname for fname, outcome in outcomes.items()
+              if outcome == 'copied'
+             ]
+    for k in range(0, len(copied), delete_batch_size):
+        batch = copied[k:k + delete_batch_size]
+        try:
+            response = s3_client.delete_objects(
+                                    Bucket = bucket_name,
+                                    Delete = {'Objects': [{'Key': fname}
+                                                          for fname in batch
+                                                         ],
+                                              'Quiet': True,
+                                             },
+                                    )
+        except Exception as e:
+            for fname in batch:
+                outcomes[fname] = 'delete failed: {}'.format(e)
+            continue
+        
+        for fname in batch:
+            outcomes[fname] = 'moved'
+        # In quiet mode only the keys which couldn't be deleted are returned
+        for error in response.get('Errors', []):
+            outcomes[error['Key']] = 'delete failed: {}'.format(
+                                                            error['Message']
+                                                            )
+    
+    num_failed = sum(outcome != 'moved' for outcome in outcomes.values())
+    print('Moved {} files to {}, {} failed'.format(len(outcomes) - num_failed,
+                                                  destination_dir,
+                                                  num_failed
+                                                 ))
+    for fname, outcome in outcomes.items():
+        if outcome != 'moved':
+            print(fname, outcome)
+    
+    return outcomes
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+from operator import itemgetter
+
+from schema import column_definitions
+
+
+
+
+"""
+The column names of the SQL table, in table order.
+"""
+schema_columns = tuple(name for name, definition in column_definitions())
+
+
+
+
+"""
+Encoders already compiled by this process, keyed by the kind of row and the
+columns (or keys) of the rows they encode.
+"""
+encoders = {}
+
+
+
+
+def compile_encoder(source_columns, rows_are_dicts = False):
+    """
+    Build a function which extracts the values of a row in table order. The
+    columns are matched against the schema once, when the encoder is built,
+    so that encoding each row is a single operator.itemgetter call.
+
+    Parameters
+    ----------
+    source_columns : list
+        The names of the columns (or dictionary keys) of the rows to be
+        encoded, in the order they appear in each row.
+    rows_are_dicts : bool, default=False
+        Whether rows are dictionaries keyed by column name, rather than
+        sequences of values in the order of source_columns.
+
+    Raises
+    ------
+    ValueError
+        A column is not part of the schema, or appears twice.
+
+    Returns
+    -------
+    columns : tuple
+        The names of the encoded columns: the source columns in table order.
+    encode : function
+        Takes a row, returns a tuple of its values in the order of columns.
+
+    """
+    
+    key = (rows_are_dicts, tuple(source_columns))
+    if key in encoders:
+        return encoders[key]
+    
+    unknown = [name for name in source_columns if name not in schema_columns]
+    if unknown:
+        raise ValueError('Columns not in schema: ' + ', '.join(unknown))
+    if len(set(source_columns)) != len(source_columns):
+        raise ValueError('Repeated columns: ' + ', '.join(source_columns))
+    
+    columns = tuple(name for name in schema_columns if name in source_columns)
+    if rows_are_dicts:
+        fields = columns
+    else:
+        positions = {name: k for k, name in enumerate(source_columns)}
+        fields = [positions[name] for name in columns]
+    
+    if len(fields) == 1:
+        # A single-item itemgetter returns the item itself, not a tuple
+        field = fields[0]
+        encode = lambda row: (row[field],)
+    else:
+        encode = itemgetter(*fields)
+    
+    encoders[key] = (columns, encode)
+    
+    return columns, encode
+
+
+
+
+def encode_rows(source_columns, rows, rows_are_dicts = False):
+    """
+    Put every row in table order, ready to be written by write_rows. Rows
+    which don't have exactly the expected columns are rejected before
+    anything is sent to the database.
+
+    Parameters
+    ----------
+    source_columns : list
+        The names of the columns (or dictionary keys) of the rows.
+    rows : list
+        The rows, either sequences of values or dictionaries (see
+        compile_encoder).
+    rows_are_dicts : bool, default=False
+        Whether rows are dictionaries keyed by column name.
+
+    Raises
+    ------
+    ValueError
+        A row has the wrong number of values, or (for dictionaries) the wrong
+        keys.
+
+    Returns
+    -------
+    columns : tuple
+        The names of the encoded columns, in table order.
+    values : list
+        One tuple per row, in the order of columns.
+
+    """
+    
+    columns, encode = compile_encoder(source_columns, rows_are_dicts)
+    
+    num_columns = len(source_columns)
+    if any(len(row) != num_columns for row in rows):
+        raise ValueError('Rows have differing numbers of columns')
+    
+    try:
+        values = list(map(encode, rows))
+    except KeyError as e:
+        raise ValueError('Row is missing column {}'.format(e))
+    
+    return columns, values
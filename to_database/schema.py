@@ -55,12 +55,55 @@ columns = [
 	        'Initial_gold		        integer,',
 	        'Initial_platinum		    integer,',
             'Final_upvotes              integer,',
-            'Final_num_comments         integer'
+            'Final_num_comments         integer,',
+            'Scrape_tag                 varchar(30),',
+            'Scrape_time                double precision'
           ]
 
 
 
 
+"""
+Columns to be indexed, the scrape metadata is used to split the table in to
+blocks when querying the whole table (see GetData in train_model).
+"""
+indexed_columns = ['How_sorted', 'Scrape_tag', 'Scrape_time']
+
+
+
+
+"""
+SQL expressions to fill in columns added to an existing table, keyed by column
+name. Rows inserted before the scrape metadata columns were added still hold
+the same information in their ID (Reddit ID + '_' + scrape tag, see
+new_unique_ID_with_scrape_time). Reddit IDs vary in length but never contain
+'_', so the tag is the ID's second '_' separated part; it ends with the month,
+day, and UTC time of the scrape, the year is that of the post creation (or the
+next, for posts created just before the new year).
+"""
+column_backfills = {
+    'Scrape_tag': "SPLIT_PART(ID, '_', 2)",
+    'Scrape_time': """EXTRACT(EPOCH FROM (
+                        SELECT CASE
+                            WHEN t < TO_TIMESTAMP(Created_utc) - INTERVAL '1 day'
+                            THEN t + INTERVAL '1 year' ELSE t END
+                        FROM (SELECT MAKE_TIMESTAMPTZ(
+                                EXTRACT(YEAR FROM TO_TIMESTAMP(Created_utc)
+                                                  AT TIME ZONE 'UTC')::int,
+                                SUBSTRING(time_key, 1, 2)::int,
+                                SUBSTRING(time_key, 3, 2)::int,
+                                SUBSTRING(time_key, 5, 2)::int,
+                                SUBSTRING(time_key, 7, 2)::int,
+                                0, 'UTC') AS t
+                              FROM (SELECT RIGHT(SPLIT_PART(ID, '_', 2), 8)
+                                           AS time_key) AS tag
+                             ) AS scrape
+                        ))""",
+    }
+
+
+
+
 def create_table_string(schema_name, table_name):
     """
     Create the string which defines execution to build the table in Postgresql,
@@ -92,6 +135,29 @@ def create_table_string(schema_name, table_name):
 
 
 
+def column_definitions():
+    """
+    Split the schema in to the name and the definition of each column, for use
+    when columns are added to an existing table.
+
+    Returns
+    -------
+    definitions : list
+        List of tuples, (column name, column definition) for each column, the
+        definition excludes any trailing comma.
+
+    """
+    
+    definitions = []
+    for feature in columns:
+        definition = ' '.join(feature.rstrip(',').split())
+        definitions.append((definition.split()[0], definition))
+    
+    return definitions
+
+
+
+
 if __name__ == '__main__':
     columns = ['col1 integer PRIMARY KEY, col2 varchar(30)']
     print('Sample output:', create_table_string('schema_name', 'table_name') )
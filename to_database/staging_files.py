@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import pickle as pkl
+
+
+
+
+def read_staging_columns(fname, body, columns = None):
+    """
+    Read the contents of a staged data file, column-by-column. Parquet files
+    are read directly, and only the requested columns are decoded. Pickled
+    files (the original staging format) are still supported, these must be
+    read in full.
+
+    Parameters
+    ----------
+    fname : str
+        The filename/AWS s3 key of the file, its extension sets the format.
+    body : bytes
+        The contents of the file.
+    columns : list, default=None
+        List of strings, the names of the features to be read. The 'ID'
+        feature is always included. The default is None, read every feature.
+
+    Returns
+    -------
+    data_columns : dict
+        Keys are feature names, values are lists holding the value of that
+        feature for every post.
+
+    """
+
+    if columns is not None:
+        columns = ['ID'] + [column for column in columns if column != 'ID']
+
+    if fname.endswith('.parquet'):
+        # Not available to every Lambda function, only import when needed
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(io.BytesIO(body), columns = columns)
+        metadata = table.schema.metadata or {}
+        json_columns = json.loads(metadata.get(b'json_columns', b'[]'))
+
+        data_columns = {}
+        for name in table.column_names:
+            values = table.column(name).to_pylist()
+            if name in json_columns:
+                values = [json.loads(value) for value in values]
+            data_columns[name] = values
+
+    else:
+        data = pkl.loads(body)
+        if columns is None:
+            # Use the features of the first post
+            columns = list(next(iter(data.values())).keys()) if data else []
+        data_columns = {name: [post_data[name] for post_data in data.values()]
+                        for name in columns
+                       }
+
+    return data_columns
+
+
+
+
+def columns_to_data_dicts(data_columns):
+    """
+    Convert columns (see read_staging_columns) to a dictionary of
+    dictionaries, keyed by post ID.
+
+    Parameters
+    ----------
+    data_columns : dict
+        Keys are feature names, values are lists of feature values.
+
+    Returns
+    -------
+    data : dict
+        Keys are post ID, values are dictionaries of all features of the post.
+
+    """
+
+    names = list(data_columns.keys())
+    data = {}
+    for post_values in zip(*data_columns.values()):
+        post_data = dict(zip(names, post_values))
+        data[post_data['ID']] = post_data
+
+    return data
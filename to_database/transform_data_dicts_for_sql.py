@@ -5,6 +5,8 @@ Created on Tue Feb  2 12:32:45 2021
 @author: Dillo
 """
 
+from datetime import datetime, timezone
+import os
 import re
 
 
@@ -45,6 +47,132 @@ def transform_all_data_dicts_for_sql_schema(fname, data):
 
 
 
+def transform_columns_for_sql_schema(fname, data_columns):
+    """
+    Columnar version of transform_all_data_dicts_for_sql_schema, for a whole
+    file at once. The filename metadata is parsed and the column names are
+    converted once per file, rather than once per post, and each conversion
+    is applied to an entire column.
+
+    Parameters
+    ----------
+    fname : str
+        The filename/AWS s3 key of the file. The name contains some useful
+        metadata about when/how the posts were scraped.
+    data_columns : dict
+        Keys are feature names, values are lists holding the value of that
+        feature for every post (see read_staging_columns).
+
+    Returns
+    -------
+    columns : list
+        The SQL column names, in the same order as transform_dict_dtypes_for_
+        sql_schema produces them.
+    rows : list
+        One tuple per post, holding the transformed values in column order.
+
+    """
+    
+    how, scrape_key = scrape_metadata(fname)
+    num_posts = len(data_columns['ID'])
+    
+    # Combine two-word keys in to single-words for SQL, dropping gildings
+    #   which are unpacked below
+    new_columns = {}
+    for key, values in data_columns.items():
+        if key != 'Gildings':
+            new_columns[combine_words(key)] = values
+    
+    # Add how sorted - purely for my info, not useful as a predictive feature
+    new_columns['How_sorted'] = [how] * num_posts
+    
+    # Add scrape key to post ID to ensure unique entries for SQL PRIMARY KEY
+    new_columns['ID'] = [old_ID + '_' + scrape_key
+                         for old_ID in data_columns['ID']
+                        ]
+    
+    # Also store the scrape metadata in their own (indexed) columns, every
+    #   post in the file was scraped at once (after the newest was created)
+    new_columns['Scrape_tag'] = [scrape_key] * num_posts
+    if num_posts > 0:
+        time = scrape_time(fname, max(data_columns['Created utc']))
+    else:
+        time = None
+    new_columns['Scrape_time'] = [time] * num_posts
+    
+    # Unpack gildings dict (comes from first scrape)
+    gildings = data_columns['Gildings']
+    new_columns['Initial_silver'] = [gild_dict.get('gid_1', 0)
+                                     for gild_dict in gildings
+                                    ]
+    new_columns['Initial_gold'] = [gild_dict.get('gid_2', 0)
+                                   for gild_dict in gildings
+                                  ]
+    new_columns['Initial_platinum'] = [gild_dict.get('gid_3', 0)
+                                       for gild_dict in gildings
+                                      ]
+    
+    # Deal with all possible "None" types
+    new_columns['Views'] = convert_NONE_to_0_column(data_columns['Views'])
+    new_columns['Likes'] = convert_NONE_to_0_column(data_columns['Likes'])
+    
+    # Convert distinguished to boolean
+    new_columns['Distinguished'] = [x is not None
+                                    for x in data_columns['Distinguished']
+                                   ]
+    
+    # Convert any None's in 'Discussion type' to a string
+    new_columns['Discussion_type'] = ['None' if x is None else x
+                                      for x in data_columns['Discussion type']
+                                     ]
+    
+    # Unpack content categories, taking first element of list
+    new_columns['Content_categories'] = [
+                                'None' if x is None else x[0]
+                                for x in data_columns['Content categories']
+                                ]
+    
+    # Convert some feats to floating type
+    for key in ['distinguished_rate', 'op_comment_rate', 'premium_auth_rate',
+                'gild_rate', 'std_up_rate', 'avg_up_rate']:
+        new_columns[key] = list(map(float, data_columns[key]))
+    
+    # Convert Edited to boolean type
+    new_columns['Edited'] = [x != False for x in data_columns['Edited']]
+    
+    columns = list(new_columns.keys())
+    rows = list(zip(*new_columns.values()))
+    
+    return columns, rows
+
+
+
+
+def convert_NONE_to_0_column(values):
+    """
+    Apply convert_NONE_to_0 to a whole column.
+
+    Parameters
+    ----------
+    values : list
+        The values to be converted.
+
+    Returns
+    -------
+    list
+        The converted values.
+
+    """
+    
+    try:
+        return [0 if x is None else int(x) for x in values]
+    except ValueError:
+        # Only some values are non-numerical, convert one-by-one
+        return [convert_NONE_to_0(x) for x in values]
+
+
+
+
 def transform_dict_dtypes_for_sql_schema(fname, data):
     """
     Applies data transformation to a python dictionary containing data for an
@@ -80,6 +208,10 @@ def transform_dict_dtypes_for_sql_schema(fname, data):
     # Add scrape key to post ID to ensure unique entries for SQL PRIMARY KEY
     new_dict['ID'] = new_unique_ID_with_scrape_time(fname, data['ID'])
     
+    # Also store the scrape metadata in their own (indexed) columns
+    new_dict['Scrape_tag'] = scrape_metadata(fname)[1]
+    new_dict['Scrape_time'] = scrape_time(fname, data['Created utc'])
+    
     # Unpack gildings dict (comes from first scrape)
     silvers, golds, platinums = count_gildings(data['Gildings'])
     new_dict['Initial_silver'] = silvers
@@ -315,15 +447,85 @@ def new_unique_ID_with_scrape_time(fname, old_ID):
 
     """
     
-    scrape_month = fname[-20:-18]
-    scrape_day = fname[-17:-15]
-    scrape_utc = fname[-11:-7]
+    how, scrape_key = scrape_metadata(fname)
+    new_ID = old_ID + '_' + scrape_key
+    
+    return new_ID
+
+
+
+
+def scrape_metadata(fname):
+    """
+    Parse the scraping metadata contained in a filename.
+
+    Parameters
+    ----------
+    fname : str
+        The filename/AWS s3 object key, contains metadata about scraping (both
+        when scraped as well as how Reddit was sorted during scraping).
+
+    Returns
+    -------
+    how : str
+        How Reddit was sorted during scraping, e.g. 'rising'.
+    scrape_key : str
+        How sorted, followed by the month, day, and UTC time of the scrape.
+
+    """
+    
+    # Remove the extension, which differs between staging file formats
+    fname = os.path.splitext(fname)[0]
+    
+    scrape_month = fname[-16:-14]
+    scrape_day = fname[-13:-11]
+    scrape_utc = fname[-7:-3]
     how = re.search(r'sortedby_([\w\s]+)_', fname).group(1)
     
     scrape_key = how + scrape_month + scrape_day + scrape_utc
-    new_ID = old_ID + '_' + scrape_key
     
-    return new_ID
+    return how, scrape_key
+
+
+
+
+def scrape_time(fname, created_utc):
+    """
+    Find the UTC epoch at which a file was scraped. The filename holds the
+    month, day, and time of the scrape but not the year, which is taken from
+    the creation time of a post in the file: the year it was created, or the
+    next if it was created just before the new year.
+
+    Parameters
+    ----------
+    fname : str
+        The filename/AWS s3 object key, contains metadata about scraping.
+    created_utc : float
+        The UTC epoch at which a post in the file was created.
+
+    Returns
+    -------
+    float
+        The UTC epoch of the scrape.
+
+    """
+    
+    # Remove the extension, which differs between staging file formats
+    fname = os.path.splitext(fname)[0]
+    
+    month = int(fname[-16:-14])
+    day = int(fname[-13:-11])
+    hour = int(fname[-7:-5])
+    minute = int(fname[-5:-3])
+    
+    year = datetime.fromtimestamp(created_utc, timezone.utc).year
+    scraped = datetime(year, month, day, hour, minute, tzinfo = timezone.utc)
+    
+    # Posts are scraped after they are created, allowing for a day of slack
+    if scraped.timestamp() < created_utc - 24*60*60:
+        scraped = scraped.replace(year = year + 1)
+    
+    return scraped.timestamp()
 
 
 
@@ -5,8 +5,6 @@ Created on Thu Feb 11 12:40:40 2021
 @author: Dillo
 """
 
-from datetime import datetime as dt
-
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.collections import LineCollection
@@ -15,19 +13,13 @@ import pandas as pd
 from sklearn.metrics import precision_score, recall_score, roc_curve, auc
 from sklearn.metrics import precision_recall_curve
 
+from feature_derivation import derive_features
+
 
 
 def handle_unique_columns(df):
     
-    num_gilds = df['gold_awarded'] + df['platinum_awarded']
-    gilded = num_gilds.apply(lambda x: 1 if x > 0 else 0)
-    
-    weekday = df['created_utc'].apply(lambda x: dt.utcfromtimestamp(x).weekday() )
-    hour = df['created_utc'].apply(lambda x: dt.utcfromtimestamp(x).hour )
-    
-    scrape_time = [ID[-4:] for ID in df['id']]
-    
-    return gilded, weekday, hour, scrape_time
+    return derive_features(df)
 
 
 
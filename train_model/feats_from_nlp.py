@@ -76,7 +76,13 @@ class My_tfidf(BaseEstimator, TransformerMixin):
             
             _ = self.vectorizer.fit(docs)
             
-            self.tfidf_features = self.vectorizer.get_feature_names()
+            # sklearn renamed get_feature_names (removed in 1.2) in version 1.0
+            if hasattr(self.vectorizer, 'get_feature_names_out'):
+                self.tfidf_features = list(
+                                    self.vectorizer.get_feature_names_out()
+                                    )
+            else:
+                self.tfidf_features = self.vectorizer.get_feature_names()
             
             if not self.num_pca_vars == 0:
                 # Do PCA - will need to transform training set w/ tfidf to fit PCA
@@ -99,13 +105,16 @@ class My_tfidf(BaseEstimator, TransformerMixin):
         
         # Pass through without doing anything if no tfidf_feats
         if not self.tfidf_num_feats == 0:        
-            # Do some text pre-processing
-            stopwords = nltk.corpus.stopwords.words('english')
-            stemmer = nltk.stem.PorterStemmer()
-            tokenizer = nltk.RegexpTokenizer(r"\w+")
-            
-            docs = X[self.target_column_name].apply(lambda x: 
-                      self._preprocess_text(x, stopwords, stemmer, tokenizer))
+            if self.preprocess == True:
+                # Do some text pre-processing, as in fit
+                stopwords = nltk.corpus.stopwords.words('english')
+                stemmer = nltk.stem.PorterStemmer()
+                tokenizer = nltk.RegexpTokenizer(r"\w+")
+                
+                docs = X[self.target_column_name].apply(lambda x: 
+                          self._preprocess_text(x, stopwords, stemmer, tokenizer))
+            else:
+                docs = X[self.target_column_name]
             
             # Perform tfidf calculation
             vectors = self.vectorizer.transform(docs)
@@ -124,8 +133,9 @@ class My_tfidf(BaseEstimator, TransformerMixin):
                                       )
             # If num_pca_vars = 0 just load tfidf vectors in to a dataframe
             elif (self.num_pca_vars == 0):
+                # The vocabulary may be smaller than tfidf_num_feats
                 column_names =  ['tfidf_{}'.format(x) 
-                                for x in range(self.tfidf_num_feats)
+                                for x in range(len(self.tfidf_features))
                                 ]
                 new_df = pd.DataFrame.sparse.from_spmatrix(vectors,
                                                            columns = column_names,
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+
+
+
+
+def derive_features(df):
+    """
+    Build the features which are derived from other columns of the raw data:
+    the target, and the post/scrape times. Each is computed for the whole
+    column at once.
+
+    Parameters
+    ----------
+    df : dataframe
+        The raw data, must include the columns 'gold_awarded',
+        'platinum_awarded', 'created_utc', and 'id'.
+
+    Returns
+    -------
+    gilded : series
+        1 if the post was awarded gold or platinum, otherwise 0.
+    weekday : series
+        The (UTC) day of the week on which the post was created, Monday is 0.
+    hour : series
+        The (UTC) hour of the day in which the post was created.
+    scrape_time : series
+        The (UTC) time of day the post was scraped, as a string 'HHMM' taken
+        from the end of the post ID.
+
+    """
+    
+    num_gilds = df['gold_awarded'] + df['platinum_awarded']
+    gilded = (num_gilds > 0).astype('int64')
+    
+    created = pd.to_datetime(df['created_utc'], unit = 's')
+    weekday = created.dt.weekday.astype('int64')
+    hour = created.dt.hour.astype('int64')
+    
+    scrape_time = df['id'].str[-4:]
+    
+    return gilded, weekday, hour, scrape_time
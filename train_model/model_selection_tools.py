@@ -8,17 +8,19 @@ Created on Mon Mar  1 11:14:07 2021
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import cross_val_score
+from sklearn.model_selection import cross_val_score, check_cv
 from xgboost.sklearn import XGBClassifier
 
 from pipeline_objects import MultipurposeEncoder, AddNewFeatures
+from pipeline_objects import TargetFoldStats
 from feats_from_nlp import My_tfidf
 
 
 class FeatureSelection():
     
     def __init__(self, min_features, oh_encode_feats, target_encode_feats,
-                 scoring = 'average_precision',  cv_folds = 5, verbose = 0
+                 scoring = 'average_precision',  cv_folds = 5, verbose = 0,
+                 sparse = False, out_of_fold_target = False
                  ):
         
         self.min_features = min_features
@@ -27,6 +29,10 @@ class FeatureSelection():
         self.scoring = scoring
         self.cv_folds = cv_folds
         self.verbose = verbose
+        self.sparse = sparse
+        # Whether the training rows of each split are target-encoded out of
+        # fold, rather than with their own targets (which changes the scores)
+        self.out_of_fold_target = out_of_fold_target
 
 
 
@@ -40,12 +46,15 @@ class FeatureSelection():
         remove_features = RemoveFeatures(feats_to_remove = dropped_feats)
         encode_categorical = MultipurposeEncoder(ohe_feats = ohe_feats,
                                                  target_feats = target_feats,
+                                                 target_stats = self.target_stats,
+                                                 sparse_output = self.sparse
                                                 )
         encode_tfidf = My_tfidf(target_column_name = 'title',
                                 tfidf_num_feats = num_tfidf_feats,
                                 num_pca_vars = 0
                                )
-        scale_features = StandardScaler()
+        # Centering would make a sparse matrix dense
+        scale_features = StandardScaler(with_mean = not self.sparse)
         classify = XGBClassifier(eta = 0.25,
                                  gamma = 2,
                                  min_child_weight = 5,
@@ -62,19 +71,49 @@ class FeatureSelection():
                                 )
         
         
-        pipeline = Pipeline([('add_features', add_features),
-                             ('remove_features', remove_features),
-                             ('encode_categorical', encode_categorical),
-                             ('encode_tfidf', encode_tfidf),
-                             ('scale_features', scale_features),
-                             ('classify', classify)
-                            ])
+        if self.sparse:
+            # The title must reach My_tfidf as a column, so build the tfidf
+            # features first and let the encoder assemble the sparse matrix
+            pipeline = Pipeline([('add_features', add_features),
+                                 ('remove_features', remove_features),
+                                 ('encode_tfidf', encode_tfidf),
+                                 ('encode_categorical', encode_categorical),
+                                 ('scale_features', scale_features),
+                                 ('classify', classify)
+                                ])
+        else:
+            pipeline = Pipeline([('add_features', add_features),
+                                 ('remove_features', remove_features),
+                                 ('encode_categorical', encode_categorical),
+                                 ('encode_tfidf', encode_tfidf),
+                                 ('scale_features', scale_features),
+                                 ('classify', classify)
+                                ])
         
         return pipeline
 
 
 
 
+    def _prepare_folds(self, X, y):
+        
+        # Split once, so that every fit is scored on the same folds and the
+        # target-encoding statistics of each fold are only computed once
+        splitter = check_cv(self.cv_folds, y, classifier = True)
+        self.cv_splits = list(splitter.split(X, y))
+        
+        self.target_stats = None
+        if self.out_of_fold_target:
+            target_feats = [feature for feature in self.target_encode_feats
+                            if feature in X.columns
+                           ]
+            self.target_stats = TargetFoldStats(X, y, target_feats,
+                                                self.cv_splits
+                                                )
+
+
+
+
     def _prepare_data(self, feature_list):
         
         target_feats = [feature for feature in self.target_encode_feats 
@@ -105,7 +144,7 @@ class FeatureSelection():
         score = cross_val_score(pipeline,
                                 X, y,
                                 scoring = self.scoring,
-                                cv = self.cv_folds,
+                                cv = self.cv_splits,
                                 n_jobs = -1,
                                 verbose = 0,
                                 error_score = 'raise'
@@ -159,6 +198,8 @@ class FeatureSelection():
     def select_features(self, X, y, all_features):
         
         n_features = len(all_features)
+        
+        self._prepare_folds(X, y)
 
         # Hold all data
         scores = {}
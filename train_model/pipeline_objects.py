@@ -5,6 +5,7 @@ Created on Mon Feb 15 13:54:13 2021
 @author: Dillo
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 import pickle
 import os
@@ -13,10 +14,15 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import boto3
+from botocore.exceptions import ClientError
+from scipy.sparse import csr_matrix, hstack
 
 from sklearn.base import BaseEstimator, TransformerMixin, ClassifierMixin
+from sklearn.model_selection import KFold
 from sklearn.preprocessing import OneHotEncoder
 
+from feature_derivation import derive_features
+
 
 
 # =============================================================================
@@ -56,6 +62,119 @@ def build_dbase_info_dict(info_txt_file_str):
 
 
 
+def response_too_large(error):
+    """
+    Check whether an error from the AWS RDS Data API was caused by the query
+    response exceeding its size limit (1 MB). The Data API reports this as a
+    BadRequestException, as it does for any other bad query, so the message is
+    checked too.
+
+    Parameters
+    ----------
+    error : botocore.exceptions.ClientError
+        The error raised by the query.
+
+    Returns
+    -------
+    bool
+        Whether the response was too large.
+
+    """
+    
+    error_info = error.response.get('Error', {})
+    
+    return (error_info.get('Code') == 'BadRequestException'
+            and 'response size' in error_info.get('Message', '').lower()
+           )
+
+
+
+
+"""
+Types of the AWS RDS Data API, keyed by the Postgresql type name given in the
+column metadata of a response: the field holding the value of each cell, the
+numpy dtype of the decoded column, and the value held by null cells before
+nulls are dealt with.
+"""
+data_api_types = {'int2':    ('longValue', np.int64, 0),
+                  'int4':    ('longValue', np.int64, 0),
+                  'int8':    ('longValue', np.int64, 0),
+                  'serial':  ('longValue', np.int64, 0),
+                  'float4':  ('doubleValue', np.float64, np.nan),
+                  'float8':  ('doubleValue', np.float64, np.nan),
+                  'bool':    ('booleanValue', np.bool_, False),
+                 }
+
+
+
+
+def decode_column(records, col_num, type_name):
+    """
+    Decode one column of the records returned by the AWS RDS Data API, in
+    which every cell is a dictionary such as {'longValue': 3} or
+    {'isNull': True}. The values are written directly in to a numpy array of
+    the column's type, without building an intermediate list.
+
+    Integer columns with nulls are returned as floats, with NaN for null, and
+    boolean columns with nulls are returned as objects, with None for null (as
+    pandas itself does). Any other type (e.g. varchar) is returned as objects.
+
+    Parameters
+    ----------
+    records : list
+        The records of the response, each a list holding one cell per column.
+    col_num : int
+        The position of the column in each record.
+    type_name : str
+        The Postgresql type of the column, from the column metadata.
+
+    Returns
+    -------
+    values : numpy.ndarray
+        The decoded column.
+
+    """
+    
+    num_records = len(records)
+    
+    if type_name not in data_api_types:
+        values = np.empty(num_records, dtype = object)
+        for row_num, record in enumerate(records):
+            cell = record[col_num]
+            values[row_num] = (None if cell.get('isNull')
+                               else next(iter(cell.values()))
+                              )
+        return values
+    
+    field, dtype, null_value = data_api_types[type_name]
+    values = np.fromiter((record[col_num].get(field, null_value)
+                          for record in records
+                         ),
+                         dtype = dtype,
+                         count = num_records,
+                        )
+    
+    if dtype is np.float64:
+        # Nulls are already NaN
+        return values
+    
+    is_null = np.fromiter(('isNull' in record[col_num] for record in records),
+                          dtype = np.bool_,
+                          count = num_records,
+                         )
+    if is_null.any():
+        if dtype is np.int64:
+            values = values.astype(np.float64)
+            values[is_null] = np.nan
+        else:
+            values = values.astype(object)
+            values[is_null] = None
+    
+    return values
+
+
+
+
 class GetData():
     
     def __init__(self, database_info_dict):
@@ -66,6 +185,7 @@ class GetData():
         self.database = database_info_dict['database']
         self.schema = database_info_dict['schema']
         self.tablename = database_info_dict['tablename']
+        self.rdsData = None
 
 
 
@@ -86,7 +206,10 @@ class GetData():
 
         """
         
-        rdsData = boto3.client('rds-data')
+        # One client is shared by all queries (and threads), built when needed
+        if self.rdsData is None:
+            self.rdsData = boto3.client('rds-data')
+        rdsData = self.rdsData
 
         response = rdsData.execute_statement(resourceArn =self.cluster_arn,
                                              includeResultMetadata =  True,
@@ -143,8 +266,11 @@ class GetData():
 
         """
         
-        scrape_metadata_query = '''SELECT DISTINCT SUBSTRING(id, 8) 
-                                    FROM reddit.RedditPostsData'''
+        # Scrape tags are indexed, so this needn't scan the whole table
+        scrape_metadata_query = '''SELECT DISTINCT scrape_tag 
+                                    FROM {}.{}'''.format(self.schema,
+                                                         self.tablename
+                                                        )
         response = self.make_sql_query(scrape_metadata_query)
         
         return [list(line[0].values())[0] for line in response['records']] 
@@ -170,33 +296,195 @@ class GetData():
 
         """
         
+        # Not tuple(...), which would leave a trailing comma for a single tag
+        tags = ', '.join("'{}'".format(tag) for tag in set_of_ids_to_query)
+        
         SQL_query_string = ("""SELECT {} 
                                FROM {}.{} 
-                               WHERE SUBSTRING(id,8) in {}"""
+                               WHERE scrape_tag in ({})"""
                                .format(self.define_features(),
                                        self.schema,
                                        self.tablename,
-                                       tuple(set_of_ids_to_query)
+                                       tags
                                        ))
         return SQL_query_string
 
 
 
 
-    def get_all_data(self, num_in_query_block = 16):
+    def get_scrape_tag_counts(self):
+        """
+        Retrieve the number of rows labelled with each scrape metadata tag, so
+        that tags can be grouped in to queries of a similar number of rows.
+
+        Returns
+        -------
+        tag_counts : dict
+            Keys are scrape metadata tags, values are the number of rows with
+            that tag.
+
+        """
+        
+        tag_counts_query = """SELECT scrape_tag, COUNT(*)
+                              FROM {}.{}
+                              GROUP BY scrape_tag""".format(self.schema,
+                                                             self.tablename
+                                                            )
+        response = self.make_sql_query(tag_counts_query)
+        
+        return {list(line[0].values())[0]: list(line[1].values())[0]
+                for line in response['records']
+               }
+
+
+
+
+    def plan_query_blocks(self, tag_counts, max_rows_per_block = 2000):
+        """
+        Group the scrape metadata tags in to blocks to be queried together,
+        each block holding at most max_rows_per_block rows (unless a single tag
+        has more rows than that, in which case it gets its own block).
+
+        Parameters
+        ----------
+        tag_counts : dict
+            Keys are scrape metadata tags, values are the number of rows with
+            that tag, see get_scrape_tag_counts.
+        max_rows_per_block : int, default=2000
+            The most rows to be requested by one query.
+
+        Returns
+        -------
+        blocks : list
+            List of lists, each holding the tags of one query block.
+
+        """
+        
+        blocks = []
+        block = []
+        block_rows = 0
+        for tag in sorted(tag_counts):
+            if block and (block_rows + tag_counts[tag] > max_rows_per_block):
+                blocks.append(block)
+                block = []
+                block_rows = 0
+            block.append(tag)
+            block_rows += tag_counts[tag]
+        if block:
+            blocks.append(block)
+        
+        return blocks
+
+
+
+
+    def query_block(self, set_of_ids_to_query, max_splits = 6):
+        """
+        Query all rows with the given scrape metadata tags. If the response is
+        too large for AWS then the block is split in half, and each half
+        queried separately.
+
+        Parameters
+        ----------
+        set_of_ids_to_query : list
+            List of strings, the scrape metadata tags to be queried.
+        max_splits : int, default=6
+            The most times the block may be halved, so that one block makes
+            at most 2**(max_splits + 1) - 1 queries.
+
+        Raises
+        ------
+        ClientError
+            The query failed for any reason other than the response size, or
+            the response was still too large after max_splits halvings (or
+            for a single tag).
+
+        Returns
+        -------
+        frames : list
+            List of pandas.DataFrames, the rows returned by each query made.
+
+        """
+        
+        try:
+            response = self.make_sql_query(
+                                self.build_get_data_query(set_of_ids_to_query)
+                                )
+        except ClientError as e:
+            if ((not response_too_large(e))
+                or len(set_of_ids_to_query) == 1
+                or max_splits == 0
+               ):
+                raise
+            half = len(set_of_ids_to_query)//2
+            return (self.query_block(set_of_ids_to_query[:half],
+                                     max_splits - 1,
+                                     )
+                    + self.query_block(set_of_ids_to_query[half:],
+                                       max_splits - 1,
+                                       )
+                   )
+        
+        return [self.response_to_frame(response)]
+
+
+
+
+    def response_to_frame(self, response):
+        """
+        Convert a query response to a dataframe, column-by-column. Each column
+        is decoded straight in to a numpy array of the type given by the
+        column metadata, see decode_column.
+
+        Parameters
+        ----------
+        response : dict
+            Dictionary from database containing both the query response and the
+            metadata for the query, see make_sql_query.
+
+        Returns
+        -------
+        df : pandas.DataFrame
+            The rows returned by the query.
+
+        """
+        
+        records = response['records']
+        
+        columns = {}
+        for col_num, column in enumerate(response['columnMetadata']):
+            columns[column['name']] = decode_column(records,
+                                                    col_num,
+                                                    column.get('typeName', ''),
+                                                    )
+        
+        return pd.DataFrame(columns)
+
+
+
+
+    def get_all_data(self, num_in_query_block = None, max_workers = 8,
+                     max_rows_per_block = 2000
+                     ):
         """
         Pulls all current data database, as controlled by the features() string
-        which is input in to the SELECT statement. Iterates over all sets of
-        scrape metadata tags, ensuring that each individual call stays beneath
-        the AWS response size.
+        which is input in to the SELECT statement. The table is split in to
+        blocks of scrape metadata tags, ensuring that each individual call
+        stays beneath the AWS response size, and the blocks are queried
+        concurrently.
 
         Parameters
         ----------
-        num_in_query_block : int, default=16
+        num_in_query_block : int, default=None
             The number of unique scrape metadata tags to be included in each
-            individual query. More tags means fewer queries, but more tags also
-            increases the response size. Set largely by trial and error. If 
-            AWS (via boto3) returns an exception, drop this value.
+            individual query. The default is None, instead group the tags by
+            the number of rows they hold (see max_rows_per_block).
+        max_workers : int, default=8
+            The number of queries to be made at once.
+        max_rows_per_block : int, default=2000
+            The most rows to be requested by one query, when grouping the tags
+            by their number of rows. Blocks which still exceed the AWS
+            response size are split in half automatically.
 
         Returns
         -------
@@ -205,39 +493,175 @@ class GetData():
 
         """
         
-        scrape_metadata = self.get_scrape_metadata()
+        if num_in_query_block is None:
+            blocks = self.plan_query_blocks(self.get_scrape_tag_counts(),
+                                            max_rows_per_block,
+                                            )
+        else:
+            scrape_metadata = self.get_scrape_metadata()
+            blocks = [scrape_metadata[lower_idx:lower_idx + num_in_query_block]
+                      for lower_idx in range(0, len(scrape_metadata),
+                                             num_in_query_block
+                                             )
+                     ]
         
-        num_of_ids = len(scrape_metadata)
-        query_block_idxs = np.arange(0, num_of_ids, num_in_query_block)
+        frames = self.query_blocks(blocks, max_workers)
+        df = pd.concat(frames, ignore_index = True)
+    
+        return df
+
+
+
+
+    def query_blocks(self, blocks, max_workers = 8):
+        """
+        Query many blocks of scrape metadata tags concurrently, see
+        query_block.
+
+        Parameters
+        ----------
+        blocks : list
+            List of lists, each holding the tags of one query block.
+        max_workers : int, default=8
+            The number of queries to be made at once.
+
+        Returns
+        -------
+        frames : list
+            List of pandas.DataFrames, the rows returned by each query made, in
+            the same order as the blocks.
+
+        """
         
+        frames = []
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            futures = [executor.submit(self.query_block, block)
+                       for block in blocks
+                      ]
+            # Keep the blocks in order, whichever finishes first
+            for block_num, future in enumerate(futures):
+                frames += future.result()
+                if (block_num + 1)%5 == 0:
+                    print('Block {} of {} completed.'.format(block_num + 1,
+                                                             len(blocks)
+                                                            ))
         
-        build_query = self.build_get_data_query
-        make_query = self.make_sql_query
+        return frames
+
+
+
+
+    def sync_partitions(self, data_directory = os.path.join('.','data'),
+                        max_workers = 8, max_rows_per_block = 2000
+                        ):
+        """
+        Bring the local copy of the table up to date. Rows are kept on disk in
+        one parquet file per scrape metadata tag. A scrape is usually loaded in
+        to the database all at once, but a tag may still gain rows later (e.g.
+        a file from the error folder which is loaded again), so the number of
+        rows held by each file is checked against the database: only the tags
+        which have no file yet, or whose file holds a different number of rows,
+        are queried. Their files are written whole, replacing any old file.
+
+        Parameters
+        ----------
+        data_directory : str, default='./data'
+            The directory where data is located, relative to current working
+            directory. Partitions are kept in its 'partitions' subdirectory.
+        max_workers : int, default=8
+            The number of queries to be made at once, see get_all_data.
+        max_rows_per_block : int, default=2000
+            The most rows to be requested by one query, see get_all_data.
+
+        Returns
+        -------
+        new_tags : list
+            The scrape metadata tags which were added or replaced.
+
+        """
+        
+        # pandas needs pyarrow to write the partitions in any case
+        import pyarrow.parquet as pq
+        
+        partition_directory = os.path.join(data_directory, 'partitions')
+        os.makedirs(partition_directory, exist_ok = True)
+        
+        # The row counts are read from the file footers, not the rows
+        local_counts = {os.path.splitext(fname)[0]:
+                        pq.read_metadata(os.path.join(partition_directory,
+                                                      fname
+                                                      )).num_rows
+                        for fname in os.listdir(partition_directory)
+                        if fname.endswith('.parquet')
+                       }
+        new_tag_counts = {tag: count for tag, count
+                          in self.get_scrape_tag_counts().items()
+                          if local_counts.get(tag) != count
+                         }
+        num_changed = sum(tag in local_counts for tag in new_tag_counts)
+        print('{} scrape tags stored, {} new, {} changed'.format(
+                                            len(local_counts),
+                                            len(new_tag_counts) - num_changed,
+                                            num_changed,
+                                            ))
+        if len(new_tag_counts) == 0:
+            return []
+        
+        blocks = self.plan_query_blocks(new_tag_counts, max_rows_per_block)
+        df = pd.concat(self.query_blocks(blocks, max_workers),
+                       ignore_index = True
+                      )
+        
+        # The ID is the Reddit ID followed by the scrape tag
+        tags = df['id'].str.split('_', n = 1).str[1]
+        for tag, partition in df.groupby(tags, sort = False):
+            fstring = os.path.join(partition_directory, tag + '.parquet')
+            # Write then rename, so a partition is never left half-written
+            partition.to_parquet(fstring + '.tmp', index = False)
+            os.replace(fstring + '.tmp', fstring)
+        
+        return list(new_tag_counts.keys())
+
+
+
+
+    def load_partitions(self, data_directory = os.path.join('.','data')):
+        """
+        Load every locally stored partition, see sync_partitions.
+
+        Parameters
+        ----------
+        data_directory : str, default='./data'
+            The directory where data is located, relative to current working
+            directory.
+
+        Returns
+        -------
+        df : pandas.DataFrame
+            A dataframe containing all data stored locally. If there is none
+            then the dataframe is empty, with the queried columns.
+
+        """
+        
+        partition_directory = os.path.join(data_directory, 'partitions')
+        if os.path.isdir(partition_directory):
+            fnames = sorted(fname for fname in os.listdir(partition_directory)
+                            if fname.endswith('.parquet')
+                           )
+        else:
+            fnames = []
+        
+        if len(fnames) == 0:
+            return pd.DataFrame(columns = [feature.strip() for feature
+                                           in self.define_features().split(',')
+                                          ])
+        
+        frames = [pd.read_parquet(os.path.join(partition_directory, fname))
+                  for fname in fnames
+                 ]
+        
+        df = pd.concat(frames, ignore_index = True)
         
-        all_data = []
-        for block_num, lower_idx in enumerate(query_block_idxs):
-            upper_idx = lower_idx + num_in_query_block
-            set_of_ids_to_query = scrape_metadata[lower_idx:upper_idx]
-            
-            sql = build_query(set_of_ids_to_query)
-            response = make_query(sql)
-            new_data = [[list(feature.values())[0] for feature in record] 
-                        for record in response['records']
-                        ]
-            all_data += new_data
-            
-            if block_num == 0:
-                col_names = [column['name'] for column 
-                             in response['columnMetadata']
-                             ]
-            if (block_num + 1)%5 == 0:
-                print('Block {} of {} completed.'.format(block_num + 1,
-                                                         len(query_block_idxs)
-                                                       ))
-                
-        df = pd.DataFrame(all_data)
-        df.columns = col_names
-    
         return df
 
 
@@ -276,7 +700,7 @@ class GetData():
 
 
     def data_to_disk(self, data_directory = os.path.join('.','data'),
-                     num_in_query_block = 16
+                     num_in_query_block = None
                      ):
         """
         Pull data from database and save data to disk.
@@ -286,11 +710,10 @@ class GetData():
         data_directory : str, default='./data'
             The directory where the data is to be saved, relative to current
             working directory.
-        num_in_query_block : int, default=16
+        num_in_query_block : int, default=None
             The number of unique scrape metadata tags to be included in each
-            individual query. More tags means fewer queries, but more tags also
-            increases the response size. Set largely by trial and error. If 
-            AWS (via boto3) returns an exception, drop this value.
+            individual query. The default is None, size the queries
+            automatically, see get_all_data.
 
         Returns
         -------
@@ -308,25 +731,33 @@ class GetData():
 
 
     def load_data(self, data_directory = os.path.join('.','data'),
-                     num_in_query_block = 16, fstring = ''
+                     num_in_query_block = None, fstring = '', incremental = False,
+                     max_workers = 8
                      ):
         """
         Load data if it exists, otherwise query the database and save results
-        to disk, then load.
+        to disk, then load. If incremental, the local copy is instead kept in
+        partitions, and only rows scraped since the last load are queried (see
+        sync_partitions).
 
         Parameters
         ----------
         data_directory : str, default='./data'
-            DESCRIPTION. The default is os.path.join('.','data').
-        num_in_query_block : int, default=16
+            The directory where data is located, relative to current working
+            directory.
+        num_in_query_block : int, default=None
             The number of unique scrape metadata tags to be included in each
-            individual query. More tags means fewer queries, but more tags also
-            increases the response size. Set largely by trial and error. If 
-            AWS (via boto3) returns an exception, drop this value.
+            individual query. The default is None, size the queries
+            automatically, see get_all_data. Not used when incremental.
         fstring : str, default=''
             An alternate fstring (directory and filename) to be loaded, if it
             exists. Currently cannot build the file unless it corresponds to 
             todays data.
+        incremental : bool, default=False
+            Whether to sync and load the local partitions. If False (or if an
+            fstring is given), load a whole-table file pulled today.
+        max_workers : int, default=8
+            The number of queries to be made at once.
 
         Raises
         ------
@@ -340,6 +771,10 @@ class GetData():
             features used in SELECT statement.
 
         """
+        if incremental and (len(fstring) == 0):
+            self.sync_partitions(data_directory, max_workers)
+            return self.load_partitions(data_directory)
+        
         if len(fstring) == 0: 
             fstring = self.build_fstring(data_directory)       
         
@@ -351,7 +786,7 @@ class GetData():
                file_loaded = True
             except:
                 print('Attempting to query database to build data file.')    
-                self.data_to_disk()
+                self.data_to_disk(data_directory, num_in_query_block)
                 counter += 1
             
             if counter >= 3:
@@ -522,13 +957,7 @@ class PrepData(BaseEstimator, TransformerMixin):
         df = X.copy()
         
         # Build out some new features
-        num_gilds = X['gold_awarded'] + X['platinum_awarded']
-        gilded = num_gilds.apply(lambda x: 1 if x > 0 else 0)
-
-        weekday = X['created_utc'].apply(lambda x: dt.utcfromtimestamp(x).weekday() )
-        hour = X['created_utc'].apply(lambda x: dt.utcfromtimestamp(x).hour )
-
-        scrape_time = [ID[-4:] for ID in X['id']]
+        gilded, weekday, hour, scrape_time = derive_features(X)
 
         df['gilded'] = gilded.astype('bool')
         df['weekday'] = weekday
@@ -547,6 +976,219 @@ class PrepData(BaseEstimator, TransformerMixin):
 
 
 
+def category_fold_stats(codes, num_categories, target, fold_ids = None,
+                        num_folds = 1
+                        ):
+    """
+    Count the rows and sum the target within each category (and fold), the
+    sufficient statistics for target encoding.
+
+    Parameters
+    ----------
+    codes : array
+        The category code of each row, as from pd.factorize; missing values
+        have code -1 and are not counted.
+    num_categories : int
+        The number of distinct categories.
+    target : array
+        The target value of each row.
+    fold_ids : array, default = None
+        The fold number of each row. The default is None, all rows are in a
+        single fold.
+    num_folds : int, default = 1
+        The number of folds.
+
+    Returns
+    -------
+    counts : array
+        Shape (num_folds, num_categories), the number of rows in each
+        category.
+    sums : array
+        Shape (num_folds, num_categories), the sum of the target values of the
+        rows in each category.
+
+    """
+    
+    valid = codes >= 0
+    bins = codes[valid]
+    if fold_ids is not None:
+        bins = fold_ids[valid]*num_categories + bins
+    
+    size = num_folds*num_categories
+    counts = np.bincount(bins, minlength = size)
+    sums = np.bincount(bins, weights = target[valid], minlength = size)
+    
+    return (counts.reshape(num_folds, num_categories),
+            sums.reshape(num_folds, num_categories)
+            )
+
+
+
+
+class TargetFoldStats():
+    """
+    Sufficient statistics for target encoding, split by cross-validation fold:
+    for each feature, the number of rows and the sum of the target within each
+    category of each fold. The category code of every row is kept as well.
+    
+    These are computed once for the whole data set. The statistics of any set
+    of whole folds are then found by adding (or subtracting) per-fold arrays,
+    so a target encoder given these statistics can be refit for every
+    cross-validation split, and for every set of features being compared,
+    without aggregating (or even hashing) the data again. The statistics are
+    read-only and are shared, rather than copied, when an estimator holding
+    them is cloned.
+    """
+    
+    def __init__(self, X, y, features, folds):
+        """
+        Compute the statistics.
+
+        Parameters
+        ----------
+        X : dataframe
+            The full data set, its index must be unique. Estimators using the
+            statistics recognise rows by these index labels, and check that
+            the values of the features are unchanged (see row_codes).
+        y : series or array
+            The target values, binary or boolean.
+        features : list
+            List of strings, the names of the features to be target-encoded.
+        folds : list
+            List of (train, test) pairs of row positions, as returned by the
+            split method of a cross-validation splitter. Every row must be in
+            exactly one test set.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        if not X.index.is_unique:
+            raise ValueError('The index of X must be unique')
+        
+        target = np.asarray(y, dtype = float)
+        
+        fold_ids = np.full(len(target), -1)
+        self.num_folds = 0
+        for fold_num, (_, fold_rows) in enumerate(folds):
+            fold_ids[fold_rows] = fold_num
+            self.num_folds += 1
+        if (fold_ids < 0).any():
+            raise ValueError('Every row must be in the test set of a fold')
+        
+        self.positions = pd.Series(np.arange(len(target)), index = X.index)
+        self.fold_ids = fold_ids
+        self.fold_sizes = np.bincount(fold_ids, minlength = self.num_folds)
+        self.fold_target_sums = np.bincount(fold_ids,
+                                            weights = target,
+                                            minlength = self.num_folds
+                                            )
+        
+        self.categories = {}
+        self.codes = {}
+        self.counts = {}
+        self.sums = {}
+        for feature in features:
+            codes, categories = pd.factorize(X[feature])
+            self.categories[feature] = pd.Index(categories)
+            self.codes[feature] = codes
+            self.counts[feature], self.sums[feature] = (
+                category_fold_stats(codes, len(categories), target,
+                                    fold_ids, self.num_folds
+                                    ))
+    
+    
+    
+    
+    def __deepcopy__(self, memo):
+        
+        return self
+    
+    
+    
+    
+    def row_positions(self, X, whole_folds = False):
+        """
+        Find the position of each row of X within the data the statistics
+        were computed from.
+
+        Parameters
+        ----------
+        X : dataframe
+            Rows of the full data set, identified by index label.
+        whole_folds : bool, default = False
+            Whether X must be made up of whole folds.
+
+        Returns
+        -------
+        positions : array or None
+            The position of each row of X, or None if X contains rows which
+            are not in the data set (or, if whole_folds is set, contains only
+            part of some fold).
+
+        """
+        
+        positions = self.positions.reindex(X.index)
+        if positions.isna().any():
+            return None
+        positions = positions.to_numpy(dtype = int)
+        
+        if whole_folds:
+            rows_per_fold = np.bincount(self.fold_ids[positions],
+                                        minlength = self.num_folds
+                                        )
+            in_X = rows_per_fold > 0
+            if ((not X.index.is_unique)
+                or (rows_per_fold[in_X] != self.fold_sizes[in_X]).any()):
+                return None
+        
+        return positions
+    
+    
+    
+    
+    def row_codes(self, X, feature, positions):
+        """
+        Take the category codes of the rows of X from the statistics, checking
+        that the values of the feature are still those the statistics were
+        computed from. Matching rows by index label alone is not enough, the
+        same labels may hold other data (e.g. a re-indexed or altered frame).
+
+        Parameters
+        ----------
+        X : dataframe
+            Rows of the full data set, see row_positions.
+        feature : str
+            The name of the feature.
+        positions : array
+            The position of each row of X, as returned by row_positions.
+
+        Returns
+        -------
+        codes : array or None
+            The category code of each row of X, or None if any value of the
+            feature differs from the statistics.
+
+        """
+        
+        codes = self.codes[feature][positions]
+        values = X[feature].to_numpy()
+        
+        is_missing = codes < 0
+        if (pd.isna(values) != is_missing).any():
+            return None
+        
+        categories = self.categories[feature].to_numpy()
+        if (categories[codes[~is_missing]] != values[~is_missing]).any():
+            return None
+        
+        return codes
+
+
+
+
 class MyTargetEncoder(BaseEstimator, TransformerMixin):
     """
     Target-encode the passed feature columns. Allow the encoding values to be
@@ -559,56 +1201,289 @@ class MyTargetEncoder(BaseEstimator, TransformerMixin):
     are less affected.
     
     Setting weight to 0 is equivalent to 'vanilla' target encoding.
+    
+    The categories of each feature are stored as an index, alongside an array
+    holding the encoded value of each category; values which were not seen
+    during fitting (or are missing) are encoded with the overall-target
+    average.
+    
+    If cv is set then fit_transform returns out-of-fold encodings: the rows
+    are split in to cv folds and each fold is encoded using only the target
+    values of the other folds, so that a row's own target does not leak in to
+    its encoding. The encoder itself (used by transform) is always fit to all
+    of the rows.
+    
+    If stats (a TargetFoldStats) is set, and the rows passed to fit are made
+    up of whole folds of those statistics (with unchanged values), then the
+    encoder is fit from the precomputed statistics rather than from the data,
+    and fit_transform uses their folds (in place of cv) for the out-of-fold
+    encodings; transform also takes the category codes of rows in the
+    statistics from them. Otherwise the encoder is fit from the data as usual.
     """
     
-    def __init__(self, how = 'vanilla', weight = 1):
+    def __init__(self, how = 'vanilla', weight = 1, cv = None,
+                 random_state = None, stats = None
+                 ):
         
         self.how = how
         self.weight = weight
+        self.cv = cv
+        self.random_state = random_state
+        self.stats = stats
+        
+        
         
-    def fit(self, X, y):
         
-        df = X.join(y)
+    def _encode_values(self, counts, sums):
+        """
+        Convert category counts and target sums in to encoded values,
+        categories with no rows are encoded with the overall-target average.
+
+        Parameters
+        ----------
+        counts : array
+            The number of rows in each category.
+        sums : array
+            The sum of the target values of the rows in each category.
+
+        Returns
+        -------
+        array
+            The encoded value of each category.
+
+        """
         
         if self.how == 'additive_smoothing':
-            overall_mean = y.mean()
+            return (sums + self.weight*self.prior)/(counts + self.weight)
+        
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            means = sums/counts
+            
+        return np.where(counts > 0, means, self.prior)
+    
+    
+    
+    
+    def _out_of_fold_lookup(self, fold_counts, fold_sums):
+        """
+        Encode every category for the rows of each fold, using the statistics
+        of all of the other folds.
+
+        Parameters
+        ----------
+        fold_counts : array
+            Shape (num_folds, num_categories), the number of rows in each
+            category of each fold.
+        fold_sums : array
+            Shape (num_folds, num_categories), the sum of the target values of
+            the rows in each category of each fold.
+
+        Returns
+        -------
+        lookup : array
+            Shape (num_folds, num_categories + 1), the encoded values for the
+            rows of each fold. The last column holds the overall-target
+            average, for rows with category code -1.
+
+        """
+        
+        # Statistics of the other folds are the totals less this fold's
+        out_counts = fold_counts.sum(axis = 0) - fold_counts
+        out_sums = fold_sums.sum(axis = 0) - fold_sums
+        
+        lookup = np.empty((fold_counts.shape[0], fold_counts.shape[1] + 1))
+        lookup[:, :-1] = self._encode_values(out_counts, out_sums)
+        lookup[:, -1] = self.prior
+        
+        return lookup
+    
+    
+    
+    
+    def _fold_stats(self, X, y):
+        """
+        Set the overall-target average and the categories of each feature, and
+        gather the per-fold statistics of each feature of X, either from stats
+        or from the data itself.
+
+        Parameters
+        ----------
+        X : dataframe
+            The features to be encoded.
+        y : series or array
+            The target values.
+
+        Returns
+        -------
+        fold_ids : array or None
+            The fold number of each row of X, None if fit_transform is not to
+            be out-of-fold (neither stats nor cv apply).
+        all_codes : dict
+            Keys are feature names, values are arrays holding the category
+            code of each row of X.
+        all_stats : dict
+            Keys are feature names, values are the (fold_counts, fold_sums)
+            of the feature, see category_fold_stats. Folds which are not in X
+            have zero counts.
+
+        """
         
-        self.all_means = {}
         self.features = list(X.columns)
-        for feature in self.features:
+        self.categories = {}
+        all_codes = {}
+        all_stats = {}
+        
+        positions = None
+        self.fit_from_stats = ((self.stats is not None)
+                               and all(feature in self.stats.categories
+                                       for feature in self.features
+                                       ))
+        if self.fit_from_stats:
+            positions = self.stats.row_positions(X, whole_folds = True)
+            self.fit_from_stats = positions is not None
+        if self.fit_from_stats:
+            for feature in self.features:
+                all_codes[feature] = self.stats.row_codes(X, feature,
+                                                          positions
+                                                          )
+            self.fit_from_stats = all(codes is not None
+                                      for codes in all_codes.values()
+                                      )
+        
+        if self.fit_from_stats:
+            # X is made up of whole folds, use the precomputed statistics
+            fold_ids = self.stats.fold_ids[positions]
+            in_X = np.bincount(fold_ids, minlength = self.stats.num_folds) > 0
+            self.prior = (self.stats.fold_target_sums[in_X].sum()
+                          /self.stats.fold_sizes[in_X].sum()
+                          )
+            
+            for feature in self.features:
+                self.categories[feature] = self.stats.categories[feature]
+                all_stats[feature] = (self.stats.counts[feature]*in_X[:, None],
+                                      self.stats.sums[feature]*in_X[:, None]
+                                      )
             
-            feature_replace_dict = {}
-            agg = df.groupby(feature).agg(['count', 'mean']).iloc[:,-2:]
-            means = agg.iloc[:,-1]
-            count = agg.iloc[:,-2]
-
-            if self.how == 'additive_smoothing':
-                new_means = [(count[j]*means[j] + self.weight*overall_mean)/
-                             (count[j] + self.weight) for j, _ 
-                             in enumerate(means)
-                            ]
-                means_index = means.index
-                means = pd.Series(new_means, index = means_index)
+            return fold_ids, all_codes, all_stats
+        
+        target = np.asarray(y, dtype = float)
+        self.prior = target.mean()
+        
+        fold_ids = None
+        num_folds = 1
+        if self.cv:
+            num_folds = self.cv
+            fold_ids = np.empty(len(target), dtype = int)
+            folds = KFold(n_splits = self.cv, shuffle = True,
+                          random_state = self.random_state
+                          )
+            for fold_num, (_, fold_rows) in enumerate(folds.split(X)):
+                fold_ids[fold_rows] = fold_num
+        
+        for feature in self.features:
+            codes, categories = pd.factorize(X[feature])
+            self.categories[feature] = pd.Index(categories)
+            all_codes[feature] = codes
+            all_stats[feature] = category_fold_stats(codes, len(categories),
+                                                     target, fold_ids,
+                                                     num_folds
+                                                     )
             
-            feature_replace_dict = {}
-            for value in means.index:
-                feature_replace_dict[value] = means.loc[value]
-                
-            self.all_means[feature] = feature_replace_dict
+        return fold_ids, all_codes, all_stats
+    
+    
+    
+    
+    def _set_encodings(self, all_stats):
+        """
+        Encode the categories of each feature using the statistics of all of
+        the folds, see _fold_stats.
+
+        Parameters
+        ----------
+        all_stats : dict
+            Keys are feature names, values are (fold_counts, fold_sums).
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.encodings = {}
+        for feature, (fold_counts, fold_sums) in all_stats.items():
+            counts = fold_counts.sum(axis = 0)
+            sums = fold_sums.sum(axis = 0)
+            self.encodings[feature] = self._encode_values(counts, sums)
+    
+    
+    
+    
+    def fit(self, X, y):
+        
+        _, _, all_stats = self._fold_stats(X, y)
+        self._set_encodings(all_stats)
             
         return self
+    
+    
+    
+    
+    @property
+    def all_means(self):
+        """
+        The encoded values as a dictionary for each feature, keyed by
+        category.
+        """
+        
+        return {feature: dict(zip(self.categories[feature],
+                                  self.encodings[feature]
+                                  ))
+                for feature in self.features
+               }
         
     
+    
+    
     def transform(self, X, y = None):
         
         df = X.copy()
         
+        positions = None
+        if self.fit_from_stats:
+            positions = self.stats.row_positions(X)
+        
         for feature in self.features:
-            df[feature] = X[feature].replace(self.all_means[feature])
+            # Unseen values get code -1, which takes the appended prior
+            codes = None
+            if positions is not None:
+                codes = self.stats.row_codes(X, feature, positions)
+            if codes is None:
+                codes = self.categories[feature].get_indexer(X[feature])
+            lookup = np.append(self.encodings[feature], self.prior)
+            df[feature] = np.take(lookup, codes)
         
         return df
     
     
+    
+    
+    def fit_transform(self, X, y, **fit_params):
+        
+        fold_ids, all_codes, all_stats = self._fold_stats(X, y)
+        self._set_encodings(all_stats)
+        
+        if fold_ids is None:
+            return self.transform(X)
+        
+        df = X.copy()
+        for feature in self.features:
+            lookup = self._out_of_fold_lookup(*all_stats[feature])
+            df[feature] = lookup[fold_ids, all_codes[feature]]
+            
+        return df
+    
+    
 
 
 
@@ -617,19 +1492,37 @@ class MultipurposeEncoder(BaseEstimator, TransformerMixin):
     """
     Encode the passed columns, allow user to specify which columns (if any)
     should be one-hot-encoded and which should be target-encoded.
+    
+    The target encoding of the rows passed to fit_transform is out-of-fold if
+    target_cv or target_stats is set, see MyTargetEncoder. target_random_state
+    seeds the shuffling of the target_cv folds.
+    
+    By default the output is a dataframe, with one (sparse) column per
+    category replacing each one-hot-encoded feature. If sparse_output is set
+    the output is instead a single scipy CSR matrix, so that memory scales
+    with the number of non-zero values rather than rows times categories; its
+    column names are held in feature_names. Every feature must then be
+    numeric (or boolean) once encoded, dataframe columns which are already
+    sparse (such as those from My_tfidf) are kept sparse.
     """
     
     def __init__(self, ohe_feats = [], target_feats = [],
                  target_how = 'vanilla', target_weight = 1,
+                 target_cv = None, target_random_state = None,
+                 target_stats = None, sparse_output = False
                  ):
         
         self.ohe_feats = ohe_feats
         self.target_feats = target_feats
         self.target_how = target_how
         self.target_weight = target_weight
+        self.target_cv = target_cv
+        self.target_random_state = target_random_state
+        self.target_stats = target_stats
+        self.sparse_output = sparse_output
 
    
-    def fit(self, X, y):
+    def _fit(self, X, y):
         
 # =============================================================================
 #         if len(self.target_feat_name) > 0:
@@ -646,40 +1539,151 @@ class MultipurposeEncoder(BaseEstimator, TransformerMixin):
         if len(self.ohe_feats) > 0:
             self.ohenc = OneHotEncoder(drop = 'if_binary')
             self.ohenc.fit(X[self.ohe_feats])
+        
+        target_df = None
         if len(self.target_feats) > 0:
             self.target_enc = MyTargetEncoder(how = self.target_how,
-                                              weight = self.target_weight
+                                              weight = self.target_weight,
+                                              cv = self.target_cv,
+                                              random_state = self.target_random_state,
+                                              stats = self.target_stats
                                              )
-            self.target_enc.fit(X[self.target_feats], target)
-
-            self.replacement_dictionary = self.target_enc.all_means
+            target_df = self.target_enc.fit_transform(X[self.target_feats],
+                                                      target
+                                                      )
 
+        return target_df
+    
+    
+    
+    def fit(self, X, y):
+        
+        self._fit(X, y)
+        
         return self
     
     
     
+    def fit_transform(self, X, y, **fit_params):
+        
+        target_df = self._fit(X, y)
+        
+        return self._encode(X, target_df)
+    
+    
+    
+    @property
+    def replacement_dictionary(self):
+        
+        return self.target_enc.all_means
+    
+    
+    
     def transform(self, X, y = None):
         
+        target_df = None
+        if len(self.target_feats) > 0:
+            target_df = self.target_enc.transform(X[self.target_feats])
+        
+        return self._encode(X, target_df)
+    
+    
+    
+    def _encode(self, X, target_df):
+        
+        if self.sparse_output:
+            return self._encode_sparse(X, target_df)
+        
         df = X.copy()
         
         if len(self.ohe_feats) > 0:  
             ohenc_array = self.ohenc.transform(X[self.ohe_feats])
-            ohe_vars_names = self.ohenc.get_feature_names(self.ohe_feats)
+            ohe_vars_names = self._ohe_feature_names()
             
             ohenc_df = pd.DataFrame.sparse.from_spmatrix(ohenc_array,
                                                          index = X.index
                                                          )
             ohenc_df.columns = ohe_vars_names
             
-            df[self.ohe_feats] = ohenc_df
+            # The category columns replace the encoded features
+            df = pd.concat([df.drop(columns = self.ohe_feats), ohenc_df],
+                           axis = 1
+                           )
             
-        if len(self.target_feats) > 0:
-            target_df = self.target_enc.transform(X[self.target_feats])
-        
+        if target_df is not None:
             df[self.target_feats] = target_df
         
         #print('All columns: ', list(df.columns))
         return df
+    
+    
+    
+    def _ohe_feature_names(self):
+        
+        # sklearn renamed get_feature_names (removed in 1.2) in version 1.0
+        if hasattr(self.ohenc, 'get_feature_names_out'):
+            return list(self.ohenc.get_feature_names_out(self.ohe_feats))
+        
+        return list(self.ohenc.get_feature_names(self.ohe_feats))
+    
+    
+    
+    def _encode_sparse(self, X, target_df):
+        """
+        Assemble the encoded features in to a single sparse matrix, and set
+        feature_names to its column names.
+
+        Parameters
+        ----------
+        X : dataframe
+            The features to be encoded.
+        target_df : dataframe or None
+            The target-encoded features, None if there are none.
+
+        Returns
+        -------
+        csr_matrix
+            The encoded features: the remaining dense features, then the
+            remaining sparse features, the one-hot categories and the
+            target-encoded features.
+
+        """
+        
+        other_feats = [feature for feature in X.columns
+                       if (feature not in self.ohe_feats)
+                       and (feature not in self.target_feats)
+                      ]
+        sparse_feats = [feature for feature in other_feats
+                        if isinstance(X[feature].dtype, pd.SparseDtype)
+                       ]
+        dense_feats = [feature for feature in other_feats
+                       if feature not in sparse_feats
+                      ]
+        
+        non_numeric = [feature for feature in dense_feats
+                       if not pd.api.types.is_numeric_dtype(X[feature])
+                      ]
+        if non_numeric:
+            raise ValueError('Features must be numeric for sparse output: '
+                             + ', '.join(non_numeric)
+                             )
+        
+        blocks = []
+        feature_names = dense_feats + sparse_feats
+        if dense_feats:
+            blocks.append(csr_matrix(X[dense_feats].to_numpy(dtype = float)))
+        if sparse_feats:
+            blocks.append(X[sparse_feats].sparse.to_coo().tocsr())
+        if len(self.ohe_feats) > 0:
+            blocks.append(self.ohenc.transform(X[self.ohe_feats]))
+            feature_names += self._ohe_feature_names()
+        if target_df is not None:
+            blocks.append(csr_matrix(target_df.to_numpy(dtype = float)))
+            feature_names += list(self.target_feats)
+        
+        self.feature_names = feature_names
+        
+        return hstack(blocks, format = 'csr')
 
 
 